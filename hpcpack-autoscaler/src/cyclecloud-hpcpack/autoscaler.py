@@ -1,19 +1,38 @@
 import os
 import json
-import math
+import signal
 import sys
+import threading
+import time
 import pathlib
 from typing import Any, Dict, List, Optional, Tuple
-from datetime import datetime, timedelta
+from datetime import datetime
 from subprocess import check_output, CalledProcessError
 import hpc.autoscale.hpclogging as logging
 from hpc.autoscale.node.node import Node
 from hpc.autoscale.node.nodemanager import NodeManager, new_node_manager
-from hpc.autoscale.results import DefaultContextHandler, register_result_handler, BootupResult, ShutdownResult
-from hpc.autoscale.util import partition, partition_single, load_config
+from hpc.autoscale.results import DefaultContextHandler, register_result_handler, ShutdownResult
+from hpc.autoscale.util import partition, load_config
 from .hpcpackdriver import HpcNode, HpcRestClient, GrowDecision
-from .commonutil import ci_equals, ci_find_one, ci_in, ci_notin, ci_interset, ci_lookup, make_dict, make_dict_single
-from .hpcnodehistory import HpcNodeHistory, NodeHistoryItem
+from .hpcpackasyncdriver import AsyncBackedHpcRestClient
+from .commonutil import CISet, ci_equals, ci_in, from_epoch, make_dict, make_dict_single, run_concurrently
+from .growforecast import new_grow_history
+from .headnodeguard import HeadNodeGuard, RoundDeadline, new_head_node_guard
+from .hpcnodehistory import HpcNodeHistory
+from .nodeidcache import NodeIdCache
+from .planexecutor import DEFAULT_APPLY_WORKERS, apply_plan
+from .roundlock import RoundLock, new_round_lock
+from .roundmetrics import RoundMetrics, new_round_metrics
+from .roundplan import IdleCheck, Plan, RoundInputs, allocate_round, check_idle, plan_round, recheck_idle
+
+# a round started every minute must be done before the next one starts
+DEFAULT_ROUND_BUDGET = 50
+# the seconds of the budget kept for the phases after a skippable phase
+DEFAULT_ROUND_RESERVE = 15
+# seconds a plan written by azhpcpack plan can be applied
+DEFAULT_PLAN_MAX_AGE = 300
+# the plan counts recorded under the idle_check phase
+IDLE_CHECK_COUNTS = ["candidates", "idle_nodes", "idle_unknown_nodes"]
 
 
 def autoscale_hpcpack(
@@ -21,24 +40,223 @@ def autoscale_hpcpack(
     ctx_handler: DefaultContextHandler = None,
     hpcpack_rest_client: Optional[HpcRestClient] = None,
     dry_run: bool = False,
+    node_history: Optional[HpcNodeHistory] = None,
+    node_mgr: Optional[NodeManager] = None,
+    plan: Optional[Plan] = None,
 ) -> None:
-
+    autoscale_config = config.get("autoscale") or {}
+    # "skip": a run that overlaps a running round exits, "coalesce": the running round runs once more when it is done
+    overlap = autoscale_config.get("overlap") or "skip"
+    round_lock = new_round_lock(config)
+    if round_lock is not None and not round_lock.acquire():
+        owner = round_lock.owner() or {}
+        round_lock.add_pending()
+        logging.warning("Skipping the round, the round of process {} started at {} is still running".format(
+            owner.get("pid"), from_epoch(owner.get("acquired"))))
+        round_metrics = new_round_metrics(config)
+        round_metrics.skip("overlapped the round of process {}".format(owner.get("pid")))
+        round_metrics.write()
+        return
+    try:
+        if not hpcpack_rest_client:
+            hpcpack_rest_client = new_rest_client(config)
+        round_metrics = _run_round(config, round_lock, ctx_handler, hpcpack_rest_client, dry_run, node_history, node_mgr, plan)
+        overlapped = round_metrics.counts.get("overlapping_runs", 0)
+        if overlapped > 0 and ci_equals(overlap, "coalesce"):
+            logging.info("{} runs overlapped the round, running a follow-up round".format(overlapped))
+            # the node manager of the first round holds the CycleCloud nodes and the allocations as they were
+            # before that round, the follow-up round fetches them again
+            _run_round(config, round_lock, ctx_handler, hpcpack_rest_client, dry_run, node_history, None)
+    finally:
+        if round_lock is not None:
+            round_lock.release()
+
+
+def _run_round(
+    config: Dict[str, Any],
+    round_lock: Optional[RoundLock],
+    ctx_handler: Optional[DefaultContextHandler],
+    hpcpack_rest_client: HpcRestClient,
+    dry_run: bool,
+    node_history: Optional[HpcNodeHistory],
+    node_mgr: Optional[NodeManager],
+    plan: Optional[Plan] = None,
+) -> RoundMetrics:
+    round_metrics = new_round_metrics(config)
+    autoscale_config = config.get("autoscale") or {}
+    deadline = RoundDeadline(autoscale_config.get("round_budget", DEFAULT_ROUND_BUDGET))
+    # the stats of a client kept between rounds are dumped and reset every round
+    rest_stats = getattr(hpcpack_rest_client, "stats", None)
+    if rest_stats is not None:
+        rest_stats.reset()
+    guard: Optional[HeadNodeGuard] = getattr(hpcpack_rest_client, "guard", None)
+    if guard is not None:
+        guard.start_round(deadline)
+    success = False
+    try:
+        _autoscale_hpcpack(config, round_metrics, deadline, guard, ctx_handler, hpcpack_rest_client, dry_run, node_history, node_mgr, plan)
+        success = True
+    finally:
+        round_metrics.finish(success)
+        if guard is not None:
+            round_metrics.set_round_count("rest_retries", guard.retries)
+            round_metrics.set_round_count("head_node_degraded", 1 if guard.breaker.degraded else 0)
+        if round_lock is not None:
+            round_metrics.set_round_count("overlapping_runs", round_lock.take_pending())
+        if deadline.expired:
+            logging.warning("The round took {:.1f}s, more than its budget of {}s".format(deadline.elapsed(), deadline.budget))
+        logging.info(round_metrics.summary())
+        if rest_stats is not None:
+            round_metrics.rest = rest_stats.snapshot()
+            for line in rest_stats.summary():
+                logging.info("REST {}".format(line))
+        round_metrics.write()
+    return round_metrics
+
+
+def plan_hpcpack(
+    config: Dict[str, Any],
+    ctx_handler: DefaultContextHandler = None,
+    hpcpack_rest_client: Optional[HpcRestClient] = None,
+    node_history: Optional[HpcNodeHistory] = None,
+    node_mgr: Optional[NodeManager] = None,
+) -> Plan:
+    """
+    Makes the plan of a round without applying it, the node history is not saved.
+    """
+    autoscale_config = config.get("autoscale") or {}
+    deadline = RoundDeadline(autoscale_config.get("round_budget", DEFAULT_ROUND_BUDGET))
+    round_metrics = new_round_metrics(config)
     if not hpcpack_rest_client:
         hpcpack_rest_client = new_rest_client(config)
+    guard: Optional[HeadNodeGuard] = getattr(hpcpack_rest_client, "guard", None)
+    if guard is not None:
+        guard.start_round(deadline)
+    # the grow decisions are recorded by the round that applies a plan
+    inputs = gather_round_inputs(config, round_metrics, deadline, ctx_handler, hpcpack_rest_client, node_history, node_mgr,
+                                 record_grow_decisions=False)
+    plan = make_plan(config, round_metrics, deadline, guard, ctx_handler, inputs, hpcpack_rest_client)
+    round_metrics.finish()
+    logging.info(round_metrics.summary())
+    return plan
+
+
+def apply_hpcpack(
+    config: Dict[str, Any],
+    plan_file: str,
+    ctx_handler: DefaultContextHandler = None,
+    dry_run: bool = False,
+) -> None:
+    """
+    Runs a round that applies the plan written by azhpcpack plan instead of making its own.
+    """
+    autoscale_config = config.get("autoscale") or {}
+    plan = Plan.read(plan_file)
+    # the idle checks and the node states the plan relies on get out of date
+    max_age = autoscale_config.get("plan_max_age") or DEFAULT_PLAN_MAX_AGE
+    age = (datetime.utcnow() - plan.created).total_seconds()
+    if age > max_age:
+        raise RuntimeError("The plan {} was made {:.0f}s ago, more than autoscale.plan_max_age ({}s), make a new one".format(plan_file, age, max_age))
+    logging.info(plan.summary())
+    autoscale_hpcpack(config, ctx_handler=ctx_handler, dry_run=dry_run, plan=plan)
+
+
+def prewarm_report(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The grow demand forecast for the next lead time, and the pre-warmed nodes of the node history:
+    those still waiting for their demand, those that ran jobs, the hits, and those shut down
+    before, the misses. Only the nodes the history still holds are counted, see also the
+    prewarm_hits and prewarm_misses counts of the round metrics.
+    """
+    grow_history = new_grow_history(config)
+    forecast = grow_history.forecast() if grow_history is not None else {}
+    items = [i for i in new_node_history(config).items if i.prewarm_ts is not None]
+    hits = len([i for i in items if i.prewarm_hit_ts is not None])
+    misses = len([i for i in items if i.stopped and i.prewarm_pending])
+    return {
+        "forecast": {grp: {"nodes": round(d.nodes_to_grow, 2), "cores": round(d.cores_to_grow, 2)} for grp, d in forecast.items()},
+        "pending": len([i for i in items if not i.stopped and i.prewarm_pending]),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+    }
+
+
+def skip_reason(
+    deadline: RoundDeadline,
+    guard: Optional[HeadNodeGuard],
+    reserve: float
+) -> Optional[str]:
+    # The phases the round can do without, the group tagging and the scale down, are skipped
+    # when the head node is degraded or when they would leave too little time for the rest
+    if guard is not None and guard.breaker.degraded:
+        return "the head node is degraded"
+    if deadline.remaining() < reserve:
+        return "{:.1f}s left of the round budget".format(deadline.remaining())
+    return None
+
+
+def _autoscale_hpcpack(
+    config: Dict[str, Any],
+    round_metrics: RoundMetrics,
+    deadline: RoundDeadline,
+    guard: Optional[HeadNodeGuard],
+    ctx_handler: Optional[DefaultContextHandler],
+    hpcpack_rest_client: HpcRestClient,
+    dry_run: bool,
+    node_history: Optional[HpcNodeHistory],
+    node_mgr: Optional[NodeManager],
+    plan: Optional[Plan] = None,
+) -> None:
+    autoscale_config = config.get("autoscale") or {}
+    round_reserve = autoscale_config.get("round_reserve", DEFAULT_ROUND_RESERVE)
+    inputs = gather_round_inputs(config, round_metrics, deadline, ctx_handler, hpcpack_rest_client, node_history, node_mgr,
+                                 record_grow_decisions=not dry_run)
+    # a plan made earlier, e.g. by azhpcpack plan, is applied on fresh inputs and its new nodes are allocated again
+    allocated = plan is None
+    if plan is None:
+        plan = make_plan(config, round_metrics, deadline, guard, ctx_handler, inputs, hpcpack_rest_client)
+    else:
+        # the idle check of the plan is as old as the plan, the nodes it shuts down are checked again
+        round_metrics.begin("idle_recheck")
+        kept_cc_ids = recheck_idle(plan, inputs, hpcpack_rest_client.check_nodes_idle,
+                                   idle_check_skip_reason=skip_reason(deadline, guard, round_reserve))
+        round_metrics.count("kept_nodes", len(kept_cc_ids))
+    if dry_run:
+        logging.info("Dry-run: no real action")
+        return
+    if ctx_handler:
+        ctx_handler.set_context("[apply]")
+    apply_plan(plan, inputs, hpcpack_rest_client, round_metrics, allocated=allocated,
+               skip_reason=lambda: skip_reason(deadline, guard, round_reserve),
+               max_workers=autoscale_config.get("apply_workers") or DEFAULT_APPLY_WORKERS)
+
+
+def gather_round_inputs(
+    config: Dict[str, Any],
+    round_metrics: RoundMetrics,
+    deadline: RoundDeadline,
+    ctx_handler: Optional[DefaultContextHandler],
+    hpcpack_rest_client: HpcRestClient,
+    node_history: Optional[HpcNodeHistory] = None,
+    node_mgr: Optional[NodeManager] = None,
+    record_grow_decisions: bool = True,
+) -> RoundInputs:
 
     if ctx_handler:
         ctx_handler.set_context("[Sync-Status]")
     autoscale_config = config.get("autoscale") or {}
     # Load history info
-    idle_timeout_seconds:int = autoscale_config.get("idle_timeout") or 600    
-    provisioning_timeout_seconds = autoscale_config.get("boot_timeout") or 1500
-    statefile = autoscale_config.get("statefile") or "C:\\cycle\\jetpack\\config\\autoscaler_state.txt"
-    archivefile = autoscale_config.get("archivefile") or "C:\\cycle\\jetpack\\config\\autoscaler_archive.txt"
-    node_history = HpcNodeHistory(
-        statefile=statefile, 
-        archivefile=archivefile, 
-        provisioning_timeout=provisioning_timeout_seconds, 
-        idle_timeout=idle_timeout_seconds)
+    if not node_history:
+        round_metrics.begin("history_load")
+        node_history = new_node_history(config)
+        round_metrics.count("items", len(node_history.items))
+    elif node_history.changed_on_disk:
+        # the history kept by the daemon is stale once another run saved it, e.g. an autoscale run of the scheduled task
+        logging.info("The node history was saved by another process, reloading it")
+        round_metrics.begin("history_load")
+        node_history.reload()
+        round_metrics.count("items", len(node_history.items))
 
     logging.info("Synchronizing the nodes between Cycle cloud and HPC Pack")
     # Initialize data of History info, cc nodes, HPC Pack nodes, HPC grow decisions
@@ -56,271 +274,194 @@ def autoscale_hpcpack(
             return (state_pri, name, int(index))
         except Exception:
             return (state_pri, n.name, 0)
-    node_mgr: NodeManager = new_node_manager(config)
-    for b in node_mgr.get_buckets():
-        b.nodes.sort(key=nodes_state_key)
+    def new_sorted_node_manager() -> NodeManager:
+        sorted_node_mgr = node_mgr or new_node_manager(config)
+        for b in sorted_node_mgr.get_buckets():
+            b.nodes.sort(key=nodes_state_key)
+        return sorted_node_mgr
+
+    # The CycleCloud nodes, and the node groups, grow decision and compute nodes from HPC Pack
+    # do not depend on each other, fetch them concurrently
+    round_metrics.begin("gather")
+    gather_tasks = {
+        "cc_nodes": new_sorted_node_manager,
+        "hpc_node_groups": hpcpack_rest_client.list_node_groups,
+        "grow_decisions": hpcpack_rest_client.get_grow_decision,
+        "hpc_compute_nodes": lambda: hpcpack_rest_client.list_computenodes(active_only=True),
+    }
+    # a fetch may have a timeout of its own, e.g. the node list of a large cluster, the others use gather_timeout
+    gather_timeouts: Dict[str, Any] = autoscale_config.get("gather_timeouts") or {}
+    unknown_fetches = [name for name in gather_timeouts if name not in gather_tasks]
+    if unknown_fetches:
+        logging.warning("Ignoring autoscale.gather_timeouts of {}, the fetches are {}".format(unknown_fetches, list(gather_tasks)))
+    gathered, gather_seconds = run_concurrently(
+        gather_tasks,
+        max_workers=autoscale_config.get("gather_workers") or 4,
+        timeout=deadline.cap(autoscale_config.get("gather_timeout") or 120),
+        timeouts={name: deadline.cap(t) for name, t in gather_timeouts.items() if name in gather_tasks})
+    logging.info("Gathered round inputs in seconds: {}".format(
+        ", ".join("{}={:.2f}".format(k, v) for k, v in gather_seconds.items())))
+    node_mgr: NodeManager = gathered["cc_nodes"]
     cc_nodes:List[Node] = node_mgr.get_nodes()
-    cc_nodes_by_id = partition_single(cc_nodes, func=lambda n: n.delayed_node_id.node_id)
-    # Get compute node list and grow decision from HPC Pack
-    hpc_node_groups = hpcpack_rest_client.list_node_groups()
-    grow_decisions = hpcpack_rest_client.get_grow_decision()
+    hpc_node_groups = CISet(gathered["hpc_node_groups"])
+    grow_decisions = gathered["grow_decisions"]
     logging.info("grow decision: {}".format(grow_decisions))
-    hpc_cn_nodes:List[HpcNode] = hpcpack_rest_client.list_computenodes()
-    hpc_cn_nodes = [n for n in hpc_cn_nodes if n.active]
+    # only the active compute nodes are listed
+    hpc_cn_nodes:List[HpcNode] = gathered["hpc_compute_nodes"]
+    # the fetches ran concurrently, the gather phase is their wall time
+    round_metrics.add_phase("cc_fetch", gather_seconds["cc_nodes"], nodes=len(cc_nodes))
+    round_metrics.add_phase("hpc_fetch", max(gather_seconds["hpc_node_groups"], gather_seconds["grow_decisions"], gather_seconds["hpc_compute_nodes"]),
+        nodes=len(hpc_cn_nodes), node_groups=len(hpc_node_groups), grow_decisions=len(grow_decisions))
+    status_refresh = hpcpack_rest_client.last_status_refresh
+    if status_refresh:
+        logging.info("HPC node status {}: {} nodes reused, {} parsed, {} dropped".format(
+            "not modified" if status_refresh.not_modified else "refreshed", status_refresh.reused, status_refresh.parsed, status_refresh.dropped))
+
+    # The grow decisions of the rounds applied are recorded, the forecast of the pre-warming is made on those of the past days
+    forecast: Dict[str, GrowDecision] = {}
+    round_metrics.begin("grow_history")
+    grow_history = new_grow_history(config)
+    if grow_history is not None:
+        if record_grow_decisions:
+            grow_history.record(grow_decisions)
+        if autoscale_config.get("prewarm"):
+            forecast = grow_history.forecast()
+            logging.info("grow forecast: {}".format(forecast))
+            round_metrics.count("records", grow_history.records)
+            round_metrics.count("forecast_groups", len(forecast))
 
     # This function will link node history items, cc nodes and hpc nodes
+    round_metrics.begin("synchronize")
     node_history.synchronize(cc_nodes, hpc_cn_nodes)
+    round_metrics.count("history_items", len(node_history.items))
 
-    cc_nodearrays = set([b.nodearray for b in node_mgr.get_buckets()])
-    logging.info("Current node arrays in cyclecloud: {}".format(cc_nodearrays))
-
-    # Create HPC node groups for CC node arrays
-    cc_map_hpc_groups = ["CycleCloudNodes"] + list(cc_nodearrays)
-    for cc_grp in cc_map_hpc_groups:
-        if ci_notin(cc_grp, hpc_node_groups):
-            logging.info("Create HPC node group: {}".format(cc_grp))
-            hpcpack_rest_client.add_node_group(cc_grp, "Cycle Cloud Node group")
-
-    # Add HPC nodes into corresponding node groups
-    add_cc_tag_nodes = [n.name for n in hpc_cn_nodes if n.shall_addcyclecloudtag]
-    if len(add_cc_tag_nodes) > 0:
-        logging.info("Adding HPC nodes to node group CycleCloudNodes: {}".format(add_cc_tag_nodes))
-        hpcpack_rest_client.add_node_to_node_group("CycleCloudNodes", add_cc_tag_nodes)
-    for cc_grp in list(cc_nodearrays):
-        add_array_tag_nodes = [n.name for n in hpc_cn_nodes if n.shall_addnodearraytag and ci_equals(n.cc_nodearray, cc_grp)]
-        if len(add_array_tag_nodes) > 0:
-            logging.info("Adding HPC nodes to node group {}: {}".format(cc_grp, add_array_tag_nodes))
-            hpcpack_rest_client.add_node_to_node_group(cc_grp, add_array_tag_nodes)
-
-    # Possible values for HPC NodeState (states marked with * shall not occur for CC nodes):
-    #   Unknown, Provisioning, Offline, Starting, Online, Draining, Rejected(*), Removing, NotDeployed(*), Stopping(*) 
-    # Remove the following HPC Pack nodes:
-    #   1. The corresponding CC node already removed
-    #   2. The corresponding CC node is stopped and HPC node is not assigned a node template
-    # Take offline the following HPC Pack nodes:
-    #   1. The corresponding CC node is stopped or is going to stop
-    hpc_nodes_to_remove = [n.name for n in hpc_cn_nodes if n.removed_cc_node or (n.stopped_cc_node and not n.template_assigned)]
-    hpc_nodes_to_take_offline = [n.name for n in hpc_cn_nodes if n.stopped_cc_node and ci_equals(n.state, "Online")]
-    if len(hpc_nodes_to_remove) > 0:
-        logging.info("Removing the HPC nodes: {}".format(hpc_nodes_to_remove))
-        if dry_run:
-            logging.info("Dry-run: no real action")
-        else:
-            hpcpack_rest_client.remove_nodes(hpc_nodes_to_remove)
-    hpc_cn_nodes = [n for n in hpc_cn_nodes if not (n.stopped_cc_node or n.removed_cc_node)]
-
-    # Assign default node template for unapproved CC node 
-    hpc_nodes_to_assign_template = [n.name for n in hpc_cn_nodes if n.bound_cc_node and not n.template_assigned]
-    if len(hpc_nodes_to_assign_template) > 0:
-        logging.info("Assigning default node template for the HPC nodes: {}".format(hpc_nodes_to_assign_template))
-        if dry_run:
-            logging.info("Dry-run: no real action")
-        else:
-            hpcpack_rest_client.assign_default_compute_node_template(hpc_nodes_to_assign_template)
-
-    ### Start scale up checking:
-    logging.info("Start scale up checking ...")
-    if ctx_handler:
-        ctx_handler.set_context("[scale-up]")
-
-    hpc_nodes_with_active_cc = [n for n in hpc_cn_nodes if n.template_assigned and n.bound_cc_node]
-    # Exclude the already online healthy HPC nodes before calling node_mgr.allocate
-    for hpc_node in hpc_nodes_with_active_cc:
-        if hpc_node.ready_for_job:
-            hpc_node.bound_cc_node.closed = True
-    
-    # Terminate the provisioning timeout CC nodes
-    cc_node_to_terminate: List[Node] = []
-    for cc_node in cc_nodes:
-        if ci_equals(cc_node.target_state, 'Deallocated') or ci_equals(cc_node.target_state, 'Terminated') or cc_node.create_time_remaining:
-            continue
-        nhi = node_history.find(cc_id=cc_node.delayed_node_id.node_id)
-        if not nhi.hpc_id:
-            cc_node.closed = True
-            cc_node_to_terminate.append(cc_node)
-        else:
-            hpc_node = ci_find_one(hpc_nodes_with_active_cc, nhi.hpc_id, lambda n : n.id)
-            if hpc_node and hpc_node.error:
-                cc_node.closed = True
-                cc_node_to_terminate.append(cc_node)
-
-    # "ComputeNodes", "CycleCloudNodes", "AzureIaaSNodes" are all treated as default
-    # grow_by_socket not supported yet, treat as grow_by_node
-    defaultGroups = ["Default", "ComputeNodes", "AzureIaaSNodes", "CycleCloudNodes"]
-    default_cores_to_grow = default_nodes_to_grow = 0.0
-
-    # If the current CC nodes in the node array cannot satisfy the grow decision, the group is hungry
-    # For a hungry group, no idle check is required if the node health is OK
-    group_hungry: Dict[str, bool] = {}
-    nbrNewNodes: int = 0
-    grow_groups = list(grow_decisions.keys())
-    for grp in grow_groups:
-        tmp = grow_decisions.pop(grp)
-        if not (tmp.cores_to_grow + tmp.nodes_to_grow + tmp.sockets_to_grow):
-            continue
-        if ci_in(grp, defaultGroups):
-            default_cores_to_grow += tmp.cores_to_grow
-            default_nodes_to_grow += tmp.nodes_to_grow + tmp.sockets_to_grow
-            continue
-        if ci_notin(grp, cc_nodearrays):
-            logging.warning("No mapping node array for the grow requirement {}:{}".format(grp, grow_decisions[grp]))
-            grow_decisions.pop(grp)
-            continue
-        group_hungry[grp] = False
-        array = ci_lookup(grp, cc_nodearrays)
-        selector =  {'ncpus': 1, 'node.nodearray':[array]}
-        target_cores = math.ceil(tmp.cores_to_grow)
-        target_nodes = math.ceil(tmp.nodes_to_grow + tmp.sockets_to_grow)
-        if target_nodes:
-            logging.info("Allocate: {}  Target Nodes: {}".format(selector, target_nodes))
-            result = node_mgr.allocate(selector, node_count=target_nodes)
-            logging.info(result)
-            if not result or result.total_slots < target_nodes:
-                group_hungry[grp] = True
-        if target_cores:
-            logging.info("Allocate: {}  Target Cores: {}".format(selector, target_cores))
-            result = node_mgr.allocate(selector, slot_count=target_cores)
-            logging.info(result)
-            if not result or result.total_slots < target_cores:
-                group_hungry[grp] = True
-        if len(node_mgr.new_nodes) > nbrNewNodes:
-            group_hungry[grp] = True
-        nbrNewNodes = len(node_mgr.new_nodes)
-
-    # We then check the grow decision for the default node groups:
-    checkShrinkNeeded = True
-    growForDefaultGroup = True if default_nodes_to_grow or default_cores_to_grow else False
-    if growForDefaultGroup:
-        selector = {'ncpus': 1}
-        if default_nodes_to_grow:
-            target_nodes = math.ceil(default_nodes_to_grow)
-            logging.info("Allocate: {}  Target Nodes: {}".format(selector, target_nodes))
-            result = node_mgr.allocate({'ncpus': 1}, node_count=target_nodes)
-            if not result or result.total_slots < target_nodes:
-                checkShrinkNeeded = False
-        if default_cores_to_grow:
-            target_cores = math.ceil(default_cores_to_grow)
-            logging.info("Allocate: {}  Target Cores: {}".format(selector, target_cores))
-            result = node_mgr.allocate({'ncpus': 1}, slot_count=target_cores)
-            if not result or result.total_slots < target_cores:
-                checkShrinkNeeded = False
-        if len(node_mgr.new_nodes) > nbrNewNodes:
-            checkShrinkNeeded = False
-        nbrNewNodes = len(node_mgr.new_nodes)
-
-    if nbrNewNodes > 0:
-        logging.info("Need to Allocate {} nodes in total".format(nbrNewNodes))
-        if dry_run:
-            logging.info("Dry-run: skipping node bootup...")
-        else:
-            logging.info("Allocating {} nodes in total".format(len(node_mgr.new_nodes)))            
-            bootup_result:BootupResult = node_mgr.bootup()
-            logging.info(bootup_result)
-            if bootup_result and bootup_result.nodes:
-                for cc_node in bootup_result.nodes:
-                    nhi = node_history.find(cc_id = cc_node.delayed_node_id.node_id)
-                    if nhi is None:
-                        nhi = node_history.insert(NodeHistoryItem(cc_node.delayed_node_id.node_id))
-                    else:
-                        nhi.restart()
-    else:
-        logging.info("No need to allocate new nodes ...")
+    inputs = RoundInputs(node_mgr, cc_nodes, hpc_cn_nodes, hpc_node_groups, grow_decisions, node_history, forecast=forecast)
+    logging.info("Current node arrays in cyclecloud: {}".format(inputs.nodearrays))
+    round_metrics.set_round_count("cc_nodes", len(cc_nodes))
+    round_metrics.set_round_count("hpc_nodes", len(hpc_cn_nodes))
+    round_metrics.set_round_count("nodearrays", len(inputs.nodearrays))
+    return inputs
 
-    ### Start the shrink checking
+
+def make_plan(
+    config: Dict[str, Any],
+    round_metrics: RoundMetrics,
+    deadline: RoundDeadline,
+    guard: Optional[HeadNodeGuard],
+    ctx_handler: Optional[DefaultContextHandler],
+    inputs: RoundInputs,
+    hpcpack_rest_client: HpcRestClient,
+) -> Plan:
     if ctx_handler:
-        ctx_handler.set_context("[scale-down]")
-
-    cc_node_to_shutdown: List[Node] = []
-    if not checkShrinkNeeded:
-        logging.info("No shrink check at this round ...")
-        if not dry_run:
-            for nhi in node_history.items:
-                if not nhi.stopped and nhi.hpc_id:
-                    nhi.idle_from = None
-    else:
-        logging.info("Start scale down checking ...")
-        # By default, we check idle for active CC nodes in HPC Pack with 'Offline', 'Starting', 'Online', 'Draining' state
-        candidate_idle_check_nodes = [n for n in hpc_nodes_with_active_cc if (not n.bound_cc_node.keep_alive) and ci_in(n.state, ["Offline", "Starting", "Online", "Draining"])]
-
-        # We can exclude some nodes from idle checking:
-        # 1. If HPC Pack ask for grow in default node group(s), all healthy ONLINE nodes are considered as busy
-        # 2. If HPC Pack ask for grow in certain node group, all healthy ONLINE nodes in that node group are considered as busy
-        # 3. If a node group is hungry (new CC required or grow request not satisfied), no idle check needed for all nodes in that node array
-        if growForDefaultGroup:
-            candidate_idle_check_nodes = [n for n in candidate_idle_check_nodes if not n.ready_for_job]
-        for grp, hungry in group_hungry.items():
-            if hungry:
-                candidate_idle_check_nodes = [n for n in candidate_idle_check_nodes if not ci_equals(grp, n.cc_nodearray)]
-            elif not growForDefaultGroup:
-                candidate_idle_check_nodes = [n for n in candidate_idle_check_nodes if not (ci_equals(grp, n.cc_nodearray) and n.ready_for_job)]
-
-        curtime = datetime.utcnow()
-        # Offline node must be idle
-        idle_node_names = [n.name for n in candidate_idle_check_nodes if ci_equals(n.state, 'Offline')]
-        if len(candidate_idle_check_nodes) > len(idle_node_names):
-            idle_nodes = hpcpack_rest_client.check_nodes_idle([n.name for n in candidate_idle_check_nodes if not ci_equals(n.state, 'Offline')])
-            if len(idle_nodes) > 0:
-                idle_node_names.extend([n.node_name for n in idle_nodes])
-
-        if len(idle_node_names) > 0:
-            logging.info("The following node is idle: {}".format(idle_node_names))
-        else:
-            logging.info("No idle node found in this round.")
-
-        retention_days = autoscale_config.get("vm_retention_days") or 7
-        for nhi in node_history.items:
-            if nhi.stopped:
-                if nhi.stop_time + timedelta(days=retention_days) < datetime.utcnow():
-                    cc_node = cc_nodes_by_id.get(nhi.cc_id)
-                    if cc_node is not None:
-                        cc_node_to_terminate.append(cc_node)
-                continue
-            if ci_in(nhi.hostname, idle_node_names):
-                if nhi.idle_from is None:
-                    nhi.idle_from = curtime
-                elif nhi.idle_timeout(idle_timeout_seconds):
-                    nhi.stop_time = curtime
-                    cc_node = cc_nodes_by_id.get(nhi.cc_id)
-                    if cc_node is not None:
-                        cc_node_to_shutdown.append(cc_node)
+        ctx_handler.set_context("[plan]")
+    autoscale_config = config.get("autoscale") or {}
+    round_reserve = autoscale_config.get("round_reserve", DEFAULT_ROUND_RESERVE)
+
+    round_metrics.begin("plan")
+    allocation = allocate_round(config, inputs)
+    # the one head node call the decisions depend on, made between the allocation and the plan
+    idle_check_skip_reason = skip_reason(deadline, guard, round_reserve)
+    idle_check: Optional[IdleCheck] = None
+    idle_check_seconds = 0.0
+    if allocation.shrink_check and not idle_check_skip_reason:
+        start = time.perf_counter()
+        idle_check = check_idle(allocation.idle_check_candidates(), hpcpack_rest_client.check_nodes_idle)
+        idle_check_seconds = time.perf_counter() - start
+    plan = plan_round(config, inputs, allocation, idle_check, idle_check_skip_reason=idle_check_skip_reason)
+    idle_check_counts = {k: v for k, v in plan.counts.items() if k in IDLE_CHECK_COUNTS}
+    for name, value in plan.counts.items():
+        if name not in IDLE_CHECK_COUNTS:
+            round_metrics.count(name, value)
+    if "idle_check" in plan.skipped:
+        idle_check_counts["skipped"] = 1
+    # the head node call made while planning, its time is also part of the plan phase
+    round_metrics.add_phase("idle_check", idle_check_seconds, **idle_check_counts)
+    logging.info(plan.summary())
+    return plan
+
+
+def new_node_history(
+    config: Dict[str, Any]
+) -> HpcNodeHistory:
+
+    autoscale_config = config.get("autoscale") or {}
+    idle_timeout_seconds:int = autoscale_config.get("idle_timeout") or 600    
+    provisioning_timeout_seconds = autoscale_config.get("boot_timeout") or 1500
+    statefile = autoscale_config.get("statefile") or "C:\\cycle\\jetpack\\config\\autoscaler_state.txt"
+    archivefile = autoscale_config.get("archivefile") or "C:\\cycle\\jetpack\\config\\autoscaler_archive.txt"
+    return HpcNodeHistory(
+        statefile=statefile, 
+        archivefile=archivefile, 
+        provisioning_timeout=provisioning_timeout_seconds, 
+        idle_timeout=idle_timeout_seconds,
+        compact_every=autoscale_config.get("state_compact_every") or 60,
+        lock=new_round_lock(config))
+
+
+def autoscale_hpcpack_daemon(
+    config_path: str,
+    ctx_handler: DefaultContextHandler = None,
+    interval: Optional[float] = None,
+    dry_run: bool = False,
+    stop_event: Optional[threading.Event] = None,
+) -> None:
+    """
+    Runs autoscale rounds in a long-running process, so that the REST session, the node history
+    and the config stay in memory between the rounds. The config is reloaded when the config file
+    changes, and the loop exits once stop_event is set (SIGINT/SIGTERM set it by default).
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+        _register_stop_signals(stop_event)
+
+    config_mtime = os.path.getmtime(config_path)
+    config = load_config(config_path)
+    hpcpack_rest_client = new_rest_client(config)
+    node_history = new_node_history(config)
+    try:
+        while not stop_event.is_set():
+            round_start = time.monotonic()
+            try:
+                cur_mtime = os.path.getmtime(config_path)
+                if cur_mtime != config_mtime:
+                    logging.info("Config file {} changed, reloading".format(config_path))
+                    config = load_config(config_path)
+                    config_mtime = cur_mtime
+                    hpcpack_rest_client.close()
+                    hpcpack_rest_client = new_rest_client(config)
+                    node_history = new_node_history(config)
+            except Exception:
+                logging.exception("Failed to reload config file {}, keep using the current config".format(config_path))
+
+            autoscale_config = config.get("autoscale") or {}
+            round_interval = interval or autoscale_config.get("daemon_interval") or 60
+            if autoscale_config.get("start_enabled", True):
+                logging.info("------------------------------------------------------------------------")
+                try:
+                    autoscale_hpcpack(
+                        config,
+                        ctx_handler=ctx_handler,
+                        hpcpack_rest_client=hpcpack_rest_client,
+                        dry_run=dry_run,
+                        node_history=node_history)
+                except Exception:
+                    logging.exception("Autoscale round failed")
             else:
-                nhi.idle_from = None
-
-    shrinking_cc_node_ids = [n.delayed_node_id.node_id for n in cc_node_to_terminate]
-    shrinking_cc_node_ids.extend([n.delayed_node_id.node_id for n in cc_node_to_shutdown])
-    hpc_nodes_to_bring_online = [n.name for n in hpc_nodes_with_active_cc if ci_equals(n.state, 'Offline') and not n.error and ci_notin(n.cc_node_id, shrinking_cc_node_ids)]
-    hpc_nodes_to_take_offline.extend([n.name for n in hpc_nodes_with_active_cc if ci_equals(n.state, 'Online') and ci_in(n.cc_node_id, shrinking_cc_node_ids)])
-    if len(hpc_nodes_to_bring_online) > 0:
-        logging.info("Bringing the HPC nodes online: {}".format(hpc_nodes_to_bring_online))
-        if dry_run:
-            logging.info("Dry-run: no real action")
-        else:
-            hpcpack_rest_client.bring_nodes_online(hpc_nodes_to_bring_online)
-
-    if len(hpc_nodes_to_take_offline) > 0:
-        logging.info("Taking the HPC nodes offline: {}".format(hpc_nodes_to_take_offline))
-        if dry_run:
-            logging.info("Dry-run: no real action")
-        else:
-            hpcpack_rest_client.take_nodes_offline(hpc_nodes_to_take_offline)
-
-    if len(cc_node_to_shutdown) > 0:
-        logging.info("Shut down the following Cycle cloud node: {}".format([cn.name for cn in cc_node_to_shutdown]))
-        if dry_run:
-            logging.info("Dry-run: skip ...")
-        else:            
-            node_mgr.shutdown_nodes(cc_node_to_shutdown)
-
-    if len(cc_node_to_terminate) > 0:
-        logging.info("Terminating the following provisioning-timeout Cycle cloud nodes: {}".format([cn.name for cn in cc_node_to_terminate]))
-        if dry_run:
-            logging.info("Dry-run: skip ...")
-        else:            
-            node_mgr.terminate_nodes(cc_node_to_terminate)
-
-    if not dry_run:
-        logging.info("Save node history: {}".format(node_history))
-        node_history.save()
+                logging.info("Autoscaler is not enabled")
+            stop_event.wait(max(0, round_interval - (time.monotonic() - round_start)))
+    finally:
+        logging.info("Autoscale daemon is shutting down")
+        hpcpack_rest_client.close()
+
+
+def _register_stop_signals(stop_event: threading.Event) -> None:
+    def _stop(signum: int, frame: Any) -> None:
+        logging.info("Received signal {}, stopping after the current round".format(signum))
+        stop_event.set()
+
+    for signame in ["SIGINT", "SIGTERM", "SIGBREAK"]:
+        if hasattr(signal, signame):
+            signal.signal(getattr(signal, signame), _stop)
 
 
 def new_rest_client(
@@ -330,7 +471,31 @@ def new_rest_client(
     hpcpack_config = config.get('hpcpack') or {}    
     hpc_pem_file = hpcpack_config.get('pem')
     hn_hostname = hpcpack_config.get('hn_hostname')
-    return HpcRestClient(config, pem=hpc_pem_file, hostname=hn_hostname)
+    pool_size = hpcpack_config.get('pool_size') or HpcRestClient.DEFAULT_POOL_SIZE
+    connect_timeout = hpcpack_config.get('connect_timeout') or HpcRestClient.DEFAULT_CONNECT_TIMEOUT
+    read_timeout = hpcpack_config.get('read_timeout') or HpcRestClient.DEFAULT_READ_TIMEOUT
+    chunk_size = hpcpack_config.get('chunk_size') or HpcRestClient.DEFAULT_CHUNK_SIZE
+    chunks_in_flight = hpcpack_config.get('chunks_in_flight') or HpcRestClient.DEFAULT_CHUNKS_IN_FLIGHT
+    bulk_timeout = hpcpack_config.get('bulk_timeout') or HpcRestClient.DEFAULT_BULK_TIMEOUT
+    # the retry and circuit breaker settings, see new_head_node_guard
+    guard = new_head_node_guard(hpcpack_config)
+    node_id_cache = NodeIdCache(
+        cache_file=hpcpack_config.get('node_id_cache_file') or "C:\\cycle\\jetpack\\config\\hpcpack_node_ids.json",
+        max_age=hpcpack_config.get('node_id_cache_max_age') or NodeIdCache.DEFAULT_MAX_AGE)
+    # aiohttp based client behind the same blocking interface, aiohttp is an optional dependency
+    client_class = AsyncBackedHpcRestClient if hpcpack_config.get('async_client') else HpcRestClient
+    return client_class(
+        config,
+        pem=hpc_pem_file,
+        hostname=hn_hostname,
+        pool_size=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        node_id_cache=node_id_cache,
+        chunk_size=chunk_size,
+        chunks_in_flight=chunks_in_flight,
+        bulk_timeout=bulk_timeout,
+        guard=guard)
 
 if __name__ == "__main__":
 
@@ -0,0 +1,615 @@
+import functools
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import hpc.autoscale.hpclogging as logging
+from .autoscaler import autoscale_hpcpack
+from .commonutil import ChunkResult, CISet, ci_dict
+from .growforecast import DAY_SECONDS, DEFAULT_PREWARM_DAYS, GrowHistory
+from .hpcnodehistory import HpcNodeHistory, NodeHistoryItem
+from .hpcpackdriver import BulkResult, GrowDecision, HpcNode, HpcRestClient, IdleNode, is_active_computenode, new_hpc_node
+from .hpcpacksimulator import SimulatedHeadNode, SimulatorServer
+from .jsonstream import STREAM_CHUNK_SIZE, iter_json_array
+from .nodeselection import NodeColumns, NodeSelector, np
+from .roundplan import RoundInputs, allocate_round, check_idle, plan_round
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+# version of the results file layout, 2: retained_bytes
+RESULTS_FORMAT = 2
+
+DelayedNodeId = NamedTuple("DelayedNodeId", [("node_id", str)])
+AllocationResult = NamedTuple("AllocationResult", [("total_slots", int), ("nodes", List[Any])])
+NodesResult = NamedTuple("NodesResult", [("nodes", List[Any])])
+Phase = NamedTuple("Phase", [("name", str), ("setup", Callable[[], Any]), ("run", Callable[[Any], Optional[Dict[str, float]]])])
+PhaseResult = NamedTuple("PhaseResult", [("nodes", int), ("phase", str), ("seconds", float), ("peak_bytes", Optional[int]),
+                                         ("retained_bytes", Optional[int]), ("breakdown", Dict[str, float])])
+
+
+class SyntheticNode:
+    """
+    The attributes of a CycleCloud node (hpc.autoscale.node.node.Node) that the autoscale round uses.
+    """
+    def __init__(
+        self,
+        node_id: str,
+        name: str,
+        hostname: str,
+        nodearray: str,
+        state: str = "Started",
+        target_state: str = "Started",
+        vm_size: str = "Standard_F2s_v2"
+    ) -> None:
+        self.delayed_node_id = DelayedNodeId(node_id)
+        self.name = name
+        self.hostname = hostname
+        self.nodearray = nodearray
+        self.vm_size = vm_size
+        self.state = state
+        self.target_state = target_state
+        self.keep_alive = False
+        self.closed = False
+        self.create_time_unix = 0.0
+        self.create_time_remaining = 0.0
+        self.idle_time_remaining = 0.0
+
+    def __repr__(self) -> str:
+        return "SyntheticNode({}, {})".format(self.name, self.state)
+
+
+class SyntheticBucket:
+    def __init__(self, nodearray: str, nodes: List[SyntheticNode], max_count: int) -> None:
+        self.nodearray = nodearray
+        self.vcpu_count = 1
+        self.nodes = nodes
+        self.max_count = max_count
+
+
+class FakeNodeManager:
+    """
+    In-memory NodeManager over synthetic buckets, every node has one slot.
+    """
+    def __init__(self, buckets: List[SyntheticBucket]) -> None:
+        self.__buckets = buckets
+        self.new_nodes: List[SyntheticNode] = []
+        self.shutdown: List[SyntheticNode] = []
+        self.terminated: List[SyntheticNode] = []
+
+    def get_buckets(self) -> List[SyntheticBucket]:
+        return self.__buckets
+
+    def get_nodes(self) -> List[SyntheticNode]:
+        return [n for b in self.__buckets for n in b.nodes]
+
+    def allocate(
+        self,
+        selector: Dict[str, Any],
+        node_count: Optional[int] = None,
+        slot_count: Optional[int] = None,
+        allow_existing: bool = True
+    ) -> AllocationResult:
+        nodearrays = CISet(selector.get("node.nodearray") or [b.nodearray for b in self.__buckets])
+        count = node_count or slot_count or 0
+        allocated: List[SyntheticNode] = []
+        for b in self.__buckets:
+            if b.nodearray not in nodearrays:
+                continue
+            # the running nodes not excluded from the allocation are matched first
+            for n in (b.nodes if allow_existing else []):
+                if len(allocated) >= count:
+                    break
+                if not n.closed and n.target_state == "Started":
+                    n.closed = True
+                    allocated.append(n)
+            while len(allocated) < count and len(b.nodes) < b.max_count:
+                index = len(b.nodes) + 1
+                n = SyntheticNode("{}-new-{}".format(b.nodearray, index), "{}-{}".format(b.nodearray, index),
+                                  "ccw-{}-{}".format(b.nodearray, index), b.nodearray, state="Off", target_state="Started")
+                n.closed = True
+                b.nodes.append(n)
+                self.new_nodes.append(n)
+                allocated.append(n)
+        return AllocationResult(len(allocated), allocated)
+
+    def bootup(self) -> NodesResult:
+        return NodesResult(list(self.new_nodes))
+
+    def shutdown_nodes(self, nodes: List[SyntheticNode]) -> NodesResult:
+        self.shutdown.extend(nodes)
+        return NodesResult(nodes)
+
+    def terminate_nodes(self, nodes: List[SyntheticNode]) -> NodesResult:
+        self.terminated.extend(nodes)
+        return NodesResult(nodes)
+
+
+class SyntheticCluster:
+    """
+    Deterministic synthetic cluster: node_count CycleCloud nodes spread over nodearray_count nodearrays,
+    the HPC Pack node status records of those nodes plus some on-premise compute nodes, the grow
+    decisions and the node history records. The build methods return fresh objects, as a round
+    changes the nodes it is given.
+    """
+    def __init__(
+        self,
+        node_count: int,
+        nodearray_count: int = 4,
+        seed: int = 0
+    ) -> None:
+        rnd = random.Random(seed)
+        now = time.time()
+        self.node_count = node_count
+        self.nodearrays = ["array{}".format(i) for i in range(nodearray_count)]
+        # (node_id, name, hostname, nodearray, state, target_state)
+        self.cc_nodes: List[Tuple[str, str, str, str, str, str]] = []
+        # node status records as listed by the REST API, plus the node Id
+        self.hpc_nodes: List[Dict[str, Any]] = []
+        # NodeHistoryItem records, see NodeHistoryItem.to_record
+        self.history_records: List[List[Any]] = []
+        self.idle_node_names = CISet()
+        for i in range(node_count):
+            nodearray = self.nodearrays[i % nodearray_count]
+            index = i // nodearray_count + 1
+            cc_id = "cc-{:08d}".format(i)
+            hpc_id = "{:08x}-0000-4000-8000-{:012x}".format(seed, i)
+            hostname = "ccw-{}-{}".format(nodearray, index)
+            # HPC Pack lists the names in upper case
+            hpc_name = hostname.upper()
+            groups = ["ComputeNodes", "CycleCloudNodes", nodearray]
+            template: Optional[str] = "Default ComputeNode Template"
+            state, target_state = "Started", "Started"
+            hpc_state, health = "Online", "OK"
+            record: List[Any] = [cc_id, hostname, hpc_id, now - 86400, now - 3600, None, None]
+            r = rnd.random()
+            if r < 0.70:
+                # running and healthy, some of them idle for a while
+                if rnd.random() < 0.3:
+                    self.idle_node_names.add(hpc_name)
+                    record[5] = now - rnd.choice([60, 1200])
+            elif r < 0.78:
+                hpc_state = "Offline"
+            elif r < 0.84:
+                # still booting, not in HPC Pack yet
+                record[2] = None
+                record[4] = now - 300
+                hpc_state = ""
+            elif r < 0.88:
+                # joined HPC Pack but not yet approved nor bound
+                record[2] = None
+                hpc_state, health, template, groups = "Offline", "Unapproved", None, ["ComputeNodes"]
+            elif r < 0.92:
+                hpc_state, health = "Offline", "Error"
+            elif r < 0.97:
+                state, target_state, hpc_state = "Deallocated", "Deallocated", "Offline"
+                record[6] = now - 86400 * rnd.choice([1, 8])
+            else:
+                # the node history lost the node
+                record = []
+            self.cc_nodes.append((cc_id, "{}-{}".format(nodearray, index), hostname, nodearray, state, target_state))
+            if hpc_state:
+                self.hpc_nodes.append(self.__status_record(hpc_id, hpc_name, health, hpc_state, groups, template))
+            if record:
+                self.history_records.append(record)
+        for i in range(max(1, node_count // 50)):
+            self.hpc_nodes.append(self.__status_record(
+                "{:08x}-0000-4000-9000-{:012x}".format(seed, i), "ONPREM-{}".format(i), "OK", "Online", ["ComputeNodes"], "Default ComputeNode Template"))
+        self.node_groups = ["ComputeNodes", "HeadNodes", "WCFBrokerNodes", "CycleCloudNodes"] + self.nodearrays[1:]
+        self.grow_decisions = {
+            "Default": GrowDecision(0.0, 0.0, 0.0),
+            self.nodearrays[0]: GrowDecision(0.0, float(max(1, node_count // 100)), 0.0),
+        }
+
+    @staticmethod
+    def __status_record(
+        node_id: str,
+        name: str,
+        health: str,
+        state: str,
+        groups: List[str],
+        template: Optional[str]
+    ) -> Dict[str, Any]:
+        return {"Id": node_id, "Name": name, "NodeHealth": health, "NodeState": state, "Groups": groups, "NodeTemplate": template}
+
+    def write_grow_history(self, history_file: str, days: int = DEFAULT_PREWARM_DAYS) -> None:
+        # a record a minute, every node array asks to grow in its own hours of the day
+        start = time.time() - days * DAY_SECONDS
+        with open(history_file, "w", encoding="utf-8") as hf:
+            for minute in range(days * 24 * 60):
+                hour = minute // 60 % 24
+                demand = {a: [float(self.node_count // 100), 0.0] for i, a in enumerate(self.nodearrays) if hour in (i % 24, (i + 8) % 24)}
+                hf.write(json.dumps({"t": start + minute * 60, "g": demand}) + "\n")
+
+    def new_node_manager(self) -> FakeNodeManager:
+        nodes_by_array: Dict[str, List[SyntheticNode]] = {a: [] for a in self.nodearrays}
+        for spec in self.cc_nodes:
+            nodes_by_array[spec[3]].append(SyntheticNode(*spec))
+        return FakeNodeManager([SyntheticBucket(a, nodes, len(nodes) + len(nodes) // 10 + 1) for a, nodes in nodes_by_array.items()])
+
+    def new_hpc_nodes(self) -> List[HpcNode]:
+        return [new_hpc_node(n["Id"], n) for n in self.hpc_nodes]
+
+    def new_rest_client(self) -> "FakeHpcRestClient":
+        return FakeHpcRestClient(self)
+
+    def status_body(self) -> bytes:
+        return json.dumps([{k: v for k, v in n.items() if k != "Id"} for n in self.hpc_nodes]).encode("utf-8")
+
+    def write_history(self, statefile: str, archivefile: str) -> None:
+        for f in [statefile, statefile + ".journal", archivefile]:
+            if os.path.exists(f):
+                os.remove(f)
+        node_history = HpcNodeHistory(statefile=statefile, archivefile=archivefile)
+        for record in self.history_records:
+            node_history.insert(NodeHistoryItem.from_record(list(record)))
+        node_history.save()
+
+
+class FakeHpcRestClient:
+    """
+    In-memory HpcRestClient serving a synthetic cluster, the number of calls per method is in calls.
+    """
+    def __init__(self, cluster: SyntheticCluster) -> None:
+        self.__cluster = cluster
+        self.__hpc_names = CISet([n["Name"] for n in cluster.hpc_nodes])
+        self.calls: Dict[str, int] = {}
+        self.last_status_refresh = None
+
+    def __count(self, function_name: str) -> None:
+        self.calls[function_name] = self.calls.get(function_name, 0) + 1
+
+    def __bulk(self, function_name: str, node_names: Iterable[str], result: List[Any]) -> BulkResult:
+        self.__count(function_name)
+        return BulkResult(function_name, [ChunkResult(0, list(node_names), result, None)])
+
+    def close(self) -> None:
+        pass
+
+    def get_grow_decision(self) -> Dict[str, GrowDecision]:
+        self.__count(self.get_grow_decision.__name__)
+        return dict(self.__cluster.grow_decisions)
+
+    def list_computenodes(self, active_only: bool = False) -> List[HpcNode]:
+        self.__count(self.list_computenodes.__name__)
+        nodes = self.__cluster.new_hpc_nodes()
+        return [n for n in nodes if (is_active_computenode(n) if active_only else n.is_computenode)]
+
+    def check_nodes_idle(self, node_names: Iterable[str]) -> BulkResult:
+        now = datetime.utcnow()
+        idle_names = self.__cluster.idle_node_names
+        return self.__bulk(self.check_nodes_idle.__name__, node_names,
+                           [IdleNode(name, now, "headnode") for name in node_names if name in idle_names])
+
+    def bring_nodes_online(self, node_names: Iterable[str]) -> BulkResult:
+        return self.__bulk(self.bring_nodes_online.__name__, node_names, [])
+
+    def take_nodes_offline(self, node_names: Iterable[str]) -> BulkResult:
+        return self.__bulk(self.take_nodes_offline.__name__, node_names, [])
+
+    def assign_default_compute_node_template(self, node_names: Iterable[str]) -> BulkResult:
+        return self.__bulk(self.assign_default_compute_node_template.__name__, node_names, [])
+
+    def remove_nodes(self, node_names: Iterable[str]) -> BulkResult:
+        return self.__bulk(self.remove_nodes.__name__, [n for n in node_names if n in self.__hpc_names], [])
+
+    def list_node_groups(self, group_name: Optional[str] = None) -> List[str]:
+        self.__count(self.list_node_groups.__name__)
+        return list(self.__cluster.node_groups)
+
+    def add_node_group(self, group_name: str, group_description: str = "") -> bool:
+        self.__count(self.add_node_group.__name__)
+        return True
+
+    def add_node_to_node_group(self, group_name: str, node_names: Iterable[str]) -> BulkResult:
+        return self.__bulk(self.add_node_to_node_group.__name__, node_names, [])
+
+
+class PhaseTimer:
+    """
+    Sums up the wall time of the wrapped calls by phase, the calls may come from several threads.
+    """
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = {}
+        self.__lock = threading.Lock()
+
+    def wrap(self, phase: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.__lock:
+                    self.seconds[phase] = self.seconds.get(phase, 0.0) + elapsed
+        return timed
+
+
+ROUND_REST_METHODS = [
+    "list_node_groups", "get_grow_decision", "list_computenodes", "add_node_group", "add_node_to_node_group", "remove_nodes",
+    "assign_default_compute_node_template", "check_nodes_idle", "bring_nodes_online", "take_nodes_offline"]
+ROUND_NODE_MANAGER_METHODS = ["get_buckets", "get_nodes", "allocate", "bootup", "shutdown_nodes", "terminate_nodes"]
+
+
+def cluster_phases(
+    cluster: SyntheticCluster,
+    work_dir: str,
+    simulator: Optional[SimulatorServer] = None
+) -> List[Phase]:
+    statefile = os.path.join(work_dir, "autoscaler_state.txt")
+    archivefile = os.path.join(work_dir, "autoscaler_archive.txt")
+    grow_history_file = os.path.join(work_dir, "autoscaler_grow_history.jsonl")
+    config = {"autoscale": {
+        "idle_timeout": 600, "boot_timeout": 1500, "metrics_file": os.path.join(work_dir, "autoscaler_metrics.jsonl"),
+        "lock_file": os.path.join(work_dir, "autoscaler.lock"), "grow_history_file": grow_history_file}}
+
+    def new_history() -> HpcNodeHistory:
+        cluster.write_history(statefile, archivefile)
+        return HpcNodeHistory(statefile=statefile, archivefile=archivefile, provisioning_timeout=1500, idle_timeout=600)
+
+    def synchronize_inputs() -> Tuple[HpcNodeHistory, List[SyntheticNode], List[HpcNode]]:
+        node_history = new_history()
+        hpc_nodes = [n for n in cluster.new_hpc_nodes() if is_active_computenode(n)]
+        return node_history, cluster.new_node_manager().get_nodes(), hpc_nodes
+
+    def synchronized_history() -> HpcNodeHistory:
+        node_history, cc_nodes, hpc_nodes = synchronize_inputs()
+        node_history.synchronize(cc_nodes, hpc_nodes)
+        return node_history
+
+    def round_inputs(rest_client: Any = None) -> Tuple[HpcNodeHistory, Any, FakeNodeManager, PhaseTimer]:
+        timer = PhaseTimer()
+        node_history = new_history()
+        node_history.synchronize = timer.wrap("synchronize", node_history.synchronize)  # type: ignore
+        node_history.save = timer.wrap("save", node_history.save)  # type: ignore
+        rest_client = rest_client or cluster.new_rest_client()
+        for name in ROUND_REST_METHODS:
+            setattr(rest_client, name, timer.wrap("rest_client", getattr(rest_client, name)))
+        node_mgr = cluster.new_node_manager()
+        for name in ROUND_NODE_MANAGER_METHODS:
+            setattr(node_mgr, name, timer.wrap("node_manager", getattr(node_mgr, name)))
+        return node_history, rest_client, node_mgr, timer
+
+    def run_round(inputs: Tuple[HpcNodeHistory, Any, FakeNodeManager, PhaseTimer]) -> Dict[str, float]:
+        node_history, rest_client, node_mgr, timer = inputs
+        try:
+            autoscale_hpcpack(config, hpcpack_rest_client=rest_client, node_history=node_history, node_mgr=node_mgr)  # type: ignore
+        finally:
+            rest_client.close()
+        return timer.seconds
+
+    def simulated_round_inputs() -> Tuple[HpcNodeHistory, Any, FakeNodeManager, PhaseTimer]:
+        # a fresh head node and client, so every run lists the node Ids and the full status,
+        # the simulator asks for no client certificate
+        assert simulator is not None
+        simulator.head_node.load_cluster(cluster)
+        return round_inputs(HpcRestClient(config, pem="", hostname=simulator.hostname))
+
+    def decode_inputs() -> List[bytes]:
+        body = cluster.status_body()
+        return [body[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(body), STREAM_CHUNK_SIZE)]
+
+    def reload_history(_: Any) -> None:
+        HpcNodeHistory(statefile=statefile, archivefile=archivefile)
+
+    def keep_history(kept: List[HpcNodeHistory]) -> None:
+        # the loaded history stays referenced by the inputs, its size is the memory retained by the run
+        kept.append(HpcNodeHistory(statefile=statefile, archivefile=archivefile))
+
+    def history_memory_inputs() -> List[HpcNodeHistory]:
+        cluster.write_history(statefile, archivefile)
+        return []
+
+    def decode_status(chunks: List[bytes]) -> None:
+        # the status records do not hold the Id, the name stands in for the joined Id
+        for n in iter_json_array(chunks):
+            new_hpc_node(n["Name"], n)
+
+    def bound_hpc_nodes() -> List[HpcNode]:
+        node_history, cc_nodes, hpc_nodes = synchronize_inputs()
+        node_history.synchronize(cc_nodes, hpc_nodes)
+        return hpc_nodes
+
+    def select_nodes(selector_class: Callable[[List[HpcNode]], NodeSelector], hpc_nodes: List[HpcNode]) -> None:
+        # the selections of a round, on the nodes bound by the synchronize
+        selector = selector_class(hpc_nodes)
+        selector.cc_tag_names()
+        selector.nodearray_tag_names()
+        selector.remove_names()
+        selector.stopped_online_names()
+        selector.drop_stopped_and_removed()
+        selector.assign_template_names()
+        selector.ready_active_cc_nodes()
+        selector.idle_check_candidates(False, {a: i == 0 for i, a in enumerate(cluster.nodearrays)})
+        shrinking_cc_node_ids = CISet([spec[0] for spec in cluster.cc_nodes[::10]])
+        selector.bring_online_names(shrinking_cc_node_ids)
+        selector.shrinking_online_names(shrinking_cc_node_ids)
+
+    def plan_inputs() -> Tuple[RoundInputs, FakeHpcRestClient]:
+        node_history = new_history()
+        node_mgr = cluster.new_node_manager()
+        cc_nodes = node_mgr.get_nodes()
+        hpc_nodes = [n for n in cluster.new_hpc_nodes() if is_active_computenode(n)]
+        node_history.synchronize(cc_nodes, hpc_nodes)
+        inputs = RoundInputs(node_mgr, cc_nodes, hpc_nodes, cluster.node_groups, dict(cluster.grow_decisions), node_history)  # type: ignore
+        return inputs, cluster.new_rest_client()
+
+    def make_plan(inputs: Tuple[RoundInputs, FakeHpcRestClient]) -> None:
+        # the decisions alone, the idle check is answered in memory
+        round_inputs, rest_client = inputs
+        allocation = allocate_round(config, round_inputs)
+        idle_check = check_idle(allocation.idle_check_candidates(), rest_client.check_nodes_idle) if allocation.shrink_check else None
+        plan_round(config, round_inputs, allocation, idle_check)
+
+    def grow_forecast(_: Any) -> None:
+        # the load of a week of records and the forecast, as made every round with pre-warming on
+        GrowHistory(grow_history_file).forecast()
+
+    def grow_record(_: Any) -> None:
+        # the grow decisions appended to a week of records, as every round does
+        GrowHistory(grow_history_file).record(cluster.grow_decisions)
+
+    def ci_lookups(hpc_nodes: List[HpcNode]) -> None:
+        by_name = ci_dict(hpc_nodes, lambda n: n.name)
+        names = CISet([n.name for n in hpc_nodes])
+        found = [n for n in hpc_nodes if by_name.get(n.name.lower()) is n and n.name.lower() in names]
+        assert len(found) == len(hpc_nodes)
+
+    return [
+        Phase("history.reload", lambda: cluster.write_history(statefile, archivefile), reload_history),
+        Phase("history.memory", history_memory_inputs, keep_history),
+        Phase("history.synchronize", synchronize_inputs, lambda inputs: inputs[0].synchronize(inputs[1], inputs[2])),
+        Phase("history.save", synchronized_history, lambda node_history: node_history.save()),
+        Phase("status.decode", decode_inputs, decode_status),
+        Phase("commonutil.ci_lookups", cluster.new_hpc_nodes, ci_lookups),
+        Phase("decide.selections", bound_hpc_nodes, functools.partial(select_nodes, NodeSelector)),
+        Phase("plan_round", plan_inputs, make_plan),
+        Phase("grow_history.forecast", lambda: cluster.write_grow_history(grow_history_file), grow_forecast),
+        Phase("grow_history.record", lambda: cluster.write_grow_history(grow_history_file), grow_record),
+        Phase("autoscale_round", round_inputs, run_round),
+    ] + ([Phase("decide.selections.columnar", bound_hpc_nodes, functools.partial(select_nodes, NodeColumns))] if np is not None else []) \
+      + ([Phase("autoscale_round.simulated", simulated_round_inputs, run_round)] if simulator else [])
+
+
+def measure(phase: Phase, repeat: int = 3, trace_memory: bool = True) -> Tuple[float, Optional[int], Optional[int], Dict[str, float]]:
+    """
+    Returns the best wall time of repeat runs of the phase, the peak memory allocated by one more
+    run and the memory it still holds at its end, with the breakdown of the wall time. The memory
+    is traced in a separate run as tracing slows the run down.
+    """
+    best = float("inf")
+    best_breakdown: Dict[str, float] = {}
+    for _ in range(max(1, repeat)):
+        inputs = phase.setup()
+        gc.collect()
+        start = time.perf_counter()
+        breakdown = phase.run(inputs)
+        elapsed = time.perf_counter() - start
+        if elapsed < best:
+            best = elapsed
+            best_breakdown = dict(breakdown or {})
+        del inputs
+    if best_breakdown:
+        # the time not spent in the measured calls
+        best_breakdown["decide"] = max(0.0, best - sum(best_breakdown.values()))
+    peak_bytes = retained_bytes = None
+    if trace_memory:
+        inputs = phase.setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            phase.run(inputs)
+            gc.collect()
+            retained_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return best, peak_bytes, retained_bytes, best_breakdown
+
+
+def run_benchmark(
+    sizes: List[int],
+    nodearray_count: int = 4,
+    repeat: int = 3,
+    trace_memory: bool = True,
+    phase_names: Optional[List[str]] = None,
+    seed: int = 0,
+    simulator_cert: Optional[str] = None,
+    simulator_settings: Optional[Dict[str, Any]] = None
+) -> List[PhaseResult]:
+    """
+    With simulator_cert, the round is also run with HpcRestClient against a local SimulatedHeadNode
+    created with simulator_settings, see hpcpacksimulator.
+    """
+    results: List[PhaseResult] = []
+    for size in sizes:
+        cluster = SyntheticCluster(size, nodearray_count=nodearray_count, seed=seed)
+        simulator = None
+        if simulator_cert:
+            simulator = SimulatorServer(SimulatedHeadNode(**(simulator_settings or {})), simulator_cert).start()
+        try:
+            with tempfile.TemporaryDirectory(prefix="hpcpack-benchmark-") as work_dir:
+                for phase in cluster_phases(cluster, work_dir, simulator):
+                    if phase_names and phase.name not in phase_names:
+                        continue
+                    seconds, peak_bytes, retained_bytes, breakdown = measure(phase, repeat=repeat, trace_memory=trace_memory)
+                    results.append(PhaseResult(size, phase.name, seconds, peak_bytes, retained_bytes, breakdown))
+                    logging.info("{} nodes {}: {:.4f}s peak {}".format(size, phase.name, seconds, peak_bytes))
+        finally:
+            if simulator:
+                simulator.close()
+    return results
+
+
+def results_document(results: List[PhaseResult], label: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "format": RESULTS_FORMAT,
+        "label": label,
+        "created": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings,
+        "results": [r._asdict() for r in results],
+    }
+
+
+def format_results(results: List[PhaseResult], baseline: Optional[Dict[str, Any]] = None) -> str:
+    baseline_seconds: Dict[Tuple[int, str], float] = {}
+    if baseline:
+        baseline_seconds = {(r["nodes"], r["phase"]): r["seconds"] for r in baseline["results"]}
+    lines = ["{:>8} {:<24} {:>10} {:>12} {:>12} {:>8}  {}".format("nodes", "phase", "seconds", "peak_MiB", "retained_MiB", "vs_base", "breakdown")]
+    for r in results:
+        base = baseline_seconds.get((r.nodes, r.phase))
+        lines.append("{:>8} {:<24} {:>10.4f} {:>12} {:>12} {:>8}  {}".format(
+            r.nodes,
+            r.phase,
+            r.seconds,
+            "-" if r.peak_bytes is None else "{:.2f}".format(r.peak_bytes / 1048576.0),
+            "-" if r.retained_bytes is None else "{:.2f}".format(r.retained_bytes / 1048576.0),
+            "{:.2f}x".format(r.seconds / base) if base else "-",
+            " ".join("{}={:.4f}".format(k, v) for k, v in sorted(r.breakdown.items()))))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = ArgumentParser(description="Times the autoscale round and its parts against synthetic clusters")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES), help="Comma separated numbers of CycleCloud nodes")
+    parser.add_argument("--nodearrays", type=int, default=4, help="Number of nodearrays the nodes are spread over")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per phase, the best wall time is reported")
+    parser.add_argument("--phases", default="", help="Comma separated phases to run, all by default")
+    parser.add_argument("--no-memory", action="store_true", default=False, help="Skip the traced run that measures the peak memory")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="Label of the results, e.g. the version under test")
+    parser.add_argument("--output", default="hpcpack-benchmark.json", help="Results file (JSON)")
+    parser.add_argument("--baseline", default=None, help="Results file of an earlier run to compare the wall times with")
+    parser.add_argument("--simulator-cert", default=None,
+                        help="PEM file with a server certificate and its key, also runs the round against a local HPC Pack REST simulator")
+    parser.add_argument("--simulator-latency", type=float, default=0.0, help="Seconds the simulator adds to every request")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    phase_names = [p.strip() for p in args.phases.split(",") if p.strip()]
+    settings = {"sizes": sizes, "nodearrays": args.nodearrays, "repeat": args.repeat, "seed": args.seed,
+                "simulator_latency": args.simulator_latency if args.simulator_cert else None}
+    results = run_benchmark(sizes, nodearray_count=args.nodearrays, repeat=args.repeat,
+                            trace_memory=not args.no_memory, phase_names=phase_names, seed=args.seed,
+                            simulator_cert=args.simulator_cert, simulator_settings={"latency": args.simulator_latency})
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results_document(results, args.label, settings), f, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_results(results, baseline))
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
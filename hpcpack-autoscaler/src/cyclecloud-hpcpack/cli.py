@@ -6,7 +6,7 @@ from shutil import which
 from subprocess import check_output
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
-from .autoscaler import autoscale_hpcpack
+from .autoscaler import apply_hpcpack, autoscale_hpcpack, autoscale_hpcpack_daemon, plan_hpcpack, prewarm_report
 
 from hpc.autoscale import clilib
 from hpc.autoscale.job.demandcalculator import DemandCalculator
@@ -71,6 +71,8 @@ class HpcPackCLI(clilib.CommonCLI):
     def __init__(self) -> None:
         clilib.CommonCLI.__init__(self, "hpcpack")
         self.__driver: Optional[HpcPackDriver] = None
+        # the config files clilib loads, those given with -c or the default one
+        self.config_files: List[str] = [os.path.join(self.autoscale_home, "autoscale.json")]
 
     def connect(self, config: Dict) -> None:
         """Tests connection to CycleCloud"""    
@@ -153,6 +155,78 @@ class HpcPackCLI(clilib.CommonCLI):
 
         return autoscale_hpcpack(config, ctx_handler=ctx_handler, dry_run=dry_run)
 
+    def daemon_parser(self, parser: ArgumentParser) -> None:
+        parser.set_defaults(read_only=False)
+        parser.add_argument(
+            "--interval", type=float, default=None, help="Seconds between autoscale rounds (default: autoscale.daemon_interval or 60)"
+        )
+        parser.add_argument(
+            "--config-path", default=self.config_files[0] if len(self.config_files) == 1 else None,
+            help="Config file to watch for changes (default: the config file given with -c)"
+        )
+        parser.add_argument("--dry-run", action="store_true", default=False)
+
+    def daemon(
+        self,
+        config: Dict,
+        config_path: str,
+        interval: Optional[float] = None,
+        dry_run: bool = False,
+    ) -> None:
+        """Runs the autoscale rounds in a long-running process, reloading the config when it changes."""
+        if not config_path:
+            raise RuntimeError("The daemon reloads a single config file, pass it with --config-path when -c is given several times")
+        if not os.path.isfile(config_path):
+            raise RuntimeError("Config file {} not found".format(config_path))
+        ctx_handler = self._ctx_handler(config)
+
+        register_result_handler(ctx_handler)
+
+        driver = self._driver(config)
+        driver.initialize()
+
+        return autoscale_hpcpack_daemon(config_path, ctx_handler=ctx_handler, interval=interval, dry_run=dry_run)
+
+    def plan_parser(self, parser: ArgumentParser) -> None:
+        parser.set_defaults(read_only=True)
+        parser.add_argument(
+            "--plan-file", default=os.path.join(self.autoscale_home, "autoscaler_plan.json"), help="File the plan is written to"
+        )
+
+    def plan(self, config: Dict, plan_file: str) -> None:
+        """Writes the actions the autoscale round would take to a plan file, without taking them."""
+        ctx_handler = self._ctx_handler(config)
+
+        register_result_handler(ctx_handler)
+
+        plan = plan_hpcpack(config, ctx_handler=ctx_handler)
+        plan.write(plan_file)
+        print(plan.summary())
+
+    def apply_parser(self, parser: ArgumentParser) -> None:
+        parser.set_defaults(read_only=False)
+        parser.add_argument(
+            "--plan-file", default=os.path.join(self.autoscale_home, "autoscaler_plan.json"), help="Plan file written by the plan command"
+        )
+
+    def apply(self, config: Dict, plan_file: str) -> None:
+        """Runs an autoscale round that takes the actions of a plan file written by the plan command."""
+        ctx_handler = self._ctx_handler(config)
+
+        register_result_handler(ctx_handler)
+
+        driver = self._driver(config)
+        driver.initialize()
+
+        return apply_hpcpack(config, plan_file, ctx_handler=ctx_handler)
+
+    def prewarm_parser(self, parser: ArgumentParser) -> None:
+        parser.set_defaults(read_only=True)
+
+    def prewarm(self, config: Dict) -> None:
+        """Prints the grow demand forecast and the hits and misses of the pre-warmed nodes."""
+        print(json.dumps(prewarm_report(config), indent=2))
+
     def _initconfig(self, config: Dict) -> None:
         pass    
 
@@ -180,6 +254,56 @@ class HpcPackCLI(clilib.CommonCLI):
             "--archivefile", default="C:\\cycle\\jetpack\\config\\autoscaler_archive.txt"
         )
 
+        parser.add_argument(
+            "--metrics-file", default="C:\\cycle\\jetpack\\config\\autoscaler_metrics.jsonl", dest="autoscale__metrics_file",
+            help="JSON-lines file the phase timings and counts of every round are appended to"
+        )
+
+        parser.add_argument(
+            "--prometheus-file", default=None, dest="autoscale__prometheus_file",
+            help="Prometheus textfile-collector file (*.prom) replaced with the metrics of the last round"
+        )
+
+        parser.add_argument(
+            "--round-budget", default=50.0, type=float, dest="autoscale__round_budget",
+            help="Seconds a round may take, the group tagging and the scale down check are skipped when it runs short"
+        )
+
+        parser.add_argument(
+            "--lock-file", default="C:\\cycle\\jetpack\\config\\autoscaler.lock", dest="autoscale__lock_file",
+            help="Lock file that keeps two autoscale rounds from running at once"
+        )
+
+        parser.add_argument(
+            "--overlap", default="skip", choices=["skip", "coalesce"], dest="autoscale__overlap",
+            help="What a run that overlaps a running round does: exit, or have the running round run once more"
+        )
+
+        parser.add_argument(
+            "--columnar", action="store_true", default=False, dest="autoscale__columnar",
+            help="Select the nodes to act on from a columnar view of the node states (requires numpy)"
+        )
+
+        parser.add_argument(
+            "--grow-history-file", default="C:\\cycle\\jetpack\\config\\autoscaler_grow_history.jsonl", dest="autoscale__grow_history_file",
+            help="JSON-lines file the grow decisions of every round are appended to, for the pre-warming forecast"
+        )
+
+        parser.add_argument(
+            "--prewarm", action="store_true", default=False, dest="autoscale__prewarm",
+            help="Start nodes ahead of the grow demand forecast from the grow decisions of the past days"
+        )
+
+        parser.add_argument(
+            "--prewarm-max-nodes", default=10, type=int, dest="autoscale__prewarm_max_nodes",
+            help="Pre-warmed nodes that may wait for their demand at once"
+        )
+
+        parser.add_argument(
+            "--hpcpack-retry-attempts", default=3, type=int, dest="hpcpack__retry_attempts",
+            help="Attempts of an idempotent REST call that fails with a connection error, a timeout or a 408/429/5xx status"
+        )
+
         parser.add_argument(
             "--hpcpack-pem", default="C:\\cycle\\jetpack\\config\\hpc-comm.pem", dest="hpcpack__pem"
         )
@@ -188,6 +312,32 @@ class HpcPackCLI(clilib.CommonCLI):
             "--hn-hostname", default="localhost", dest="hpcpack__hn_hostname"
         )
 
+        parser.add_argument(
+            "--hpcpack-pool-size", default=10, type=int, dest="hpcpack__pool_size"
+        )
+
+        parser.add_argument(
+            "--hpcpack-connect-timeout", default=10.0, type=float, dest="hpcpack__connect_timeout"
+        )
+
+        parser.add_argument(
+            "--hpcpack-read-timeout", default=120.0, type=float, dest="hpcpack__read_timeout"
+        )
+
+        parser.add_argument(
+            "--hpcpack-chunk-size", default=500, type=int, dest="hpcpack__chunk_size",
+            help="Nodes per request of the bulk node operations"
+        )
+
+        parser.add_argument(
+            "--hpcpack-node-id-cache-file", default="C:\\cycle\\jetpack\\config\\hpcpack_node_ids.json", dest="hpcpack__node_id_cache_file"
+        )
+
+        parser.add_argument(
+            "--hpcpack-async-client", action="store_true", default=False, dest="hpcpack__async_client",
+            help="Use the aiohttp based REST client (requires aiohttp)"
+        )
+
 
 
         
@@ -239,9 +389,18 @@ class HpcPackCLI(clilib.CommonCLI):
 
 
 
+def _config_files(argv: List[str]) -> List[str]:
+    # the -c/--config options clilib loads the config from, it does not pass their paths on
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument("-c", "--config", action="append", default=[])
+    return parser.parse_known_args(argv)[0].config
+
+
 def main(argv: Iterable[str] = None) -> None:
+    argv = list(argv or sys.argv[1:])
     hpcpack_cli = HpcPackCLI()
-    clilib.main(argv or sys.argv[1:], "hpcpack", hpcpack_cli, default_config=os.path.join(hpcpack_cli.autoscale_home, "autoscale.json"))
+    hpcpack_cli.config_files = _config_files(argv) or hpcpack_cli.config_files
+    clilib.main(argv, "hpcpack", hpcpack_cli, default_config=os.path.join(hpcpack_cli.autoscale_home, "autoscale.json"))
 
 
 if __name__ == "__main__":
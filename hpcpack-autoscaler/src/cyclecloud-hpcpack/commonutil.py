@@ -1,11 +1,170 @@
-from typing import Any, Callable, Dict, Iterable, List, Optional, Union, Set, TypeVar
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Generic, Iterable, Iterator, List, MutableMapping, MutableSet, NamedTuple, Optional, Tuple, Union, Set, TypeVar, ValuesView
+
+T = TypeVar("T")
+K = TypeVar("K")
+V = TypeVar("V")
+
+EPOCH = datetime(1970, 1, 1)
+
+def to_epoch(value: Optional[datetime]) -> Optional[float]:
+    # naive UTC datetime => UTC epoch seconds
+    return (value - EPOCH).total_seconds() if value is not None else None
+
+def from_epoch(value: Optional[float]) -> Optional[datetime]:
+    return EPOCH + timedelta(seconds=value) if value is not None else None
+
+def ci_key(a:Optional[str]) -> Optional[str]:
+    return a.casefold() if isinstance(a, str) else None
+
+class CISet(MutableSet[str]):
+    """
+    Case-insensitive set of strings, hashed by the casefolded value.
+    The first spelling added is kept and returned when iterating.
+    """
+    def __init__(self, values: Iterable[str] = ()) -> None:
+        self.__values: Dict[str, str] = {}
+        for v in values:
+            self.add(v)
+
+    def __contains__(self, value: object) -> bool:
+        return isinstance(value, str) and value.casefold() in self.__values
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__values.values())
+
+    def __len__(self) -> int:
+        return len(self.__values)
+
+    def add(self, value: str) -> None:
+        cvalue = value.casefold()
+        # a value casefolded already is its own key
+        self.__values.setdefault(value if cvalue == value else cvalue, value)
+
+    def update(self, values: Iterable[str]) -> None:
+        for v in values:
+            self.add(v)
+
+    def discard(self, value: str) -> None:
+        if isinstance(value, str):
+            self.__values.pop(value.casefold(), None)
+
+    def lookup(self, value: Optional[str]) -> Optional[str]:
+        key = ci_key(value)
+        return self.__values.get(key) if key is not None else None
+
+    def __str__(self) -> str:
+        return "CISet({})".format(list(self))
+
+    def __repr__(self) -> str:
+        return "CISet({})".format(list(self))
+
+class CIDict(MutableMapping[str, V], Generic[V]):
+    """
+    Case-insensitive dict keyed by the casefolded string, the original key spelling is kept.
+    Only the spellings that differ from the casefolded key are stored apart, and a key that is
+    casefolded already is used as is, so the common lower case keys cost one dict entry.
+    """
+    def __init__(self, items: Union[Iterable[Tuple[str, V]], Dict[str, V]] = ()) -> None:
+        self.__values: Dict[str, V] = {}
+        # casefolded key -> original spelling, for the keys not casefolded already
+        self.__spellings: Dict[str, str] = {}
+        if isinstance(items, dict):
+            items = items.items()
+        for k, v in items:
+            self[k] = v
+
+    def __getitem__(self, key: str) -> V:
+        ckey = ci_key(key)
+        if ckey is None or ckey not in self.__values:
+            raise KeyError(key)
+        return self.__values[ckey]
+
+    def __setitem__(self, key: str, value: V) -> None:
+        ckey = key.casefold()
+        if ckey not in self.__values:
+            if ckey == key:
+                ckey = key
+            else:
+                self.__spellings[ckey] = key
+        self.__values[ckey] = value
+
+    def __delitem__(self, key: str) -> None:
+        ckey = ci_key(key)
+        if ckey is None or ckey not in self.__values:
+            raise KeyError(key)
+        del self.__values[ckey]
+        self.__spellings.pop(ckey, None)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and key.casefold() in self.__values
+
+    def __iter__(self) -> Iterator[str]:
+        if not self.__spellings:
+            return iter(self.__values)
+        return (self.__spellings.get(k, k) for k in self.__values)
+
+    # get/setdefault/pop/values are overridden, the Mapping mixins go through KeyError and are slow in hot loops
+    def get(self, key: Optional[str], default: Any = None) -> Any:
+        return self.__values.get(key.casefold(), default) if isinstance(key, str) else default
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        ckey = key.casefold()
+        if ckey in self.__values:
+            return self.__values[ckey]
+        self[key] = default
+        return default
+
+    def pop(self, key: Optional[str], *default: Any) -> Any:
+        ckey = ci_key(key)
+        if ckey is not None and ckey in self.__values:
+            self.__spellings.pop(ckey, None)
+            return self.__values.pop(ckey)
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def values(self) -> ValuesView[V]:
+        return self.__values.values()
+
+    def clear(self) -> None:
+        self.__values.clear()
+        self.__spellings.clear()
+
+    def __len__(self) -> int:
+        return len(self.__values)
+
+    def lookup(self, key: Optional[str]) -> Optional[str]:
+        ckey = ci_key(key)
+        if ckey is None or ckey not in self.__values:
+            return None
+        return self.__spellings.get(ckey, ckey)
+
+    def __str__(self) -> str:
+        return "CIDict({})".format(dict(self.items()))
+
+    def __repr__(self) -> str:
+        return "CIDict({})".format(dict(self.items()))
+
+def ci_dict(source: Iterable[T], keyfunc: Callable[[T], Optional[str]]) -> CIDict[T]:
+    # Index the items by a case-insensitive key, the first item wins and None keys are skipped
+    ret: CIDict[T] = CIDict()
+    for item in source:
+        key = keyfunc(item)
+        if key is not None and key not in ret:
+            ret[key] = item
+    return ret
 
 def ci_equals(a:Optional[str], b:Optional[str]) -> bool:
     if a is None or b is None:
         return a == b
     return a.casefold() == b.casefold()
 
-def ci_in(a:str, b:Union[List[str], Set[str], Dict[str, Any]]) -> bool:
+def ci_in(a:str, b:Union[List[str], Set[str], Dict[str, Any], CISet, CIDict]) -> bool:
+    if isinstance(b, (CISet, CIDict)):
+        return a in b
     if isinstance(b, dict):
         b = b.keys()
     for c in b:
@@ -13,35 +172,23 @@ def ci_in(a:str, b:Union[List[str], Set[str], Dict[str, Any]]) -> bool:
             return True
     return False
 
-def ci_notin(a:str, b:Union[List[str], Set[str], Dict[str, Any]]) -> bool:
+def ci_notin(a:str, b:Union[List[str], Set[str], Dict[str, Any], CISet, CIDict]) -> bool:
     return not ci_in(a, b)
 
-def ci_lookup(a:str, b:Union[List[str], Set[str]]) -> Optional[str]:
+def ci_lookup(a:str, b:Union[List[str], Set[str], CISet]) -> Optional[str]:
+    if isinstance(b, CISet):
+        return b.lookup(a)
     for c in b:
         if ci_equals(a, c):
             return c
     return False
 
-def ci_set(a:Union[List[str], Set[str]]) -> Set[str]:
-    dic: Dict[str, str] = {}
-    for c in a:
-        if c.casefold() in dic:
-            continue
-        dic[c.casefold()] = c
-    return set(dic.values())
-
-def ci_interset(a:Union[List[str], Set[str]], b:Union[List[str], Set[str]]) -> Set[str]:
-    r = set()
-    a = ci_set(a)
-    b = ci_set(b)
-    for c in a:
-        if ci_in(c, b):
-            r.add(c)
-    return r
+def ci_set(a:Union[List[str], Set[str], CISet]) -> Set[str]:
+    return set(a if isinstance(a, CISet) else CISet(a))
 
-T = TypeVar("T")
-K = TypeVar("K")
-V = TypeVar("V")
+def ci_interset(a:Union[List[str], Set[str], CISet], b:Union[List[str], Set[str], CISet]) -> Set[str]:
+    b = b if isinstance(b, CISet) else CISet(b)
+    return set(c for c in CISet(a) if c in b)
 
 def ci_find_one(source: Iterable[T], target_value:str, target_func:Callable[[T], str]) -> Optional[T]:
     for i in source:
@@ -79,4 +226,137 @@ def make_dict_single(
                     )
                 )
         ret[key] = value[0]
-    return ret
\ No newline at end of file
+    return ret
+
+def run_concurrently(
+    tasks: Dict[str, Callable[[], Any]],
+    max_workers: int = 4,
+    timeout: Optional[float] = None,
+    timeouts: Optional[Dict[str, Optional[float]]] = None
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Runs independent callables on a bounded thread pool, returns (results, seconds taken) keyed by task name.
+    Each task must finish within its timeout in timeouts, or timeout, seconds of the start, the first failure
+    or timeout is raised.
+    """
+    elapsed: Dict[str, float] = {}
+    start = time.monotonic()
+    task_timeouts = {name: (timeouts or {}).get(name, timeout) for name in tasks}
+
+    def timed(name: str, func: Callable[[], Any]) -> Any:
+        task_start = time.monotonic()
+        try:
+            return func()
+        finally:
+            elapsed[name] = time.monotonic() - task_start
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks))))
+    try:
+        futures = {name: executor.submit(timed, name, func) for name, func in tasks.items()}
+        results: Dict[str, Any] = {}
+        # the shortest timeouts first, a task is not waited for past its own timeout while a slower one runs
+        for name in sorted(futures, key=lambda n: (task_timeouts[n] is None, task_timeouts[n] or 0.0)):
+            task_timeout = task_timeouts[name]
+            remaining = None if task_timeout is None else max(0, task_timeout - (time.monotonic() - start))
+            try:
+                results[name] = futures[name].result(timeout=remaining)
+            except FutureTimeoutError:
+                raise TimeoutError("{} did not finish within {} seconds".format(name, task_timeout))
+        return {name: results[name] for name in tasks}, elapsed
+    finally:
+        # do not block on a timed-out task, its thread finishes in the background
+        executor.shutdown(wait=False)
+
+ChunkResult = NamedTuple("ChunkResult", [("index", int), ("items", List[Any]), ("result", Any), ("error", Optional[BaseException])])
+
+def chunked(items: List[T], chunk_size: int) -> List[List[T]]:
+    chunk_size = max(1, chunk_size)
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+def run_chunked(
+    func: Callable[[List[T]], Any], items: List[T], chunk_size: int, max_workers: int = 4, timeout: Optional[float] = None
+) -> List[ChunkResult]:
+    """
+    Calls func for each chunk of items with at most max_workers chunks in flight, returns a ChunkResult per chunk in order.
+    A chunk that raises or does not finish within timeout seconds of the start gets its error set, the others are not affected.
+    """
+    chunks = chunked(list(items), chunk_size)
+    if len(chunks) == 1:
+        try:
+            return [ChunkResult(0, chunks[0], func(chunks[0]), None)]
+        except Exception as e:
+            return [ChunkResult(0, chunks[0], None, e)]
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks))))
+    try:
+        futures = [executor.submit(func, chunk) for chunk in chunks]
+        results: List[ChunkResult] = []
+        for index, (chunk, future) in enumerate(zip(chunks, futures)):
+            remaining = None if timeout is None else max(0, timeout - (time.monotonic() - start))
+            try:
+                results.append(ChunkResult(index, chunk, future.result(timeout=remaining), None))
+            except FutureTimeoutError:
+                # a chunk that has not started yet is not sent at all
+                future.cancel()
+                results.append(ChunkResult(index, chunk, None, TimeoutError("chunk {} did not finish within {} seconds".format(index, timeout))))
+            except Exception as e:
+                results.append(ChunkResult(index, chunk, None, e))
+        return results
+    finally:
+        executor.shutdown(wait=False)
+
+ActionResult = NamedTuple("ActionResult", [("name", str), ("result", Any), ("error", Optional[BaseException]), ("seconds", float)])
+
+def run_dependent(
+    tasks: Dict[str, Callable[[], Any]], depends_on: Dict[str, List[str]], max_workers: int = 4, timeout: Optional[float] = None
+) -> Dict[str, ActionResult]:
+    """
+    Runs the callables on a bounded thread pool, each one once the tasks it depends on have succeeded, returns an ActionResult
+    per task name. A task that raises or does not finish within timeout seconds of the start gets its error set, and so do
+    the tasks that depend on it, which are not run. The other tasks are not affected.
+    """
+    start = time.monotonic()
+    results: Dict[str, ActionResult] = {}
+    pending = dict(tasks)
+    running: Dict[Future, str] = {}
+
+    def timed(func: Callable[[], Any]) -> Tuple[Any, Optional[BaseException], float]:
+        task_start = time.monotonic()
+        try:
+            return func(), None, time.monotonic() - task_start
+        except Exception as e:
+            return None, e, time.monotonic() - task_start
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks) or 1)))
+    try:
+        while pending or running:
+            for name in list(pending):
+                deps = [d for d in depends_on.get(name, []) if d in tasks]
+                failed = [d for d in deps if d in results and results[d].error is not None]
+                if failed:
+                    del pending[name]
+                    results[name] = ActionResult(name, None, RuntimeError("not run, {} failed".format(", ".join(failed))), 0.0)
+                elif all(d in results for d in deps):
+                    running[executor.submit(timed, pending.pop(name))] = name
+            if not running:
+                # the tasks left wait for each other
+                for name in pending:
+                    results[name] = ActionResult(name, None, RuntimeError("not run, circular dependency"), 0.0)
+                break
+            remaining = None if timeout is None else max(0, timeout - (time.monotonic() - start))
+            done, _ = wait(list(running), timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                for future, name in running.items():
+                    future.cancel()
+                    results[name] = ActionResult(name, None, TimeoutError("{} did not finish within {} seconds".format(name, timeout)),
+                                                 time.monotonic() - start)
+                for name in pending:
+                    results[name] = ActionResult(name, None, TimeoutError("{} did not start within {} seconds".format(name, timeout)), 0.0)
+                break
+            for future in done:
+                name = running.pop(future)
+                results[name] = ActionResult(name, *future.result())
+        return results
+    finally:
+        # do not block on a timed-out task, its thread finishes in the background
+        executor.shutdown(wait=False)
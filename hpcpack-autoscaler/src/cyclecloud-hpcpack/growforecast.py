@@ -0,0 +1,167 @@
+import bisect
+import json
+import os
+import hpc.autoscale.hpclogging as logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from .commonutil import CIDict, to_epoch
+from .hpcpackdriver import GrowDecision
+
+DEFAULT_GROW_HISTORY_FILE = "C:\\cycle\\jetpack\\config\\autoscaler_grow_history.jsonl"
+# days of grow decisions the forecast averages over
+DEFAULT_PREWARM_DAYS = 7
+# minutes ahead of the predicted demand the nodes are pre-warmed
+DEFAULT_PREWARM_LEAD_MINUTES = 30
+DAY_SECONDS = 86400
+
+
+class GrowHistory:
+    """
+    Time series of the grow decisions, one JSON line per round with the nodes and cores each node
+    group asked for, kept for the days the forecast looks back on. A round with no demand is
+    recorded too, so that the forecast tells a quiet day from a day with no records.
+
+    The forecast is a seasonal moving average: the peak demand of each group in the lead window,
+    taken at the same time of day on each of the past days that has records, averaged over them.
+    The records are only loaded for the forecast, a round recording its grow decisions appends
+    them to the file without reading it.
+    """
+    def __init__(
+        self,
+        history_file: str,
+        days: int = DEFAULT_PREWARM_DAYS,
+        lead_minutes: float = DEFAULT_PREWARM_LEAD_MINUTES
+    ) -> None:
+        self.__history_file = history_file
+        self.__days = days
+        self.__lead_seconds = lead_minutes * 60
+        # sorted by time, (epoch seconds, group -> [nodes, cores])
+        self.__times: List[float] = []
+        self.__demands: List[Dict[str, List[float]]] = []
+        self.__loaded = False
+
+    @property
+    def records(self) -> int:
+        """
+        The records loaded, none until the history is loaded by reload or forecast.
+        """
+        return len(self.__times)
+
+    def __retained_since(self, now_ts: float) -> float:
+        return now_ts - self.__days * DAY_SECONDS
+
+    def reload(self) -> None:
+        self.__times, self.__demands = [], []
+        self.__loaded = True
+        if not os.path.exists(self.__history_file):
+            return
+        now_ts = to_epoch(datetime.utcnow())
+        records: List[Tuple[float, Dict[str, List[float]]]] = []
+        expired = 0
+        try:
+            with open(self.__history_file, "r", encoding="utf-8") as hf:
+                for line in hf:
+                    try:
+                        record = json.loads(line)
+                        ts, demand = float(record["t"]), record.get("g") or {}
+                    except (ValueError, KeyError, TypeError):
+                        # a line torn by a crash, or written by hand
+                        continue
+                    if ts < self.__retained_since(now_ts):
+                        expired += 1
+                        continue
+                    records.append((ts, demand))
+        except OSError as e:
+            logging.warning("Failed to load the grow history from {}: {}".format(self.__history_file, e))
+            return
+        records.sort(key=lambda r: r[0])
+        self.__times = [r[0] for r in records]
+        self.__demands = [r[1] for r in records]
+        # the file is appended to every round, drop the expired records once they are a tenth of it
+        if expired > len(records) // 10:
+            self.__rewrite(records)
+
+    def __rewrite(self, records: List[Tuple[float, Dict[str, List[float]]]]) -> None:
+        tmp_file = self.__history_file + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as hf:
+                for ts, demand in records:
+                    hf.write(_record_line(ts, demand))
+            os.replace(tmp_file, self.__history_file)
+        except OSError as e:
+            logging.warning("Failed to compact the grow history {}: {}".format(self.__history_file, e))
+
+    def record(self, grow_decisions: Dict[str, GrowDecision], now: Optional[datetime] = None) -> None:
+        """
+        Appends the grow decisions of a round, the history must never fail the round.
+        """
+        ts = to_epoch(now or datetime.utcnow())
+        # grow_by_socket not supported yet, treat as grow_by_node
+        demand = {grp: [d.nodes_to_grow + d.sockets_to_grow, d.cores_to_grow] for grp, d in grow_decisions.items()
+                  if d.nodes_to_grow + d.sockets_to_grow + d.cores_to_grow > 0}
+        try:
+            with open(self.__history_file, "a", encoding="utf-8") as hf:
+                hf.write(_record_line(ts, demand))
+        except OSError as e:
+            logging.warning("Failed to record the grow decisions in {}: {}".format(self.__history_file, e))
+            return
+        if self.__loaded:
+            index = bisect.bisect_right(self.__times, ts)
+            self.__times.insert(index, ts)
+            self.__demands.insert(index, demand)
+        elif self.__oldest_record() < self.__retained_since(ts) - self.__days * DAY_SECONDS / 10:
+            # the expired records are a tenth of the file, the reload drops them
+            self.reload()
+
+    def __oldest_record(self) -> float:
+        # the records are appended in time order and compacted sorted, the first one is the oldest
+        try:
+            with open(self.__history_file, "r", encoding="utf-8") as hf:
+                return float(json.loads(hf.readline())["t"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return float("inf")
+
+    def forecast(self, now: Optional[datetime] = None) -> Dict[str, GrowDecision]:
+        """
+        The demand of each node group expected within the lead time from now, see the class.
+        """
+        if not self.__loaded:
+            self.reload()
+        now_ts = to_epoch(now or datetime.utcnow())
+        totals: CIDict[List[float]] = CIDict()
+        days_with_records = 0
+        for day in range(1, self.__days + 1):
+            start = now_ts - day * DAY_SECONDS
+            first = bisect.bisect_left(self.__times, start)
+            last = bisect.bisect_right(self.__times, start + self.__lead_seconds)
+            if first == last:
+                continue
+            days_with_records += 1
+            peaks: CIDict[List[float]] = CIDict()
+            for demand in self.__demands[first:last]:
+                for grp, (nodes, cores) in demand.items():
+                    peak = peaks.setdefault(grp, [0.0, 0.0])
+                    peak[0], peak[1] = max(peak[0], nodes), max(peak[1], cores)
+            for grp, (nodes, cores) in peaks.items():
+                total = totals.setdefault(grp, [0.0, 0.0])
+                total[0] += nodes
+                total[1] += cores
+        if days_with_records == 0:
+            return {}
+        return {grp: GrowDecision(cores / days_with_records, nodes / days_with_records, 0.0) for grp, (nodes, cores) in totals.items()}
+
+
+def _record_line(ts: float, demand: Dict[str, Any]) -> str:
+    return json.dumps({"t": round(ts, 3), "g": demand}, separators=(",", ":")) + "\n"
+
+
+def new_grow_history(config: Dict[str, Any]) -> Optional[GrowHistory]:
+    autoscale_config = config.get("autoscale") or {}
+    # an empty or null grow_history_file turns the recording, and so the pre-warming, off
+    history_file = autoscale_config.get("grow_history_file", DEFAULT_GROW_HISTORY_FILE)
+    if not history_file:
+        return None
+    return GrowHistory(
+        history_file,
+        days=autoscale_config.get("prewarm_days") or DEFAULT_PREWARM_DAYS,
+        lead_minutes=autoscale_config.get("prewarm_lead_minutes") or DEFAULT_PREWARM_LEAD_MINUTES)
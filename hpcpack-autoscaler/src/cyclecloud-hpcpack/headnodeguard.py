@@ -0,0 +1,181 @@
+import random
+import threading
+import time
+import hpc.autoscale.hpclogging as logging
+from typing import Any, Dict, Optional
+
+# statuses worth another attempt, the other 4xx statuses fail the same way every time
+RETRYABLE_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+
+class RoundDeadline:
+    """
+    The time budget of one autoscale round, None for no budget.
+    """
+    def __init__(self, budget: Optional[float] = None) -> None:
+        self.budget = budget
+        self.__start = time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.__start
+
+    def remaining(self) -> float:
+        if self.budget is None:
+            return float("inf")
+        return max(0.0, self.budget - self.elapsed())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cap(self, timeout: Optional[float], minimum: float = 1.0) -> Optional[float]:
+        """
+        The timeout cut down to the remaining budget, but no less than minimum seconds so
+        that the essential calls of an overrun round still get a short chance.
+        """
+        if self.budget is None:
+            return timeout
+        remaining = max(minimum, self.remaining())
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of the head node from the outcome of the REST calls. After failure_threshold
+    consecutive failures (errors, timeouts or calls slower than slow_call_seconds) the breaker opens
+    for reset_timeout seconds, the calls that succeed meanwhile do not close it, then lets the next
+    call decide whether it closes or opens again.
+
+    An open breaker does not block calls, the scale up must go on, it turns off the retries and
+    tells the autoscaler to skip the phases it can do without.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    DEFAULT_FAILURE_THRESHOLD = 5
+    DEFAULT_RESET_TIMEOUT = 300.0
+    DEFAULT_SLOW_CALL_SECONDS = 30.0
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+        slow_call_seconds: float = DEFAULT_SLOW_CALL_SECONDS
+    ) -> None:
+        self.__failure_threshold = max(1, failure_threshold)
+        self.__reset_timeout = reset_timeout
+        self.__slow_call_seconds = slow_call_seconds
+        self.__failures = 0
+        self.__opened_at: Optional[float] = None
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.__opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.__opened_at >= self.__reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def degraded(self) -> bool:
+        return self.state == self.OPEN
+
+    def record_success(self, seconds: float = 0.0) -> None:
+        if seconds > self.__slow_call_seconds:
+            self.record_failure("call took {:.1f}s".format(seconds))
+            return
+        with self.__lock:
+            state = self.state
+            if state == self.OPEN:
+                return
+            if state == self.HALF_OPEN:
+                logging.info("Head node circuit breaker closed")
+            self.__failures = 0
+            self.__opened_at = None
+
+    def record_failure(self, reason: str = "") -> None:
+        with self.__lock:
+            self.__failures += 1
+            state = self.state
+            if state == self.HALF_OPEN or (state == self.CLOSED and self.__failures >= self.__failure_threshold):
+                logging.warning("Head node circuit breaker opened after {} consecutive failures, last: {}".format(self.__failures, reason))
+                self.__opened_at = time.monotonic()
+
+
+class HeadNodeGuard:
+    """
+    Retry, deadline and circuit breaker policy shared by the calls of a REST client. Idempotent calls
+    that fail with a connection error, a timeout or a retryable status are retried with full-jitter
+    exponential backoff, as long as the breaker is closed and the round deadline leaves room for it.
+    """
+    DEFAULT_RETRY_ATTEMPTS = 3
+    DEFAULT_RETRY_BASE_DELAY = 0.5
+    DEFAULT_RETRY_MAX_DELAY = 8.0
+
+    def __init__(
+        self,
+        retry_attempts: int = DEFAULT_RETRY_ATTEMPTS,
+        retry_base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+        retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+        breaker: Optional[CircuitBreaker] = None,
+        seed: Optional[int] = None
+    ) -> None:
+        self.__retry_attempts = max(1, retry_attempts)
+        self.__retry_base_delay = retry_base_delay
+        self.__retry_max_delay = retry_max_delay
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.deadline = RoundDeadline()
+        # retries of the current round
+        self.retries = 0
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+
+    def start_round(self, deadline: RoundDeadline) -> None:
+        self.deadline = deadline
+        self.retries = 0
+
+    def timeout(self, timeout: Optional[float]) -> Optional[float]:
+        return self.deadline.cap(timeout)
+
+    def succeeded(self, seconds: float) -> None:
+        self.breaker.record_success(seconds)
+
+    def failed(
+        self,
+        attempt: int,
+        status: Optional[int],
+        idempotent: bool = True,
+        retry_after: Optional[str] = None
+    ) -> Optional[float]:
+        """
+        Records a failed attempt (status None: no response at all) and returns the seconds to wait before
+        the next attempt, or None if the call must not be retried.
+        """
+        if status is not None and status not in RETRYABLE_STATUSES:
+            # the head node answered, it is not the head node that is in trouble
+            return None
+        self.breaker.record_failure("status {}".format(status) if status is not None else "no response")
+        if not idempotent or attempt + 1 >= self.__retry_attempts or self.breaker.degraded:
+            return None
+        with self.__lock:
+            delay = self.__random.uniform(0, min(self.__retry_max_delay, self.__retry_base_delay * 2 ** attempt))
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, min(self.__retry_max_delay, float(retry_after)))
+            if delay >= self.deadline.remaining():
+                return None
+            self.retries += 1
+            return delay
+
+
+def new_head_node_guard(hpcpack_config: Dict[str, Any]) -> HeadNodeGuard:
+    breaker = CircuitBreaker(
+        failure_threshold=hpcpack_config.get('breaker_failures') or CircuitBreaker.DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=hpcpack_config.get('breaker_reset_timeout') or CircuitBreaker.DEFAULT_RESET_TIMEOUT,
+        slow_call_seconds=hpcpack_config.get('slow_call_seconds') or CircuitBreaker.DEFAULT_SLOW_CALL_SECONDS)
+    return HeadNodeGuard(
+        retry_attempts=hpcpack_config.get('retry_attempts') or HeadNodeGuard.DEFAULT_RETRY_ATTEMPTS,
+        retry_base_delay=hpcpack_config.get('retry_base_delay') or HeadNodeGuard.DEFAULT_RETRY_BASE_DELAY,
+        retry_max_delay=hpcpack_config.get('retry_max_delay') or HeadNodeGuard.DEFAULT_RETRY_MAX_DELAY,
+        breaker=breaker)
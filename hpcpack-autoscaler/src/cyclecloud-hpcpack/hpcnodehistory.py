@@ -1,45 +1,145 @@
-from hpc.autoscale.util import partition_single
 import jsonpickle
 import os
+import shutil
 import hpc.autoscale.hpclogging as logging
 from datetime import datetime, timedelta
-from typing import Dict, Iterable, Optional, List
+from typing import Any, Dict, Iterable, Optional, List, Set, Union
 from hpc.autoscale.node.node import Node
-from .commonutil import ci_find_one, ci_in, ci_notin, ci_equals
+from .commonutil import CIDict, CISet, ci_dict, ci_equals, from_epoch, to_epoch
 from .hpcpackdriver import HpcNode
+from .roundlock import RoundLock
+from .statestore import JournaledStateStore
 
 class NodeHistoryItem:
+    # Timestamps are kept as UTC epoch seconds and exposed as naive UTC datetimes
+    __slots__ = ("cc_id", "_hostname", "_hpc_id", "emerge_ts", "start_ts", "idle_ts", "stop_ts", "prewarm_ts", "prewarm_hit_ts",
+                 "_history")
+
     def __init__(
         self,
         cc_node_id: str,
         hostname: Optional[str] = None,
-        emerge_time: datetime = datetime.utcnow()
+        emerge_time: Optional[datetime] = None
     ) -> None:
+        # The owning HpcNodeHistory, notified when an indexed key (hpc_id, hostname) changes
+        self._history: Optional["HpcNodeHistory"] = None
         self.cc_id = cc_node_id
         self.hostname = hostname
-        self.emerge_time = emerge_time
-        self.start_time = datetime.utcnow()
         self.hpc_id = None
-        self.idle_from: Optional[datetime] = None
-        self.stop_time: Optional[datetime] = None
+        now = to_epoch(datetime.utcnow())
+        self.emerge_ts = to_epoch(emerge_time) if emerge_time is not None else now
+        self.start_ts = now
+        self.idle_ts: Optional[float] = None
+        self.stop_ts: Optional[float] = None
+        # set when the node was started ahead of a predicted demand, and when it first ran jobs
+        self.prewarm_ts: Optional[float] = None
+        self.prewarm_hit_ts: Optional[float] = None
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # The owning history journals the items whose fields changed since its last save. A property
+        # (hostname, idle_from, ...) is reported through the slot it sets
+        history = getattr(self, "_history", None)
+        if history is not None and name in _RECORD_SLOTS and getattr(self, name, None) != value:
+            history._on_item_changed(self)
+        object.__setattr__(self, name, value)
+
+    @property
+    def hpc_id(self) -> Optional[str]:
+        return self._hpc_id
+
+    @hpc_id.setter
+    def hpc_id(self, value: Optional[str]) -> None:
+        # unset while the item is restored from a legacy state file
+        old = getattr(self, "_hpc_id", None)
+        self._hpc_id = value
+        history = getattr(self, "_history", None)
+        if history is not None:
+            history._on_key_changed(self, "hpc_id", old, value)
+
+    @property
+    def hostname(self) -> Optional[str]:
+        return self._hostname
+
+    @hostname.setter
+    def hostname(self, value: Optional[str]) -> None:
+        old = getattr(self, "_hostname", None)
+        self._hostname = value
+        history = getattr(self, "_history", None)
+        if history is not None:
+            history._on_key_changed(self, "hostname", old, value)
+
+    @property
+    def emerge_time(self) -> datetime:
+        return from_epoch(self.emerge_ts)
+
+    @emerge_time.setter
+    def emerge_time(self, value: datetime) -> None:
+        self.emerge_ts = to_epoch(value)
+
+    @property
+    def start_time(self) -> datetime:
+        return from_epoch(self.start_ts)
+
+    @start_time.setter
+    def start_time(self, value: datetime) -> None:
+        self.start_ts = to_epoch(value)
+
+    @property
+    def idle_from(self) -> Optional[datetime]:
+        return from_epoch(self.idle_ts)
+
+    @idle_from.setter
+    def idle_from(self, value: Optional[datetime]) -> None:
+        self.idle_ts = to_epoch(value)
+
+    @property
+    def stop_time(self) -> Optional[datetime]:
+        return from_epoch(self.stop_ts)
+
+    @stop_time.setter
+    def stop_time(self, value: Optional[datetime]) -> None:
+        self.stop_ts = to_epoch(value)
+
+    @property
+    def prewarm_time(self) -> Optional[datetime]:
+        return from_epoch(self.prewarm_ts)
+
+    @prewarm_time.setter
+    def prewarm_time(self, value: Optional[datetime]) -> None:
+        self.prewarm_ts = to_epoch(value)
+
+    @property
+    def prewarm_hit_time(self) -> Optional[datetime]:
+        return from_epoch(self.prewarm_hit_ts)
+
+    @prewarm_hit_time.setter
+    def prewarm_hit_time(self, value: Optional[datetime]) -> None:
+        self.prewarm_hit_ts = to_epoch(value)
+
+    @property
+    def prewarm_pending(self) -> bool:
+        # pre-warmed and waiting for the predicted demand
+        return self.prewarm_ts is not None and self.prewarm_hit_ts is None
 
     @property
     def stopped(self):
-        return self.stop_time is not None
+        return self.stop_ts is not None
 
     def restart(self):
-        self.idle_from = None
-        self.stop_time = None
+        self.idle_ts = None
+        self.stop_ts = None
+        self.prewarm_ts = None
+        self.prewarm_hit_ts = None
         self.start_time = datetime.utcnow()
 
     def reset_hpc_id(self, new_id: Optional[str] = None):
-        self.idle_from = None
+        self.idle_ts = None
         self.hpc_id = new_id
 
     def idle_timeout(self, idle_timeout_seconds: int = 900):
-        if self.stopped or not self.idle_from or not self.hpc_id:
+        if self.stopped or self.idle_ts is None or not self.hpc_id:
             return False
-        return self.idle_from + timedelta(seconds=idle_timeout_seconds) < datetime.utcnow()
+        return self.idle_ts + idle_timeout_seconds < to_epoch(datetime.utcnow())
 
     def __str__(self) -> str:
         return "HpcNodeItem(cc_id={}, hostname={}, hpc_id={}, emerge_time={}, start_time={}, idle_from={}, stop_time={})".format(
@@ -49,9 +149,38 @@ class NodeHistoryItem:
         return "HpcNodeItem(cc_id={}, hostname={}, hpc_id={}, emerge_time={}, start_time={}, idle_from={}, stop_time={})".format(
             self.cc_id, self.hostname, self.hpc_id, self.emerge_time, self.start_time, self.idle_from, self.stop_time)
 
-    def archive_str(self, archive_time = datetime.utcnow()) -> str:
+    def to_record(self) -> List[Any]:
+        # Compact record layout of state format version 2, see JournaledStateStore.VERSION. The
+        # pre-warm times are appended for the pre-warmed nodes only, the other records keep their size
+        record = [self.cc_id, self.hostname, self.hpc_id, self.emerge_ts, self.start_ts, self.idle_ts, self.stop_ts]
+        if self.prewarm_ts is not None:
+            record.extend([self.prewarm_ts, self.prewarm_hit_ts])
+        return record
+
+    @classmethod
+    def from_record(cls, record: List[Any]) -> "NodeHistoryItem":
+        # not owned by a history yet, the slots are set without the change tracking of __setattr__
+        item = cls.__new__(cls)
+        object.__setattr__(item, "_history", None)
+        values = record if len(record) > 7 else record + [None, None]
+        for set_slot, value in zip(_RECORD_SLOT_SETTERS, values):
+            set_slot(item, value)
+        return item
+
+    def archive_str(self, archive_time: Optional[datetime] = None) -> str:
         return "cc_id={}, hostname={}, hpc_id={}, emerge_time={}, stop_time={}, archive_time={}".format(
-            self.cc_id, self.hostname, self.hpc_id, self.emerge_time, self.stop_time, archive_time)
+            self.cc_id, self.hostname, self.hpc_id, self.emerge_time, self.stop_time, archive_time or datetime.utcnow())
+
+
+# The slots of the record fields, in the order of NodeHistoryItem.to_record. A change of any of
+# them is journaled by the next save
+_RECORD_LAYOUT = ("cc_id", "_hostname", "_hpc_id", "emerge_ts", "start_ts", "idle_ts", "stop_ts", "prewarm_ts", "prewarm_hit_ts")
+_RECORD_SLOTS = frozenset(_RECORD_LAYOUT)
+_RECORD_SLOT_SETTERS = [NodeHistoryItem.__dict__[name].__set__ for name in _RECORD_LAYOUT]
+
+# An entry of the secondary indexes of HpcNodeHistory
+IndexEntry = Union[NodeHistoryItem, List[NodeHistoryItem]]
+
 
 class HpcNodeHistory:
     def __init__(
@@ -59,19 +188,108 @@ class HpcNodeHistory:
         statefile: str,
         archivefile: str,
         provisioning_timeout: int = 1500,
-        idle_timeout: int = 900
+        idle_timeout: int = 900,
+        compact_every: int = 60,
+        lock: Optional[RoundLock] = None,
+        lock_timeout: float = 30.0
     ) -> None:
         self.__statefile = statefile
+        # held while saving, so that two processes never write the state files at once
+        self.__lock = lock
+        self.__lock_timeout = lock_timeout
+        # The state is persisted as per-save deltas in a journal, compacted into the statefile
+        self.__store = JournaledStateStore(statefile, compact_every=compact_every)
+        # Whether the store holds the items as of the last save or load, and the changes since: the
+        # items changed or inserted (by id), and the cc_ids of the items removed
+        self.__in_store = False
+        self.__changed: Dict[int, NodeHistoryItem] = {}
+        self.__removed: Set[str] = set()
         self.__provisioning_timeout = provisioning_timeout
         self.__idle_timeout = idle_timeout
         self.__archivefile = archivefile
-        self.__items: List[NodeHistoryItem] = []
+        # Items keyed by cc_id, plus case-insensitive secondary indexes by hpc_id and hostname. An
+        # index holds the item of a key itself, and a list only for the keys of several items
+        self.__items: CIDict[NodeHistoryItem] = CIDict()
+        self.__by_hpc_id: CIDict[IndexEntry] = CIDict()
+        self.__by_hostname: CIDict[IndexEntry] = CIDict()
         self.__items_to_archive: List[NodeHistoryItem] = []
         self.reload()
 
     @property
     def items(self) -> List[NodeHistoryItem]:
-        return self.__items
+        return list(self.__items.values())
+
+    @property
+    def changed_on_disk(self) -> bool:
+        # saved by another process since this one last loaded or saved it
+        return self.__store.changed_on_disk
+
+    def _on_item_changed(self, item: NodeHistoryItem) -> None:
+        self.__changed[id(item)] = item
+
+    def _on_key_changed(self, item: NodeHistoryItem, key: str, old: Optional[str], new: Optional[str]) -> None:
+        index = self.__by_hpc_id if key == "hpc_id" else self.__by_hostname
+        self.__index_remove(index, old, item)
+        self.__index_add(index, new, item)
+
+    def __index_add(self, index: CIDict[IndexEntry], key: Optional[str], item: NodeHistoryItem) -> None:
+        if not key:
+            return
+        entry = index.get(key)
+        if entry is None:
+            index[key] = item
+        elif isinstance(entry, list):
+            entry.append(item)
+        else:
+            index[key] = [entry, item]
+
+    def __index_remove(self, index: CIDict[IndexEntry], key: Optional[str], item: NodeHistoryItem) -> None:
+        entry = index.get(key) if key else None
+        if entry is None:
+            return
+        if isinstance(entry, list):
+            remaining = [i for i in entry if i is not item]
+        else:
+            remaining = [] if entry is item else [entry]
+        if not remaining:
+            del index[key]
+        elif len(remaining) == 1:
+            index[key] = remaining[0]
+        else:
+            index[key] = remaining
+
+    def __index_get(self, index: CIDict[IndexEntry], key: Optional[str]) -> List[NodeHistoryItem]:
+        entry = index.get(key)
+        if entry is None:
+            return []
+        return entry if isinstance(entry, list) else [entry]
+
+    def __add(self, item: NodeHistoryItem) -> None:
+        self.__items[item.cc_id] = item
+        self.__index_add(self.__by_hpc_id, item.hpc_id, item)
+        self.__index_add(self.__by_hostname, item.hostname, item)
+        item._history = self
+        self.__changed[id(item)] = item
+
+    def __remove(self, item: NodeHistoryItem) -> None:
+        item._history = None
+        del self.__items[item.cc_id]
+        self.__index_remove(self.__by_hpc_id, item.hpc_id, item)
+        self.__index_remove(self.__by_hostname, item.hostname, item)
+        self.__removed.add(item.cc_id)
+
+    def __clear(self) -> None:
+        for item in self.__items.values():
+            item._history = None
+        self.__items.clear()
+        self.__by_hpc_id.clear()
+        self.__by_hostname.clear()
+        self.__changed.clear()
+        self.__removed.clear()
+
+    def archive(self, item: NodeHistoryItem) -> None:
+        self.__remove(item)
+        self.__items_to_archive.append(item)
 
     def find(
         self, 
@@ -81,15 +299,30 @@ class HpcNodeHistory:
     ) -> Optional[NodeHistoryItem]:
         if not (bool(cc_id) or bool(hpc_id) or bool(hostname)):
             raise Exception("Specify at least one condition")
-        for n in self.__items:
-            if ((ci_equals(n.cc_id, cc_id) or not cc_id) and
-                (ci_equals(n.hpc_id, hpc_id) or not hpc_id) and 
+        # Look up the most selective index, then check the remaining conditions on its bucket
+        if cc_id:
+            candidates: Iterable[NodeHistoryItem] = [self.__items[cc_id]] if cc_id in self.__items else []
+        elif hpc_id:
+            candidates = self.__index_get(self.__by_hpc_id, hpc_id)
+        else:
+            candidates = self.__index_get(self.__by_hostname, hostname)
+        for n in candidates:
+            if ((ci_equals(n.hpc_id, hpc_id) or not hpc_id) and 
                 (ci_equals(n.hostname, hostname) or not hostname)):
                 return n
         return None       
     
     def find_items(self, hpc_ids:List[str] = [], cc_ids:List[str] = [], hostnames:List[str] = []) -> List[NodeHistoryItem]:
-        return [i for i in self.__items if ci_in(i.hpc_id, hpc_ids) or ci_in(i.cc_id, cc_ids) or ci_in(i.hostname, hostnames)]
+        found: Dict[int, NodeHistoryItem] = {}
+        for cc_id in cc_ids:
+            if cc_id in self.__items:
+                item = self.__items[cc_id]
+                found[id(item)] = item
+        for keys, index in [(hpc_ids, self.__by_hpc_id), (hostnames, self.__by_hostname)]:
+            for key in keys:
+                for item in self.__index_get(index, key):
+                    found[id(item)] = item
+        return list(found.values())
 
     def insert(self, item: NodeHistoryItem, overwrite: bool = False) -> None:
         existingItem = self.find(cc_id=item.cc_id)
@@ -97,48 +330,84 @@ class HpcNodeHistory:
             if not overwrite:
                 raise Exception("Duplicate node id {}".format(item.cc_id))
             else:
-                self.__items.remove(existingItem)
-        self.__items.append(item)
+                self.__remove(existingItem)
+        self.__add(item)
     
     def reload(self) -> None:
         nodehistory = {}
-        if os.path.exists(self.__statefile):
-            try: 
-                with open(self.__statefile, 'r') as f:
-                    encodedContent = f.read()
-                    nodehistory = jsonpickle.decode(encodedContent)
-            except Exception as ex:
-                logging.warning("Failed to load history information from {}: {}".format(self.__statefile, ex))
+        records: Optional[Dict[str, List[Any]]] = None
+        self.__in_store = False
+        try:
+            stored = self.__store.load()
+            if stored is not None:
+                updated, records = stored
+                nodehistory = {
+                    "updated": updated,
+                    "items": [NodeHistoryItem.from_record(r) for r in records.values()]
+                }
+            elif os.path.exists(self.__statefile):
+                nodehistory = self.__migrate_legacy_statefile()
+        except Exception as ex:
+            logging.warning("Failed to load history information from {}: {}".format(self.__statefile, ex))
 
         if nodehistory:
             # If file was updated 7 days ago, do not load it
             if nodehistory["updated"] + timedelta(days=7) > datetime.utcnow() and nodehistory["updated"] < datetime.utcnow():
-                self.__items.clear()
+                self.__clear()
                 try:
                     items: List[NodeHistoryItem] = nodehistory["items"]
-                    self.__items.extend(items)
+                    for item in items:
+                        self.insert(item, overwrite=True)
+                    # the items are those of the store, the legacy ones are compacted by the next save
+                    self.__in_store = records is not None
+                    self.__changed.clear()
+                    self.__removed.clear()
                     # if file was updated 3 minutes ago, the idle_from time is not correct
                     if nodehistory["updated"] + timedelta(minutes=3) < datetime.utcnow():
                         logging.warning("The loaded history information was updated 3 minutes before, clear idle_from ...")
-                        for n in self.__items:
+                        for n in self.__items.values():
                             if not n.stopped:
                                 n.idle_from = None
-                    logging.info("Loaded node history HpcNodeHistory(updated={}, items={})".format(nodehistory["updated"], self.items))
+                    logging.info("Loaded node history HpcNodeHistory(updated={}, items={})".format(nodehistory["updated"], len(self.__items)))
                 except:
-                    self.__items.clear()
+                    self.__clear()
+                    self.__in_store = False
             else:
                 logging.warning("The loaded history information is out-dated, discard it")
 
+    def __migrate_legacy_statefile(self) -> Dict[str, Any]:
+        # One-time migration of a jsonpickle state file written by older versions:
+        # keep a copy of it, and rewrite it as a snapshot of the current format
+        with open(self.__statefile, 'r') as f:
+            nodehistory = jsonpickle.decode(f.read())
+        if not isinstance(nodehistory, dict) or not isinstance(nodehistory.get("updated"), datetime):
+            raise ValueError("Unrecognized state file format")
+        logging.info("Migrating the legacy state file {}".format(self.__statefile))
+        shutil.copyfile(self.__statefile, self.__statefile + ".legacy")
+        items: List[NodeHistoryItem] = nodehistory.get("items") or []
+        for item in items:
+            # jsonpickle restores the saved attributes one by one, without __setstate__, so
+            # the slots the older versions did not have are left unset
+            for slot in NodeHistoryItem.__slots__:
+                if not hasattr(item, slot):
+                    setattr(item, slot, None)
+        self.__store.compact(nodehistory["updated"], {i.cc_id: i.to_record() for i in items})
+        return nodehistory
+
     def synchronize(self, cc_nodes: Iterable[Node], hpc_nodes: Iterable[HpcNode]):
-        nhi_by_cc_id = partition_single(self.items, func = lambda n: n.cc_id)
+        # All the joins below are hash joins over case-insensitive keys, so the cost
+        # grows linearly with the number of CC nodes, HPC nodes and history items
+        cc_nodes = list(cc_nodes)
+        hpc_nodes = list(hpc_nodes)
+        hpc_node_by_id: CIDict[HpcNode] = ci_dict(hpc_nodes, lambda n: n.id)
         now = datetime.utcnow()
+        now_ts = to_epoch(now)
         # Refresh node history items with CC node list
         for cc_node in cc_nodes:
-            nhi = nhi_by_cc_id.get(cc_node.delayed_node_id.node_id)
+            nhi = self.find(cc_id=cc_node.delayed_node_id.node_id)
             if nhi is None:
                 nhi = NodeHistoryItem(cc_node.delayed_node_id.node_id, cc_node.hostname)
                 self.insert(nhi)
-                nhi_by_cc_id[nhi.cc_id] = nhi
             else:
                 if not nhi.hostname:
                     nhi.hostname = cc_node.hostname
@@ -147,14 +416,12 @@ class HpcNodeHistory:
                     # Somehow the node hostname changed, should not happen
                     # if the orig host name still in HPC node list, we shall remove the HPC node
                     if nhi.hpc_id:
-                        hpc_node = ci_find_one(hpc_nodes, nhi.hpc_id, target_func=lambda n: n.id)
+                        hpc_node = hpc_node_by_id.get(nhi.hpc_id)
                         if hpc_node is not None:
                             hpc_node.cc_node_id = nhi.cc_id
-                    self.__items.remove(nhi)
-                    self.__items_to_archive.append(nhi)
+                    self.archive(nhi)
                     nhi = NodeHistoryItem(cc_node.delayed_node_id.node_id, cc_node.hostname, nhi.emerge_time)
                     self.insert(nhi)
-                    nhi_by_cc_id[nhi.cc_id] = nhi
             if ci_equals(cc_node.target_state, 'Deallocated') or ci_equals(cc_node.target_state, 'Terminated'):
                 cc_node.create_time_remaining =  self.__provisioning_timeout
                 cc_node.idle_time_remaining = self.__idle_timeout
@@ -163,16 +430,16 @@ class HpcNodeHistory:
             else:
                 if nhi.stopped:
                     nhi.restart()
-                cc_node.create_time_unix = nhi.start_time.timestamp()
-                cc_node.create_time_remaining = max(0, self.__provisioning_timeout + cc_node.create_time_unix - now.timestamp())
-                if nhi.idle_from is None:
+                cc_node.create_time_unix = nhi.start_ts
+                cc_node.create_time_remaining = max(0, self.__provisioning_timeout + nhi.start_ts - now_ts)
+                if nhi.idle_ts is None:
                     cc_node.idle_time_remaining = self.__idle_timeout
                 else:
-                    cc_node.idle_time_remaining = max(0, self.__idle_timeout + nhi.idle_from.timestamp() - now.timestamp())
+                    cc_node.idle_time_remaining = max(0, self.__idle_timeout + nhi.idle_ts - now_ts)
 
         # Bound hpc nodes with CC nodes as per the info in node history
-        cc_node_by_id: Dict[str, Node] = partition_single(cc_nodes, func=lambda n: n.delayed_node_id.node_id)
-        nhi_by_hpc_id: Dict[str, NodeHistoryItem] = partition_single([nhi for nhi in self.__items if nhi.hpc_id], func = lambda n: n.hpc_id)
+        cc_node_by_id: CIDict[Node] = ci_dict(cc_nodes, lambda n: n.delayed_node_id.node_id)
+        nhi_by_hpc_id: CIDict[NodeHistoryItem] = ci_dict(self.__items.values(), lambda n: n.hpc_id or None)
         for hpc_node in hpc_nodes:
             if hpc_node.is_cc_node:
                 continue
@@ -185,41 +452,55 @@ class HpcNodeHistory:
         # For the nodes already removed from HPC Pack side, if they still exist in CC side
         # We shall reset the hpc_id for the node history item
         for nhi in nhi_by_hpc_id.values():
-            if ci_in(nhi.cc_id, cc_node_by_id):
+            if nhi.cc_id in cc_node_by_id:
                 nhi.reset_hpc_id()
 
         hpc_node_to_bound = [n for n in hpc_nodes if not n.is_cc_node]
-        nhi_to_bound_with_hpc = [nhi for nhi in self.__items if nhi.hostname and not nhi.hpc_id]
+        nhi_to_bound_with_hpc = [nhi for nhi in self.__items.values() if nhi.hostname and not nhi.hpc_id]
         if len(hpc_node_to_bound) > 0 and len(nhi_to_bound_with_hpc) > 0:
-            candidate_nhi = [nhi for nhi in nhi_to_bound_with_hpc if ci_in(nhi.cc_id, cc_node_by_id)]
-            candidate_nhi.extend([nhi for nhi in nhi_to_bound_with_hpc if not ci_in(nhi.cc_id, cc_node_by_id)])
-            # Map the HPC nodes with CC nodes by hostname  
+            # Map the HPC nodes with CC nodes by hostname, the items of active CC nodes take precedence
+            candidate_nhi = [nhi for nhi in nhi_to_bound_with_hpc if nhi.cc_id in cc_node_by_id]
+            candidate_nhi.extend([nhi for nhi in nhi_to_bound_with_hpc if nhi.cc_id not in cc_node_by_id])
+            candidate_nhi_by_hostname: CIDict[NodeHistoryItem] = ci_dict(candidate_nhi, lambda n: n.hostname)
             for hpc_node in hpc_node_to_bound:
-                # First search in active node history items
-                match_nhi = ci_find_one(candidate_nhi, hpc_node.name, target_func=lambda n: n.hostname)
+                match_nhi = candidate_nhi_by_hostname.get(hpc_node.name)
                 if match_nhi:
                     match_nhi.reset_hpc_id(hpc_node.id)
                     hpc_node.cc_node_id = match_nhi.cc_id
                     hpc_node.bound_cc_node = cc_node_by_id.get(match_nhi.cc_id)
 
         # Refresh the node history items, archive the stale items
-        hpc_ids = [hpc_node.id for hpc_node in hpc_nodes]
-        self.__items_to_archive.extend([nhi for nhi in self.__items if ci_notin(nhi.cc_id, cc_node_by_id) and ci_notin(nhi.hpc_id, hpc_ids)])
-        self.__items[:] = [nhi for nhi in self.__items if ci_in(nhi.cc_id, cc_node_by_id) or ci_in(nhi.hpc_id, hpc_ids)]
+        hpc_ids = CISet([hpc_node.id for hpc_node in hpc_nodes])
+        for nhi in [nhi for nhi in self.__items.values() if nhi.cc_id not in cc_node_by_id and nhi.hpc_id not in hpc_ids]:
+            self.archive(nhi)
 
     def save(self) -> None:
+        if self.__lock is None:
+            self.__save()
+            return
+        # re-entrant: immediate when the round holds the lock already
+        with self.__lock.hold(self.__lock_timeout):
+            self.__save()
+
+    def __save(self) -> None:
         cur_time = datetime.utcnow()
-        pickedContent = jsonpickle.encode(
-            {
-                'updated': cur_time,
-                'items': self.__items
-            })
-        with open(self.__statefile, 'w') as sf:
-            sf.write(pickedContent)
+        if not self.__in_store or self.__store.needs_compaction:
+            self.__store.compact(cur_time, {i.cc_id: i.to_record() for i in self.__items.values()})
+        else:
+            # Only the items changed since the last save are journaled, those archived since
+            # are not. An empty commit still records the update time
+            upserts = [i.to_record() for i in self.__changed.values() if i._history is self]
+            upserted = set(r[0] for r in upserts)
+            deletes = [k for k in self.__removed if k not in upserted]
+            self.__store.commit(cur_time, upserts, deletes)
+        self.__in_store = True
+        self.__changed.clear()
+        self.__removed.clear()
         if len(self.__items_to_archive) > 0:
             with open(self.__archivefile, 'a+') as af:
                 for i in self.__items_to_archive:
                     af.write("\n{}".format(i.archive_str(cur_time)))
+            self.__items_to_archive.clear()
 
     def __str__(self) -> str:
         return "HpcNodeHistory(items={})".format(self.items)
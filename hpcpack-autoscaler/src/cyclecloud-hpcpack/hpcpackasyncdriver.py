@@ -0,0 +1,489 @@
+import asyncio
+import json
+import ssl
+import threading
+import time
+import hpc.autoscale.hpclogging as logging
+from datetime import datetime
+from typing import Any, Callable, Coroutine, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple, Union
+from .hpcpackdriver import (
+    BulkResult,
+    GrowDecision,
+    HpcNode,
+    HpcRestClient,
+    IdleNode,
+    NodeIdentity,
+    NodeStatusSnapshot,
+    StatusRefresh,
+    NodeStatusJoin,
+    all_in_state,
+    is_active_computenode,
+    is_computenode,
+    new_idle_node,
+    parse_grow_decision,
+    status_snapshot_key,
+    wait_deadline,
+)
+from .commonutil import ChunkResult, chunked
+from .headnodeguard import HeadNodeGuard
+from .jsonstream import STREAM_CHUNK_SIZE, JsonArrayDecoder
+from .nodeidcache import NodeIdCache
+from .reststats import RestStats
+
+aiohttp: Any
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+AsyncResponse = NamedTuple("AsyncResponse", [("status", int), ("headers", Mapping[str, str]), ("content", bytes)])
+
+
+class AsyncHpcRestClient:
+    """
+    asyncio variant of HpcRestClient on top of aiohttp, the coroutines mirror the
+    HpcRestClient methods. Independent calls of a round can be awaited together on one
+    event loop instead of occupying a thread each.
+    """
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        pem: str,
+        hostname: str = "localhost",
+        pool_size: int = HpcRestClient.DEFAULT_POOL_SIZE,
+        connect_timeout: float = HpcRestClient.DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = HpcRestClient.DEFAULT_READ_TIMEOUT,
+        node_id_cache: Optional[NodeIdCache] = None,
+        chunk_size: int = HpcRestClient.DEFAULT_CHUNK_SIZE,
+        chunks_in_flight: int = HpcRestClient.DEFAULT_CHUNKS_IN_FLIGHT,
+        bulk_timeout: Optional[float] = HpcRestClient.DEFAULT_BULK_TIMEOUT,
+        guard: Optional[HeadNodeGuard] = None
+    ) -> None:
+        if aiohttp is None:
+            raise RuntimeError("hpcpack.async_client requires the aiohttp package, install it or disable the async client")
+        self.hostname = hostname
+        self._pem = pem
+        self._pool_size = pool_size
+        self._chunk_size = chunk_size
+        self._chunks_in_flight = chunks_in_flight
+        self._bulk_timeout = bulk_timeout
+        self.node_id_cache = node_id_cache if node_id_cache is not None else NodeIdCache()
+        self.__status_snapshots: Dict[Tuple, NodeStatusSnapshot] = {}
+        self.last_status_refresh: Optional[StatusRefresh] = None
+        self.stats = RestStats()
+        self.guard = guard if guard is not None else HeadNodeGuard()
+        self._timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        # created on first use, aiohttp binds the session to the running loop
+        self._session: Optional["aiohttp.ClientSession"] = None
+
+        logging.initialize_logging(config)
+
+    def _new_ssl_context(self) -> ssl.SSLContext:
+        # same as the blocking client: client certificate, no server certificate verification
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        context.load_cert_chain(self._pem)
+        return context
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, ssl=self._new_ssl_context())
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._timeout,
+                headers={"Content-Type": "application/json", "Accept-Encoding": "gzip, deflate"})
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "AsyncHpcRestClient":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+    async def _request(
+        self,
+        method: str,
+        function_name: str,
+        function_route: str,
+        params: Optional[Dict[str, str]] = None,
+        data: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        idempotent: bool = True
+    ) -> AsyncResponse:
+        url = function_route.format(self.hostname)
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                with self.stats.measure(function_route, data) as call:
+                    async with self._get_session().request(method, url, params=params or None, data=data, headers=headers) as res:
+                        content = await res.read()
+                        call.response(res.status, len(content))
+                        if res.status >= 400:
+                            logging.error("{}: status_code:{} content:{}".format(function_name, res.status, content))
+                            res.raise_for_status()
+                        self.guard.succeeded(time.monotonic() - start)
+                        logging.debug("{}: {}".format(function_name, str(content)))
+                        return AsyncResponse(res.status, res.headers, content)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                delay = self._retry_delay(e, attempt, idempotent)
+                if delay is None:
+                    raise
+                logging.warning("{}: attempt {} failed ({}), retrying in {:.2f}s".format(function_name, attempt + 1, e, delay))
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def _retry_delay(
+        self,
+        error: BaseException,
+        attempt: int,
+        idempotent: bool
+    ) -> Optional[float]:
+        if not isinstance(error, aiohttp.ClientResponseError):
+            return self.guard.failed(attempt, None, idempotent)
+        return self.guard.failed(attempt, error.status, idempotent, (error.headers or {}).get("Retry-After"))
+
+    async def _get(
+        self,
+        function_name: str,
+        function_route: str,
+        params: Optional[Dict[str, str]]
+    ) -> bytes:
+        res = await self._request("GET", function_name, function_route, params=params)
+        return res.content
+
+    async def _post(
+        self,
+        function_name: str,
+        function_route: str,
+        data: Optional[str],
+        idempotent: bool = True
+    ) -> bytes:
+        res = await self._request("POST", function_name, function_route, data=data, idempotent=idempotent)
+        return res.content
+
+    async def _request_records(
+        self,
+        method: str,
+        function_name: str,
+        function_route: str,
+        on_record: Callable[[Any], None],
+        params: Optional[Dict[str, str]] = None,
+        data: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        idempotent: bool = True
+    ) -> AsyncResponse:
+        url = function_route.format(self.hostname)
+        attempt = 0
+        count = 0
+        while True:
+            start = time.monotonic()
+            try:
+                with self.stats.measure(function_route, data) as call:
+                    async with self._get_session().request(method, url, params=params or None, data=data, headers=headers) as res:
+                        call.response(res.status)
+                        if res.status >= 400:
+                            content = await res.read()
+                            logging.error("{}: status_code:{} content:{}".format(function_name, res.status, content))
+                            res.raise_for_status()
+                        self.guard.succeeded(time.monotonic() - start)
+                        if res.status == 304:
+                            logging.info("{}: not modified".format(function_name))
+                            return AsyncResponse(res.status, res.headers, b"")
+                        decoder = JsonArrayDecoder()
+                        async for chunk in res.content.iter_chunked(STREAM_CHUNK_SIZE):
+                            call.received(len(chunk))
+                            for record in decoder.feed(chunk):
+                                on_record(record)
+                                count += 1
+                        for record in decoder.close():
+                            on_record(record)
+                            count += 1
+                        logging.info("{}: {} records".format(function_name, count))
+                        return AsyncResponse(res.status, res.headers, b"")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # the records passed on cannot be taken back, a broken stream is only retried before the first one
+                delay = self._retry_delay(e, attempt, idempotent and count == 0)
+                if delay is None:
+                    raise
+                logging.warning("{}: attempt {} failed ({}), retrying in {:.2f}s".format(function_name, attempt + 1, e, delay))
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    # Starts auto-scale api
+    async def get_grow_decision(self) -> Dict[str, GrowDecision]:
+        content = await self._post(self.get_grow_decision.__name__, HpcRestClient.GROW_DECISION_API_ROUTE, data=None)
+        return parse_grow_decision(content)
+
+    async def list_node_names(
+        self,
+        filters: Dict[str, str] = {}
+    ) -> List[str]:
+        nodes: List[NodeIdentity] = await self.list_nodes(filters=filters, status=False)
+        return [n.Name for n in nodes]
+
+    async def list_nodes(
+        self,
+        filters: Dict[str, str] = {},
+        status: bool = True,
+        node_filter: Optional[Callable[[HpcNode], bool]] = None
+    ) -> Union[List[NodeIdentity], List[HpcNode]]:
+        if not status:
+            return [NodeIdentity(node_id, name) for name, node_id in (await self._list_node_identities(filters)).items()]
+        if len(self.node_id_cache) == 0:
+            await self._list_node_identities(filters)
+        snapshot = self.__status_snapshots.setdefault(status_snapshot_key(filters), NodeStatusSnapshot())
+        join = NodeStatusJoin(self.node_id_cache, snapshot, node_filter)
+        headers = snapshot.conditional_headers()
+        snapshot.begin()
+        res = await self._request_records(
+            "GET", self.list_nodes.__name__, HpcRestClient.LIST_NODES_STATUS_ROUTE, join.add, params=filters, headers=headers)
+        if res.status == 304:
+            nodes, self.last_status_refresh = snapshot.not_modified()
+            return join.filter(nodes)
+        if len(join.misses) > 0:
+            join.resolve(await self._list_node_identities(filters))
+        self.last_status_refresh = snapshot.commit(res.headers)
+        logging.debug("Node status refresh: {}".format(self.last_status_refresh))
+        return join.nodes
+
+    async def _list_node_identities(
+        self,
+        filters: Optional[Dict[str, str]]
+    ) -> Dict[str, str]:
+        nodeId_byName: Dict[str, str] = {}
+        await self._request_records(
+            "GET", self.list_nodes.__name__, HpcRestClient.LIST_NODES_ROUTE,
+            lambda i: nodeId_byName.__setitem__(i['Name'], i['Id']), params=filters)
+        self.node_id_cache.update(((node_id, name) for name, node_id in nodeId_byName.items()), complete=not filters)
+        return nodeId_byName
+
+    async def list_computenodes(
+        self,
+        active_only: bool = False
+    ) -> List[HpcNode]:
+        node_filter = is_active_computenode if active_only else is_computenode
+        return await self.list_nodes(filters={"nodeGroup": "ComputeNodes"}, node_filter=node_filter)
+
+    async def get_nodes(
+        self,
+        node_names: Iterable[str]
+    ) -> Union[List[NodeIdentity], List[HpcNode]]:
+        assert len(node_names) > 0
+        join = NodeStatusJoin(self.node_id_cache)
+        params = json.dumps({"nodeNames": list(node_names)})
+        await self._request_records("POST", self.get_node_status_exact.__name__, HpcRestClient.NODE_STATUS_EXACT_ROUTE, join.add, data=params)
+        if len(join.misses) > 0:
+            join.resolve(await self._list_node_identities(None))
+        return join.nodes
+
+    async def get_node_status_exact(
+        self,
+        node_names: Iterable[str]
+    ) -> List[Dict[str, Any]]:
+        assert len(node_names) > 0
+        params = json.dumps({"nodeNames": list(node_names)})
+        content = await self._post(self.get_node_status_exact.__name__, HpcRestClient.NODE_STATUS_EXACT_ROUTE, params)
+        return json.loads(content)
+
+    async def list_idle_nodes(
+        self,
+        filters: Dict[str, str] = {}
+    ) -> List[IdleNode]:
+        node_names = await self.list_node_names(filters)
+        if len(node_names) > 0:
+            return await self.check_nodes_idle(node_names)
+        return []
+
+    async def check_nodes_idle(
+        self,
+        node_names: Iterable[str]
+    ) -> BulkResult:
+        assert len(node_names) > 0
+        return await self._post_chunked(
+            self.check_nodes_idle.__name__, HpcRestClient.CHECK_NODES_IDLE_ROUTE, node_names, to_item=new_idle_node)
+
+    # Starts node management api
+    async def bring_nodes_online(
+        self,
+        node_names: Iterable[str]
+    ) -> BulkResult:
+        assert len(node_names) > 0
+        return await self._post_chunked(self.bring_nodes_online.__name__, HpcRestClient.BRING_NODES_ONLINE_ROUTE, node_names)
+
+    async def take_nodes_offline(
+        self,
+        node_names: Iterable[str]
+    ) -> BulkResult:
+        assert len(node_names) > 0
+        return await self._post_chunked(self.take_nodes_offline.__name__, HpcRestClient.TAKE_NODES_OFFLINE_ROUTE, node_names)
+
+    async def assign_default_compute_node_template(
+        self,
+        node_names: Iterable[str]
+    ) -> BulkResult:
+        assert len(node_names) > 0
+        return await self.assign_nodes_template(node_names, HpcRestClient.DEFAULT_COMPUTENODE_TEMPLATE)
+
+    async def assign_nodes_template(
+        self,
+        node_names: Iterable[str],
+        template_name: str
+    ) -> BulkResult:
+        assert len(node_names) > 0 and template_name
+        return await self._post_chunked(
+            self.assign_nodes_template.__name__, HpcRestClient.ASSIGN_NODES_TEMPLATE_ROUTE, node_names,
+            lambda chunk: json.dumps({"nodeNames": chunk, "templateName": template_name}))
+
+    async def remove_nodes(
+        self,
+        node_names: Iterable[str]
+    ) -> BulkResult:
+        assert len(node_names) > 0
+        result = await self._post_chunked(self.remove_nodes.__name__, HpcRestClient.REMOVE_NODES_ROUTE, node_names, idempotent=False)
+        self.node_id_cache.discard(node_names)
+        return result
+
+    async def _post_chunked(
+        self,
+        function_name: str,
+        function_route: str,
+        node_names: Iterable[str],
+        make_body: Callable[[List[str]], str] = json.dumps,
+        to_item: Optional[Callable[[Any], Any]] = None,
+        idempotent: bool = True
+    ) -> BulkResult:
+        in_flight = asyncio.Semaphore(max(1, self._chunks_in_flight))
+
+        async def post_chunk(chunk: List[str]) -> List[Any]:
+            async with in_flight:
+                if to_item is None:
+                    return json.loads(await self._post(function_name, function_route, make_body(chunk), idempotent=idempotent))
+                items: List[Any] = []
+                await self._request_records(
+                    "POST", function_name, function_route, lambda r: items.append(to_item(r)), data=make_body(chunk),
+                    idempotent=idempotent)
+                return items
+
+        chunks = chunked(list(node_names), self._chunk_size)
+        tasks = [asyncio.ensure_future(post_chunk(chunk)) for chunk in chunks]
+        bulk_timeout = self.guard.timeout(self._bulk_timeout)
+        _, pending = await asyncio.wait(tasks, timeout=bulk_timeout)
+        for task in pending:
+            task.cancel()
+        chunk_results: List[ChunkResult] = []
+        for index, (chunk, task) in enumerate(zip(chunks, tasks)):
+            if task in pending:
+                error: Optional[BaseException] = TimeoutError("chunk {} did not finish within {} seconds".format(index, bulk_timeout))
+            else:
+                error = task.exception()
+            chunk_results.append(ChunkResult(index, chunk, None if error else task.result(), error))
+        return BulkResult(function_name, chunk_results)
+
+    async def wait_node_state(
+        self,
+        node_names: Iterable[str],
+        target_state: str,
+        timeout_seconds: int = 30,
+        interval: int = 1
+    ) -> bool:
+        assert len(node_names) > 0
+        end = wait_deadline(timeout_seconds)
+        while True:
+            nodes = await self.get_node_status_exact(node_names)
+            if all_in_state(nodes, target_state):
+                return True
+            if datetime.utcnow() > end:
+                return False
+            await asyncio.sleep(interval)
+
+    # Starts node group api
+    async def list_node_groups(
+        self,
+        group_name: Optional[str] = None
+    ) -> List[str]:
+        params = {}
+        if group_name:
+            params['nodeGroupName'] = group_name
+        content = await self._get(self.list_node_groups.__name__, HpcRestClient.LIST_NODE_GROUPS_ROUTE, params)
+        return json.loads(content)
+
+    async def add_node_group(
+        self,
+        group_name: str,
+        group_description: str = ""
+    ) -> bool:
+        params = json.dumps({"name": group_name, "description": group_description})
+        try:
+            await self._post(self.add_node_group.__name__, HpcRestClient.ADD_NEW_GROUP_ROUTE, params, idempotent=False)
+            return True
+        except Exception:
+            return False
+
+    async def add_node_to_node_group(
+        self,
+        group_name: str,
+        node_names: Iterable[str]
+    ) -> BulkResult:
+        assert len(node_names) > 0 and group_name
+        logging.debug("Adding nodes {} to nodegroup {}".format(node_names, group_name))
+        return await self._post_chunked(self.add_node_to_node_group.__name__, HpcRestClient.ADD_NODES_TO_NODE_GROUP_ROUTE.format(
+            group_name=group_name), node_names)
+
+
+class AsyncBackedHpcRestClient:
+    """
+    Blocking facade with the HpcRestClient interface that runs an AsyncHpcRestClient on a
+    private event loop thread, so the autoscaler can switch clients through config only.
+    Calls from several threads are multiplexed on the one loop and its connection pool.
+    """
+    def __init__(
+        self,
+        *args: Any,
+        **kwargs: Any
+    ) -> None:
+        self.__client = AsyncHpcRestClient(*args, **kwargs)
+        self.hostname = self.__client.hostname
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, name="hpcpack-rest-loop", daemon=True)
+        self.__thread.start()
+
+    @property
+    def async_client(self) -> AsyncHpcRestClient:
+        return self.__client
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self.__loop).result()
+
+    def close(self) -> None:
+        if not self.__loop.is_running():
+            return
+        self.run(self.__client.close())
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+
+    def __enter__(self) -> "AsyncBackedHpcRestClient":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for the names not defined here, i.e. the HpcRestClient api
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self.__client, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            return self.run(attr(*args, **kwargs))
+        call.__name__ = name
+        return call
@@ -2,19 +2,28 @@ import json
 from hpc.autoscale.node.node import Node
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
 import hpc.autoscale.hpclogging as logging
 from datetime import datetime, timedelta
-from time import sleep
+from time import monotonic, sleep
 from requests.models import Response
-from requests.exceptions import HTTPError
-from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Union
-from .commonutil import ci_equals, ci_in, ci_notin, ci_interset, make_dict_single
+from requests.exceptions import ChunkedEncodingError, ConnectionError, HTTPError, Timeout
+from typing import Any, Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple, Union
+from .commonutil import ChunkResult, CISet, ci_equals, ci_in, run_chunked
+from .headnodeguard import HeadNodeGuard
+from .jsonstream import STREAM_CHUNK_SIZE, iter_json_array
+from .nodeidcache import NodeIdCache
+from .reststats import RestStats
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 GrowDecision = NamedTuple("GrowDecision", [("cores_to_grow", float), ("nodes_to_grow", float), ("sockets_to_grow", float)])
 IdleNode = NamedTuple("IdleNode", [("node_name", str), ("timestamp", datetime), ("server_name", float)])
 NodeIdentity = NamedTuple("NodeIdentity", [("Id", str), ("Name", str)])
+StatusRefresh = NamedTuple("StatusRefresh", [("not_modified", bool), ("reused", int), ("parsed", int), ("dropped", int)])
+
+INACTIVE_NODE_STATES = CISet(["Rejected", "NotDeployed", "Stopping", "Removing"])
+TRANSITIONING_NODE_STATES = CISet(["Provisioning", "Starting", "Draining", "Removing"])
 
 class HpcNode:
     # Possible values for HPC node health: 
@@ -27,14 +36,14 @@ class HpcNode:
         name: str, 
         nodehealth: str, 
         nodestate: str,
-        nodegroups: List[str],
+        nodegroups: Iterable[str],
         nodetemplate: Optional[str] = None
     ) -> None:
         self.id = id
         self.name = name
         self.health = nodehealth
         self.state = nodestate
-        self.nodegroups = nodegroups
+        self.nodegroups = CISet(nodegroups)
         self.nodetemplate = nodetemplate
         self.cc_node_id: Optional[str] = None
         self.idle_from: Optional[datetime] = None
@@ -42,11 +51,11 @@ class HpcNode:
     
     @property
     def is_computenode(self) -> bool:
-        return ci_in("ComputeNodes", self.nodegroups) and not ci_interset(["HeadNodes", "WCFBrokerNodes"], self.nodegroups)
+        return "ComputeNodes" in self.nodegroups and "HeadNodes" not in self.nodegroups and "WCFBrokerNodes" not in self.nodegroups
 
     @property
     def active(self) -> bool:
-        return ci_notin(self.state, ["Rejected", "NotDeployed", "Stopping", "Removing"])
+        return self.state not in INACTIVE_NODE_STATES
 
     @property
     def is_cc_node(self) -> bool:
@@ -62,7 +71,7 @@ class HpcNode:
 
     @property
     def transitioning(self) -> bool:
-        return ci_in(self.state, ["Provisioning", "Starting", "Draining", "Removing"])
+        return self.state in TRANSITIONING_NODE_STATES
 
     @property
     def ready_for_job(self) -> bool:
@@ -70,11 +79,11 @@ class HpcNode:
 
     @property
     def shall_addcyclecloudtag(self) -> bool:
-        return self.bound_cc_node and ci_notin("CycleCloudNodes", self.nodegroups)
+        return self.bound_cc_node and "CycleCloudNodes" not in self.nodegroups
 
     @property
     def shall_addnodearraytag(self) -> bool:
-        return self.bound_cc_node and ci_notin(self.cc_nodearray, self.nodegroups)
+        return self.bound_cc_node and self.cc_nodearray not in self.nodegroups
 
     @property
     def cc_nodearray(self) -> Optional[str]:
@@ -84,7 +93,7 @@ class HpcNode:
     def removed_cc_node(self) -> bool:
         if self.bound_cc_node:
             return False
-        return self.is_cc_node or (ci_in("CycleCloudNodes", self.nodegroups) and (self.error or not self.template_assigned))
+        return self.is_cc_node or ("CycleCloudNodes" in self.nodegroups and (self.error or not self.template_assigned))
 
     @property
     def stopped_cc_node(self) -> bool:
@@ -101,6 +110,165 @@ class HpcNode:
             return False
         return self.idle_from + timedelta(seconds=idle_timeout) < datetime.utcnow()
 
+    def unbind(self) -> None:
+        # the links to CycleCloud and the node history are made again every round
+        self.cc_node_id = None
+        self.idle_from = None
+        self.bound_cc_node = None
+
+# Response parsing shared by the blocking and the asyncio REST clients
+def parse_grow_decision(content: Union[str, bytes]) -> Dict[str, GrowDecision]:
+    grow_decision_dict = {k: GrowDecision(v['CoresToGrow'], v['NodesToGrow'], v['SocketsToGrow']) for k, v in json.loads(content).items()}
+    if not ci_in("Default", grow_decision_dict):
+        grow_decision_dict["Default"] = GrowDecision(0.0, 0.0, 0.0)
+    return grow_decision_dict
+
+def new_hpc_node(node_id: str, n: Dict[str, Any]) -> HpcNode:
+    return HpcNode(node_id, n["Name"], n["NodeHealth"], n["NodeState"], n["Groups"], n["NodeTemplate"])
+
+def status_fingerprint(node_id: str, n: Dict[str, Any]) -> Tuple:
+    return (node_id, n["NodeHealth"], n["NodeState"], tuple(n["Groups"]), n["NodeTemplate"])
+
+class NodeStatusSnapshot:
+    """
+    The HpcNode objects of the previous status listing of one filter. A new listing only builds
+    HpcNode objects for the nodes whose status fingerprint changed and hands out the previous
+    objects for the others, and is skipped entirely when the head node answers a conditional
+    request with 304 Not Modified.
+    """
+    def __init__(self) -> None:
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        # node name -> (status fingerprint, HpcNode)
+        self.nodes: Dict[str, Tuple[Tuple, HpcNode]] = {}
+        self.__next: Dict[str, Tuple[Tuple, HpcNode]] = {}
+        self.__reused = 0
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def not_modified(self) -> Tuple[List[HpcNode], StatusRefresh]:
+        self.__next = {}
+        nodes = []
+        for _, node in self.nodes.values():
+            node.unbind()
+            nodes.append(node)
+        return nodes, StatusRefresh(True, len(nodes), 0, 0)
+
+    def begin(self) -> None:
+        self.__next = {}
+        self.__reused = 0
+
+    def add(self, node_id: str, n: Dict[str, Any]) -> HpcNode:
+        nodeName = n["Name"]
+        fingerprint = status_fingerprint(node_id, n)
+        entry = self.nodes.get(nodeName)
+        if entry is not None and entry[0] == fingerprint:
+            node = entry[1]
+            node.unbind()
+            self.__reused += 1
+        else:
+            node = new_hpc_node(node_id, n)
+        self.__next[nodeName] = (fingerprint, node)
+        return node
+
+    def commit(self, response_headers: Mapping[str, str]) -> StatusRefresh:
+        # the snapshot only changes once the whole listing has arrived
+        kept = len(self.__next)
+        dropped = len([name for name in self.nodes if name not in self.__next])
+        self.nodes, self.__next = self.__next, {}
+        self.etag = response_headers.get("ETag")
+        self.last_modified = response_headers.get("Last-Modified")
+        return StatusRefresh(False, self.__reused, kept - self.__reused, dropped)
+
+class NodeStatusJoin:
+    """
+    Joins node status records with the node Ids as the records arrive. The records of names
+    the Id cache does not know are held back until the identity list is fetched.
+    """
+    def __init__(
+        self,
+        node_id_cache: NodeIdCache,
+        snapshot: Optional[NodeStatusSnapshot] = None,
+        node_filter: Optional[Callable[[HpcNode], bool]] = None
+    ) -> None:
+        self.__node_id_cache = node_id_cache
+        self.__snapshot = snapshot
+        self.__node_filter = node_filter
+        self.nodes: List[HpcNode] = []
+        self.misses: List[Dict[str, Any]] = []
+
+    def add(self, n: Dict[str, Any]) -> None:
+        node_id = self.__node_id_cache.get(n["Name"])
+        if node_id is None:
+            self.misses.append(n)
+        else:
+            self.__accept(node_id, n)
+
+    def resolve(self, nodeId_byName: Dict[str, str]) -> None:
+        for n in self.misses:
+            if n["Name"] in nodeId_byName:
+                self.__accept(nodeId_byName[n["Name"]], n)
+        self.misses = []
+
+    def filter(self, nodes: List[HpcNode]) -> List[HpcNode]:
+        if self.__node_filter is None:
+            return nodes
+        return [node for node in nodes if self.__node_filter(node)]
+
+    def __accept(self, node_id: str, n: Dict[str, Any]) -> None:
+        node = self.__snapshot.add(node_id, n) if self.__snapshot else new_hpc_node(node_id, n)
+        if self.__node_filter is None or self.__node_filter(node):
+            self.nodes.append(node)
+
+def is_computenode(node: HpcNode) -> bool:
+    return node.is_computenode
+
+def is_active_computenode(node: HpcNode) -> bool:
+    return node.is_computenode and node.active
+
+def new_idle_node(i: Dict[str, Any]) -> IdleNode:
+    return IdleNode(i['NodeName'], i['TimeStamp'], i['ServerName'])
+
+def status_snapshot_key(filters: Optional[Dict[str, str]]) -> Tuple:
+    return tuple(sorted((filters or {}).items()))
+
+def wait_deadline(timeout_seconds: int) -> datetime:
+    # timeout_seconds < 0 waits (almost) forever, 0 checks only once
+    if timeout_seconds < 0:
+        return datetime.utcnow() + timedelta(weeks=9999)
+    return datetime.utcnow() + timedelta(seconds=timeout_seconds)
+
+def all_in_state(node_status: List[Dict[str, Any]], target_state: str) -> bool:
+    return len(node_status) == len([n for n in node_status if ci_equals(n["NodeState"], target_state)])
+
+class BulkResult(list):
+    """
+    Merged results of the chunks of a bulk operation, the chunks that failed are in failed_chunks.
+    """
+    def __init__(self, function_name: str, chunk_results: List[ChunkResult]) -> None:
+        super().__init__()
+        self.failed_chunks: List[ChunkResult] = []
+        for r in chunk_results:
+            if r.error is None:
+                self.extend(r.result)
+            else:
+                logging.error("{}: chunk {} of {} nodes failed: {}".format(function_name, r.index, len(r.items), r.error))
+                self.failed_chunks.append(r)
+
+    @property
+    def ok(self) -> bool:
+        return len(self.failed_chunks) == 0
+
+    @property
+    def failed_node_names(self) -> List[str]:
+        return [name for r in self.failed_chunks for name in r.items]
+
 class HpcRestClient:
     DEFAULT_COMPUTENODE_TEMPLATE = "Default ComputeNode Template"
     # auto-scale api set
@@ -130,61 +298,179 @@ class HpcRestClient:
     NODE_STATUS_NODE_HEALTH_UNAPPROVED_VALUE = "Unapproved"
     NODE_STATUS_NODE_GROUP_KEY = "Groups"
 
+    # defaults of the connection settings, may be overridden in the "hpcpack" config section
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_CONNECT_TIMEOUT = 10.0
+    DEFAULT_READ_TIMEOUT = 120.0
+    # node lists of the bulk operations are sent in chunks of this many nodes
+    DEFAULT_CHUNK_SIZE = 500
+    DEFAULT_CHUNKS_IN_FLIGHT = 4
+    DEFAULT_BULK_TIMEOUT = 300.0
+
     def __init__(
         self, 
         config: Dict[str, Any], 
         pem: str, 
-        hostname: str = "localhost"
+        hostname: str = "localhost",
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        node_id_cache: Optional[NodeIdCache] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        chunks_in_flight: int = DEFAULT_CHUNKS_IN_FLIGHT,
+        bulk_timeout: Optional[float] = DEFAULT_BULK_TIMEOUT,
+        guard: Optional[HeadNodeGuard] = None
     ) -> None:
         self.hostname = hostname
         self._pem = pem
+        self._timeout = (connect_timeout, read_timeout)
+        self._chunk_size = chunk_size
+        self._chunks_in_flight = chunks_in_flight
+        self._bulk_timeout = bulk_timeout
+        self._session = self._new_session(pool_size)
+        self.node_id_cache = node_id_cache if node_id_cache is not None else NodeIdCache()
+        self.__status_snapshots: Dict[Tuple, NodeStatusSnapshot] = {}
+        self.last_status_refresh: Optional[StatusRefresh] = None
+        self.stats = RestStats()
+        self.guard = guard if guard is not None else HeadNodeGuard()
 
         logging.initialize_logging(config)
         # self.logger = logging_aux.init_logger_aux("hpcframework.restclient", 'hpcframework.restclient.log')
 
-    # TODO: consolidate these ceremonies.
+    def _new_session(self, pool_size: int) -> requests.Session:
+        # One keep-alive session per client, so that the TCP connection and the
+        # client certificate TLS handshake are reused by all the calls in a round
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.cert = self._pem
+        session.headers.update({"Content-Type": "application/json", "Accept-Encoding": "gzip, deflate"})
+        return session
+
+    def close(self) -> None:
+        self._session.close()
+
+    def __enter__(self) -> "HpcRestClient":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
     def _get(
         self, 
         function_name: str, 
         function_route: str, 
-        params
+        params,
+        headers: Optional[Dict[str, str]] = None
     ) -> Response:
-        headers = {"Content-Type": "application/json"}
-        url = function_route.format(self.hostname)
-        res = requests.get(url, headers=headers, verify=False, params=params, cert=self._pem)
-        try:
-            res.raise_for_status()
-            logging.info("{}: {}".format(function_name, str(res.content)))
-            return res
-        except HTTPError:
-            logging.error("{}: status_code:{} content:{}".format(function_name, res.status_code, res.content))
-            raise
+        return self._request("GET", function_name, function_route, params=params, headers=headers)
 
     def _post(
         self, 
         function_name: str, 
         function_route: str,
-        data
+        data,
+        idempotent: bool = True
+    ) -> Response:
+        return self._request("POST", function_name, function_route, data=data, idempotent=idempotent)
+
+    def _request(
+        self,
+        method: str,
+        function_name: str,
+        function_route: str,
+        params: Optional[Dict[str, str]] = None,
+        data: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        idempotent: bool = True
     ) -> Response:
-        headers = {"Content-Type": "application/json"}
         url = function_route.format(self.hostname)
-        res = requests.post(url, data=data, headers=headers, verify=False, cert=self._pem)
-        try:
-            res.raise_for_status()
-            logging.info("{} resp: {}".format(function_name, str(res.content)))
-            return res
-        except HTTPError:
-            logging.error("{}: status_code:{} content:{}".format(function_name, res.status_code, res.content))
-            raise
+        attempt = 0
+        while True:
+            start = monotonic()
+            try:
+                with self.stats.measure(function_route, data) as call:
+                    res = self._session.request(method, url, params=params, data=data, headers=headers, verify=False, timeout=self._timeout)
+                    call.response(res.status_code, len(res.content))
+                try:
+                    res.raise_for_status()
+                except HTTPError:
+                    logging.error("{}: status_code:{} content:{}".format(function_name, res.status_code, res.content))
+                    raise
+                self.guard.succeeded(monotonic() - start)
+                logging.debug("{}: {}".format(function_name, str(res.content)))
+                return res
+            except (HTTPError, ConnectionError, Timeout, ChunkedEncodingError) as e:
+                delay = self._retry_delay(e, attempt, idempotent)
+                if delay is None:
+                    raise
+                logging.warning("{}: attempt {} failed ({}), retrying in {:.2f}s".format(function_name, attempt + 1, e, delay))
+                sleep(delay)
+                attempt += 1
+
+    def _retry_delay(
+        self,
+        error: Exception,
+        attempt: int,
+        idempotent: bool
+    ) -> Optional[float]:
+        response = error.response if isinstance(error, HTTPError) else None
+        if response is None:
+            return self.guard.failed(attempt, None, idempotent)
+        return self.guard.failed(attempt, response.status_code, idempotent, response.headers.get("Retry-After"))
+
+    def _request_records(
+        self, 
+        method: str,
+        function_name: str, 
+        function_route: str,
+        on_record: Callable[[Any], None],
+        params: Optional[Dict[str, str]] = None,
+        data: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        idempotent: bool = True
+    ) -> Response:
+        # Decodes a JSON array response as it arrives and passes each element to on_record,
+        # so that a large listing is never held as a whole
+        url = function_route.format(self.hostname)
+        attempt = 0
+        count = 0
+        while True:
+            start = monotonic()
+            try:
+                with self.stats.measure(function_route, data) as call, self._session.request(method, url, params=params, data=data,
+                        headers=headers, stream=True, verify=False, timeout=self._timeout) as res:
+                    call.response(res.status_code)
+                    try:
+                        res.raise_for_status()
+                    except HTTPError:
+                        logging.error("{}: status_code:{} content:{}".format(function_name, res.status_code, res.content))
+                        raise
+                    self.guard.succeeded(monotonic() - start)
+                    if res.status_code == 304:
+                        logging.info("{}: not modified".format(function_name))
+                        # read the empty body, a response closed unread also closes its keep-alive connection
+                        res.content
+                        return res
+                    for record in iter_json_array(call.counted(res.iter_content(STREAM_CHUNK_SIZE))):
+                        on_record(record)
+                        count += 1
+                    logging.info("{}: {} records".format(function_name, count))
+                    return res
+            except (HTTPError, ConnectionError, Timeout, ChunkedEncodingError) as e:
+                # the records passed on cannot be taken back, a broken stream is only retried before the first one
+                delay = self._retry_delay(e, attempt, idempotent and count == 0)
+                if delay is None:
+                    raise
+                logging.warning("{}: attempt {} failed ({}), retrying in {:.2f}s".format(function_name, attempt + 1, e, delay))
+                sleep(delay)
+                attempt += 1
 
     # Starts auto-scale api
     def get_grow_decision(self) -> Dict[str, GrowDecision]:
         res = self._post(self.get_grow_decision.__name__, self.GROW_DECISION_API_ROUTE, data=None)
         logging.info(res.content)
-        grow_decision_dict = {k: GrowDecision(v['CoresToGrow'], v['NodesToGrow'], v['SocketsToGrow']) for k, v in json.loads(res.content).items()}
-        if not ci_in("Default", grow_decision_dict):
-            grow_decision_dict["Default"] = GrowDecision(0.0, 0.0, 0.0)
-        return grow_decision_dict
+        return parse_grow_decision(res.content)
 
     def list_node_names(
         self,
@@ -195,43 +481,69 @@ class HpcRestClient:
 
     def list_nodes(
         self, 
-        filters: Dict[str, str] = {}
+        filters: Dict[str, str] = {},
+        status: bool = True,
+        node_filter: Optional[Callable[[HpcNode], bool]] = None
     ) -> Union[List[NodeIdentity], List[HpcNode]]:
-        res = self._get(self.list_nodes.__name__, self.LIST_NODES_ROUTE, filters)
-        nodes = [NodeIdentity(i['Id'], i['Name']) for i in json.loads(res.content)]
-        if len(nodes) == 0:
-            return nodes
-        nodeId_byName = make_dict_single(nodes, keyfunc=lambda n : n.Name, valuefunc=lambda n : n.Id)
-        res = self._get(self.list_nodes.__name__, self.LIST_NODES_STATUS_ROUTE, filters)
-        nodeStatusList = []
-        for n in json.loads(res.content):
-            nodeName = n["Name"]
-            if nodeName in nodeId_byName:
-                nodeStatusList.append(HpcNode(nodeId_byName[nodeName], nodeName, n["NodeHealth"],n["NodeState"],n["Groups"], n["NodeTemplate"]))
-        return nodeStatusList
-
-    def list_computenodes(self) -> List[HpcNode]:
-        nodes = self.list_nodes(filters={"nodeGroup":"ComputeNodes"})
-        return [n for n in nodes if n.is_computenode]
+        if not status:
+            return [NodeIdentity(node_id, name) for name, node_id in self._list_node_identities(filters).items()]
+        if len(self.node_id_cache) == 0:
+            # List the Ids first so that the status records can be joined as they arrive
+            self._list_node_identities(filters)
+        snapshot = self.__status_snapshots.setdefault(status_snapshot_key(filters), NodeStatusSnapshot())
+        join = NodeStatusJoin(self.node_id_cache, snapshot, node_filter)
+        headers = snapshot.conditional_headers()
+        snapshot.begin()
+        res = self._request_records("GET", self.list_nodes.__name__, self.LIST_NODES_STATUS_ROUTE, join.add,
+            params=filters, headers=headers)
+        if res.status_code == 304:
+            nodes, self.last_status_refresh = snapshot.not_modified()
+            return join.filter(nodes)
+        if len(join.misses) > 0:
+            # Node Ids do not change, only fetch the identity list when the status list has unknown names
+            join.resolve(self._list_node_identities(filters))
+        self.last_status_refresh = snapshot.commit(res.headers)
+        logging.debug("Node status refresh: {}".format(self.last_status_refresh))
+        return join.nodes
+
+    def _list_node_identities(
+        self, 
+        filters: Optional[Dict[str, str]]
+    ) -> Dict[str, str]:
+        nodeId_byName: Dict[str, str] = {}
+        self._request_records("GET", self.list_nodes.__name__, self.LIST_NODES_ROUTE,
+            lambda i: nodeId_byName.__setitem__(i['Name'], i['Id']), params=filters)
+        self.node_id_cache.update(((node_id, name) for name, node_id in nodeId_byName.items()), complete=not filters)
+        return nodeId_byName
+
+    def list_computenodes(
+        self,
+        active_only: bool = False
+    ) -> List[HpcNode]:
+        # filtered while the records arrive, the other nodes are not kept
+        node_filter = is_active_computenode if active_only else is_computenode
+        return self.list_nodes(filters={"nodeGroup":"ComputeNodes"}, node_filter=node_filter)
 
     def get_nodes(
         self, 
         node_names: Iterable[str]
     ) -> Union[List[NodeIdentity], List[HpcNode]]:
         assert len(node_names) > 0
-        res = self._get(self.list_nodes.__name__, self.LIST_NODES_ROUTE, None)
-        nodes = [NodeIdentity(i['Id'], i['Name']) for i in json.loads(res.content) if ci_in(i['Name'], node_names)]
-        if len(nodes) == 0:
-            return []
-        nodeId_byName = make_dict_single(nodes, keyfunc=lambda n : n.Name, valuefunc=lambda n : n.Id)
-        params = json.dumps({"nodeNames": node_names})
+        join = NodeStatusJoin(self.node_id_cache)
+        params = json.dumps({"nodeNames": list(node_names)})
+        self._request_records("POST", self.get_node_status_exact.__name__, self.NODE_STATUS_EXACT_ROUTE, join.add, data=params)
+        if len(join.misses) > 0:
+            join.resolve(self._list_node_identities(None))
+        return join.nodes
+
+    def get_node_status_exact(
+        self, 
+        node_names: Iterable[str]
+    ) -> List[Dict[str, Any]]:
+        assert len(node_names) > 0
+        params = json.dumps({"nodeNames": list(node_names)})
         res = self._post(self.get_node_status_exact.__name__, self.NODE_STATUS_EXACT_ROUTE, params)
-        nodeStatusList = []
-        for n in json.loads(res.content):
-            nodeName = n["Name"]
-            if nodeName in nodeId_byName:
-                nodeStatusList.append(HpcNode(nodeId_byName[nodeName], nodeName, n["NodeHealth"],n["NodeState"],n["Groups"], n["NodeTemplate"]))
-        return nodeStatusList
+        return json.loads(res.content)
 
     def list_idle_nodes(
         self, 
@@ -245,35 +557,30 @@ class HpcRestClient:
     def check_nodes_idle(
         self, 
         node_names: Iterable[str]
-    ) -> List[IdleNode]:
+    ) -> BulkResult:
         assert len(node_names) > 0
-        data = json.dumps(node_names)
-        res = self._post(self.check_nodes_idle.__name__, self.CHECK_NODES_IDLE_ROUTE, data)
-        return [IdleNode(i['NodeName'], i['TimeStamp'], i['ServerName']) for i in json.loads(res.content)]
+        return self._post_chunked(self.check_nodes_idle.__name__, self.CHECK_NODES_IDLE_ROUTE, node_names,
+            to_item=new_idle_node)
 
     # Starts node management api
     def bring_nodes_online(
         self, 
         node_names: Iterable[str]
-    ) -> List[str]:
+    ) -> BulkResult:
         assert len(node_names) > 0
-        data = json.dumps(node_names)
-        res = self._post(self.bring_nodes_online.__name__, self.BRING_NODES_ONLINE_ROUTE, data)
-        return json.loads(res.content)
+        return self._post_chunked(self.bring_nodes_online.__name__, self.BRING_NODES_ONLINE_ROUTE, node_names)
 
     def take_nodes_offline(
         self, 
         node_names: Iterable[str]
-    ) -> List[str]:
+    ) -> BulkResult:
         assert len(node_names) > 0
-        data = json.dumps(node_names)
-        res = self._post(self.take_nodes_offline.__name__, self.TAKE_NODES_OFFLINE_ROUTE, data)
-        return json.loads(res.content)
+        return self._post_chunked(self.take_nodes_offline.__name__, self.TAKE_NODES_OFFLINE_ROUTE, node_names)
 
     def assign_default_compute_node_template(
         self, 
         node_names: Iterable[str]
-    ) -> List[str]:
+    ) -> BulkResult:
         assert len(node_names) > 0
         return self.assign_nodes_template(node_names, self.DEFAULT_COMPUTENODE_TEMPLATE)
 
@@ -281,20 +588,43 @@ class HpcRestClient:
         self, 
         node_names: Iterable[str], 
         template_name: str
-    ) -> List[str]:
+    ) -> BulkResult:
         assert len(node_names) > 0 and template_name
-        params = json.dumps({"nodeNames": node_names, "templateName": template_name})
-        res = self._post(self.assign_nodes_template.__name__, self.ASSIGN_NODES_TEMPLATE_ROUTE, params)
-        return json.loads(res.content)
+        return self._post_chunked(self.assign_nodes_template.__name__, self.ASSIGN_NODES_TEMPLATE_ROUTE, node_names,
+            lambda chunk: json.dumps({"nodeNames": chunk, "templateName": template_name}))
 
     def remove_nodes(
         self, 
         node_names: Iterable[str]
-    ) -> List[str]:
+    ) -> BulkResult:
         assert len(node_names) > 0
-        data = json.dumps(node_names)
-        res = self._post(self.remove_nodes.__name__, self.REMOVE_NODES_ROUTE, data)
-        return json.loads(res.content)
+        # a retried removal may hit a node the first attempt already removed
+        result = self._post_chunked(self.remove_nodes.__name__, self.REMOVE_NODES_ROUTE, node_names, idempotent=False)
+        # a node added again under the same name gets a new Id
+        self.node_id_cache.discard(node_names)
+        return result
+
+    def _post_chunked(
+        self, 
+        function_name: str, 
+        function_route: str,
+        node_names: Iterable[str],
+        make_body: Callable[[List[str]], str] = json.dumps,
+        to_item: Optional[Callable[[Any], Any]] = None,
+        idempotent: bool = True
+    ) -> BulkResult:
+        # Large node lists are sent in chunks with a bounded number in flight, a failed chunk does not fail the others
+        def post_chunk(chunk: List[str]) -> List[Any]:
+            if to_item is None:
+                res = self._post(function_name, function_route, make_body(chunk), idempotent=idempotent)
+                return json.loads(res.content)
+            items: List[Any] = []
+            self._request_records("POST", function_name, function_route, lambda r: items.append(to_item(r)), data=make_body(chunk),
+                idempotent=idempotent)
+            return items
+        chunk_results = run_chunked(post_chunk, list(node_names), self._chunk_size, self._chunks_in_flight,
+            self.guard.timeout(self._bulk_timeout))
+        return BulkResult(function_name, chunk_results)
 
     def wait_node_state(
         self, 
@@ -304,14 +634,10 @@ class HpcRestClient:
         interval: int = 1
     ) -> bool:
         assert len(node_names) > 0
-        end = datetime.utcnow()
-        if timeout_seconds < 0:
-            end = datetime.utcnow() + timedelta(weeks=9999)
-        elif timeout_seconds > 0:
-            end = datetime.utcnow() + timedelta(seconds=timeout_seconds)
+        end = wait_deadline(timeout_seconds)
         while True:
             nodes = self.get_node_status_exact(node_names)
-            if len(nodes) == len([n for n in nodes if ci_equals(n["NodeState"], target_state)]):
+            if all_in_state(nodes, target_state):
                 return True
             if datetime.utcnow() > end:
                 return False
@@ -335,7 +661,7 @@ class HpcRestClient:
     ) -> bool:
         params = json.dumps({"name": group_name, "description": group_description})
         try:
-            self._post(self.add_node_group.__name__, self.ADD_NEW_GROUP_ROUTE, params)
+            self._post(self.add_node_group.__name__, self.ADD_NEW_GROUP_ROUTE, params, idempotent=False)
             return True
         except:
             return False
@@ -344,10 +670,9 @@ class HpcRestClient:
         self, 
         group_name: str, 
         node_names: Iterable[str]
-    ) -> List[str]:
+    ) -> BulkResult:
         assert len(node_names) > 0 and group_name
         logging.debug("Adding nodes {} to nodegroup {}".format(node_names, group_name))
-        res = self._post(self.add_node_to_node_group.__name__, self.ADD_NODES_TO_NODE_GROUP_ROUTE.format(
-            group_name=group_name), json.dumps(node_names))
-        return json.loads(res.content)
+        return self._post_chunked(self.add_node_to_node_group.__name__, self.ADD_NODES_TO_NODE_GROUP_ROUTE.format(
+            group_name=group_name), node_names)
 
@@ -0,0 +1,412 @@
+import heapq
+import json
+import random
+import ssl
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+import hpc.autoscale.hpclogging as logging
+from .commonutil import CIDict, CISet, ci_in
+
+API_ROOT = "/HpcManager/api/"
+SimulatedResponse = Tuple[int, Dict[str, str], bytes]
+
+
+class SimulatedHeadNode:
+    """
+    In-memory model of the HPC Pack head node behind the REST routes used by HpcRestClient.
+
+    The nodes are status records (Id, Name, NodeHealth, NodeState, Groups, NodeTemplate). The node
+    operations move the nodes through the states a head node shows, each step taking
+    transition_delay seconds: assigning a template to an Unapproved node goes through Provisioning
+    to Offline, bringing a node online goes through Starting, taking it offline through Draining and
+    removing it through Removing. Every request is delayed by latency (plus up to latency_jitter and
+    per_node_latency for each node in the request), and fails with error_status at error_rate. The
+    status records are padded with record_padding bytes to mimic larger payloads.
+    """
+    def __init__(
+        self,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        per_node_latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        transition_delay: float = 0.0,
+        record_padding: int = 0,
+        seed: int = 0
+    ) -> None:
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.per_node_latency = per_node_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.transition_delay = transition_delay
+        self.record_padding = record_padding
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__nodes: CIDict[Dict[str, Any]] = CIDict()
+        self.__node_groups = CISet()
+        self.__grow_decisions: Dict[str, Dict[str, float]] = {}
+        self.__idle_node_names = CISet()
+        # (due time, sequence, node name, status updates or None to delete the node)
+        self.__pending: List[Tuple[float, int, str, Optional[Dict[str, Any]]]] = []
+        self.__sequence = 0
+        self.__version = 0
+        self.__last_modified = datetime.utcnow()
+        self.request_counts: Dict[str, int] = {}
+
+    @classmethod
+    def from_cluster(cls, cluster: Any, **settings: Any) -> "SimulatedHeadNode":
+        """
+        A head node serving the HPC Pack side of a benchmark.SyntheticCluster.
+        """
+        head_node = cls(**settings)
+        head_node.load_cluster(cluster)
+        return head_node
+
+    def load_cluster(self, cluster: Any) -> None:
+        self.load(
+            cluster.hpc_nodes,
+            node_groups=cluster.node_groups,
+            grow_decisions={grp: {"CoresToGrow": g.cores_to_grow, "NodesToGrow": g.nodes_to_grow, "SocketsToGrow": g.sockets_to_grow}
+                            for grp, g in cluster.grow_decisions.items()},
+            idle_node_names=cluster.idle_node_names)
+
+    def load(
+        self,
+        nodes: Iterable[Dict[str, Any]],
+        node_groups: Iterable[str] = ("ComputeNodes", "HeadNodes", "WCFBrokerNodes"),
+        grow_decisions: Optional[Dict[str, Dict[str, float]]] = None,
+        idle_node_names: Iterable[str] = ()
+    ) -> None:
+        with self.__lock:
+            self.__nodes = CIDict()
+            for n in nodes:
+                self.__nodes[n["Name"]] = dict(n, Groups=list(n["Groups"]))
+            self.__node_groups = CISet(node_groups)
+            self.__grow_decisions = dict(grow_decisions or {})
+            self.__idle_node_names = CISet(idle_node_names)
+            self.__pending = []
+            self.__changed()
+        self.request_counts = {}
+
+    def add_node(
+        self,
+        node_id: str,
+        name: str,
+        groups: Iterable[str] = ("ComputeNodes",)
+    ) -> None:
+        """
+        Adds a node as it shows up when a new VM joins the cluster, Unapproved and without a template.
+        """
+        with self.__lock:
+            self.__nodes[name] = {"Id": node_id, "Name": name, "NodeHealth": "Unapproved", "NodeState": "Offline",
+                                  "Groups": list(groups), "NodeTemplate": None}
+            self.__changed()
+
+    def set_grow_decision(self, group: str, cores_to_grow: float = 0.0, nodes_to_grow: float = 0.0, sockets_to_grow: float = 0.0) -> None:
+        with self.__lock:
+            self.__grow_decisions[group] = {"CoresToGrow": cores_to_grow, "NodesToGrow": nodes_to_grow, "SocketsToGrow": sockets_to_grow}
+
+    def set_idle(self, node_names: Iterable[str], idle: bool = True) -> None:
+        with self.__lock:
+            if idle:
+                self.__idle_node_names.update(node_names)
+            else:
+                for name in node_names:
+                    self.__idle_node_names.discard(name)
+
+    def node(self, name: str) -> Optional[Dict[str, Any]]:
+        with self.__lock:
+            self.__advance()
+            n = self.__nodes.get(name)
+            return dict(n) if n is not None else None
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        body: bytes = b"",
+        headers: Optional[Dict[str, str]] = None
+    ) -> SimulatedResponse:
+        """
+        Serves one request after the simulated latency, returns the status code, the headers and the body.
+        """
+        url = urlsplit(path)
+        route = unquote(url.path)
+        if not route.startswith(API_ROOT):
+            return self.__error(404, "Unknown route {}".format(route))
+        route = route[len(API_ROOT):].strip("/")
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        payload: Any = json.loads(body) if body else None
+        if_none_match = {k.lower(): v for k, v in (headers or {}).items()}.get("if-none-match")
+        with self.__lock:
+            self.request_counts[route] = self.request_counts.get(route, 0) + 1
+
+        node_names: List[str] = (payload.get("nodeNames") if isinstance(payload, dict) else payload) or []
+        delay = self.latency + self.__random.uniform(0, self.latency_jitter)
+        delay += self.per_node_latency * len(node_names)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate > 0 and self.__random.random() < self.error_rate:
+            return self.__error(self.error_status, "Simulated failure of {} {}".format(method, route))
+
+        with self.__lock:
+            self.__advance()
+            if method == "GET" and route in ["nodes", "nodes/status"]:
+                etag = '"{}"'.format(self.__version)
+                if if_none_match == etag:
+                    return 304, {"ETag": etag}, b""
+                nodes = self.__filter_nodes(query.get("nodeGroup"))
+                if route == "nodes":
+                    content: Any = [{"Id": n["Id"], "Name": n["Name"]} for n in nodes]
+                else:
+                    content = [self.__status_record(n) for n in nodes]
+                return self.__json(content, {"ETag": etag, "Last-Modified": self.__last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT")})
+            if method == "POST" and route == "nodes/status/getExact":
+                return self.__json([self.__status_record(self.__nodes[name]) for name in node_names if name in self.__nodes])
+            if method == "POST" and route == "auto-scale/grow-decision":
+                return self.__json(self.__grow_decisions)
+            if method == "POST" and route == "auto-scale/check-nodes-idle":
+                now = datetime.utcnow().isoformat()
+                return self.__json([{"NodeName": self.__nodes[name]["Name"], "TimeStamp": now, "ServerName": "headnode"}
+                                    for name in node_names if name in self.__nodes and name in self.__idle_node_names])
+            if method == "POST" and route == "nodes/bringOnline":
+                return self.__json(self.__transition(node_names, ["Offline"], {"NodeState": "Starting"}, {"NodeState": "Online"}, healthy_only=True))
+            if method == "POST" and route == "nodes/takeOffline":
+                return self.__json(self.__transition(node_names, ["Online", "Starting"], {"NodeState": "Draining"}, {"NodeState": "Offline"}))
+            if method == "POST" and route == "nodes/assignTemplate":
+                return self.__json(self.__assign_template(payload["nodeNames"], payload["templateName"]))
+            if method == "POST" and route == "nodes/remove":
+                return self.__json(self.__transition(node_names, None, {"NodeState": "Removing"}, None))
+            if route == "node-groups":
+                if method == "GET":
+                    group_name = query.get("nodeGroupName")
+                    return self.__json([g for g in self.__node_groups if not group_name or ci_in(g, [group_name])])
+                if method == "POST":
+                    self.__node_groups.add(payload["name"])
+                    return self.__json({"Name": payload["name"], "Description": payload.get("description", "")})
+            if method == "POST" and route.startswith("node-groups/"):
+                group_name = route[len("node-groups/"):]
+                if group_name not in self.__node_groups:
+                    return self.__error(404, "Node group {} not found".format(group_name))
+                added = []
+                for name in node_names:
+                    n = self.__nodes.get(name)
+                    if n is not None and not ci_in(group_name, n["Groups"]):
+                        n["Groups"].append(group_name)
+                        added.append(n["Name"])
+                if added:
+                    self.__changed()
+                return self.__json(added)
+        return self.__error(404, "Unknown route {} {}".format(method, route))
+
+    def __filter_nodes(self, group_name: Optional[str]) -> List[Dict[str, Any]]:
+        if not group_name:
+            return list(self.__nodes.values())
+        return [n for n in self.__nodes.values() if ci_in(group_name, n["Groups"])]
+
+    def __status_record(self, n: Dict[str, Any]) -> Dict[str, Any]:
+        record = {k: v for k, v in n.items() if k != "Id"}
+        if self.record_padding > 0:
+            record["Padding"] = "x" * self.record_padding
+        return record
+
+    def __assign_template(self, node_names: List[str], template_name: str) -> List[str]:
+        assigned = []
+        for name in node_names:
+            n = self.__nodes.get(name)
+            if n is None:
+                continue
+            n["NodeTemplate"] = template_name
+            if n["NodeHealth"] == "Unapproved":
+                n["NodeState"], n["NodeHealth"] = "Provisioning", "Transitional"
+                self.__schedule(n["Name"], {"NodeState": "Offline", "NodeHealth": "OK"})
+            assigned.append(n["Name"])
+        if assigned:
+            self.__changed()
+        return assigned
+
+    def __transition(
+        self,
+        node_names: List[str],
+        from_states: Optional[List[str]],
+        updates: Dict[str, Any],
+        final_updates: Optional[Dict[str, Any]],
+        healthy_only: bool = False
+    ) -> List[str]:
+        # the nodes go to the intermediate state now and to the final state after transition_delay
+        moved = []
+        for name in node_names:
+            n = self.__nodes.get(name)
+            if n is None or (from_states is not None and not ci_in(n["NodeState"], from_states)):
+                continue
+            if healthy_only and n["NodeHealth"] != "OK":
+                continue
+            n.update(updates)
+            self.__schedule(n["Name"], final_updates)
+            moved.append(n["Name"])
+        if moved:
+            self.__changed()
+        return moved
+
+    def __schedule(self, name: str, updates: Optional[Dict[str, Any]]) -> None:
+        self.__sequence += 1
+        heapq.heappush(self.__pending, (time.monotonic() + self.transition_delay, self.__sequence, name, updates))
+
+    def __advance(self) -> None:
+        now = time.monotonic()
+        changed = False
+        while self.__pending and self.__pending[0][0] <= now:
+            _, _, name, updates = heapq.heappop(self.__pending)
+            if name not in self.__nodes:
+                continue
+            if updates is None:
+                del self.__nodes[name]
+                self.__idle_node_names.discard(name)
+            else:
+                self.__nodes[name].update(updates)
+            changed = True
+        if changed:
+            self.__changed()
+
+    def __changed(self) -> None:
+        self.__version += 1
+        self.__last_modified = datetime.utcnow()
+
+    def __json(self, content: Any, headers: Optional[Dict[str, str]] = None) -> SimulatedResponse:
+        response_headers = {"Content-Type": "application/json; charset=utf-8"}
+        response_headers.update(headers or {})
+        return 200, response_headers, json.dumps(content).encode("utf-8")
+
+    def __error(self, status: int, message: str) -> SimulatedResponse:
+        return status, {"Content-Type": "application/json; charset=utf-8"}, json.dumps({"Message": message}).encode("utf-8")
+
+
+class SimulatorServer:
+    """
+    Serves a SimulatedHeadNode over HTTPS, with certfile holding the server certificate and its key.
+    Point HpcRestClient at it with hostname set to the hostname property.
+    """
+    def __init__(
+        self,
+        head_node: SimulatedHeadNode,
+        certfile: str,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ) -> None:
+        self.head_node = head_node
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # the headers and the body are written separately, do not let Nagle delay the body
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                self.__serve("GET")
+
+            def do_POST(self) -> None:
+                self.__serve("POST")
+
+            def __serve(self, method: str) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length > 0 else b""
+                try:
+                    status, headers, content = head_node.handle(method, self.path, body, dict(self.headers.items()))
+                except Exception as e:
+                    logging.exception("Simulator failed to serve {} {}".format(method, self.path))
+                    status, headers, content = 500, {}, json.dumps({"Message": str(e)}).encode("utf-8")
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logging.debug("Simulator: " + format % args)
+
+        self.__server = ThreadingHTTPServer((host, port), Handler)
+        self.__server.daemon_threads = True
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile)
+        self.__server.socket = context.wrap_socket(self.__server.socket, server_side=True)
+        self.__thread: Optional[threading.Thread] = None
+
+    @property
+    def hostname(self) -> str:
+        host, port = self.__server.server_address[:2]
+        if isinstance(host, bytes):
+            host = host.decode("ascii")
+        return "{}:{}".format(host, port)
+
+    def start(self) -> "SimulatorServer":
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="hpcpack-simulator", daemon=True)
+        self.__thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self.__server.serve_forever()
+
+    def close(self) -> None:
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.__server.server_close()
+
+    def __enter__(self) -> "SimulatorServer":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from .benchmark import SyntheticCluster
+
+    parser = ArgumentParser(description="Serves the HPC Pack REST API of a synthetic cluster for load tests off-cluster")
+    parser.add_argument("--cert", required=True, help="PEM file with the server certificate and its key")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--nodes", type=int, default=1000, help="Number of CycleCloud nodes of the synthetic cluster")
+    parser.add_argument("--nodearrays", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="Up to this many random seconds added to every request")
+    parser.add_argument("--per-node-latency", type=float, default=0.0, help="Seconds added per node in a request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of the requests that fail")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--transition-delay", type=float, default=0.0, help="Seconds a node takes to change state")
+    parser.add_argument("--record-padding", type=int, default=0, help="Bytes added to each node status record")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    cluster = SyntheticCluster(args.nodes, nodearray_count=args.nodearrays, seed=args.seed)
+    head_node = SimulatedHeadNode.from_cluster(
+        cluster,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        per_node_latency=args.per_node_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        transition_delay=args.transition_delay,
+        record_padding=args.record_padding,
+        seed=args.seed)
+    server = SimulatorServer(head_node, args.cert, host=args.host, port=args.port)
+    print("Serving {} HPC Pack nodes at https://{}{}, set hpcpack.hn_hostname to {}".format(
+        len(cluster.hpc_nodes), server.hostname, API_ROOT, server.hostname))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,89 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator, List
+
+# bytes read from a response at a time when it is decoded as a stream
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_END = ",]" + _WHITESPACE
+
+
+class JsonArrayDecoder:
+    """
+    Incremental decoder of a top-level JSON array. feed() takes the response body chunk by chunk
+    and returns the elements completed so far, so only the current partial element is buffered
+    instead of the whole body, its decoded string and the decoded list at the same time.
+    """
+    # parser states
+    __OPEN = 0       # expecting "["
+    __FIRST = 1      # expecting the first element or "]"
+    __ELEMENT = 2    # expecting an element after ","
+    __NEXT = 3       # expecting "," or "]"
+    __DONE = 4
+
+    def __init__(self) -> None:
+        self.__text = codecs.getincrementaldecoder("utf-8")()
+        self.__decoder = json.JSONDecoder()
+        self.__buf = ""
+        self.__state = self.__OPEN
+
+    @property
+    def done(self) -> bool:
+        return self.__state == self.__DONE
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[Any]:
+        buf = self.__buf + self.__text.decode(chunk, final)
+        end = len(buf)
+        pos = 0
+        elements: List[Any] = []
+        while True:
+            while pos < end and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos >= end:
+                break
+            c = buf[pos]
+            if self.__state == self.__OPEN:
+                if c != "[":
+                    raise ValueError("Expected a JSON array, got {!r}".format(buf[pos:pos + 20]))
+                self.__state = self.__FIRST
+                pos += 1
+            elif self.__state == self.__DONE:
+                raise ValueError("Extra data after the JSON array: {!r}".format(buf[pos:pos + 20]))
+            elif c == "]" and self.__state != self.__ELEMENT:
+                self.__state = self.__DONE
+                pos += 1
+            elif self.__state == self.__NEXT:
+                if c != ",":
+                    raise ValueError("Expected ',' or ']' in the JSON array, got {!r}".format(buf[pos:pos + 20]))
+                self.__state = self.__ELEMENT
+                pos += 1
+            else:
+                try:
+                    element, element_end = self.__decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    # the element continues in the next chunk
+                    break
+                if not final and isinstance(element, (int, float)) and (element_end == end or buf[element_end] not in _NUMBER_END):
+                    # so may a number, "1" of "1.5"
+                    break
+                elements.append(element)
+                self.__state = self.__NEXT
+                pos = element_end
+        self.__buf = buf[pos:]
+        return elements
+
+    def close(self) -> List[Any]:
+        elements = self.feed(b"", final=True)
+        if not self.done:
+            raise ValueError("Truncated JSON array")
+        return elements
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    decoder = JsonArrayDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+import time
+import hpc.autoscale.hpclogging as logging
+from typing import Iterable, Optional, Tuple
+from .commonutil import CIDict
+
+
+class NodeIdCache:
+    """
+    HPC Pack node name to node Id map, kept across rounds and, with a cache_file, across processes.
+
+    The Id of a node never changes while the node exists, so the status listings can be joined
+    with cached Ids instead of fetching the identity list every round. The identity list is
+    fetched again when a listing holds a name the cache does not know, when a node was removed
+    through the client, or when an Id is older than max_age seconds, in case the node was removed
+    and added again elsewhere.
+    """
+    DEFAULT_MAX_AGE = 3600.0
+
+    def __init__(
+        self,
+        cache_file: Optional[str] = None,
+        max_age: float = DEFAULT_MAX_AGE
+    ) -> None:
+        self.__cache_file = cache_file
+        self.__max_age = max_age
+        # name -> (Id, epoch time the Id was listed)
+        self.__ids: CIDict[Tuple[str, float]] = CIDict()
+        self.__lock = threading.Lock()
+        self.__load()
+
+    def __len__(self) -> int:
+        return len(self.__ids)
+
+    def get(self, node_name: str) -> Optional[str]:
+        """
+        Returns the Id of node_name, or None if it is unknown or expired.
+        """
+        entry = self.__ids.get(node_name)
+        if entry is None or entry[1] < time.time() - self.__max_age:
+            return None
+        return entry[0]
+
+    def update(self, identities: Iterable[Tuple[str, str]], complete: bool = False) -> None:
+        """
+        Records the (Id, name) pairs of an identity listing, a complete listing also drops the names it does not hold.
+        """
+        now = time.time()
+        with self.__lock:
+            if complete:
+                self.__ids.clear()
+            for node_id, name in identities:
+                self.__ids[name] = (node_id, now)
+            self.__save()
+
+    def discard(self, node_names: Iterable[str]) -> None:
+        with self.__lock:
+            removed = [name for name in node_names if self.__ids.pop(name, None) is not None]
+            if len(removed) > 0:
+                self.__save()
+
+    def __load(self) -> None:
+        if not self.__cache_file or not os.path.exists(self.__cache_file):
+            return
+        try:
+            with open(self.__cache_file, "r", encoding="utf-8") as cf:
+                content = json.load(cf)
+            for name, (node_id, listed) in content["ids"].items():
+                self.__ids[name] = (node_id, float(listed))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.warning("Ignoring unreadable node id cache {}: {}".format(self.__cache_file, e))
+            self.__ids.clear()
+
+    def __save(self) -> None:
+        if not self.__cache_file:
+            return
+        content = {"ids": dict(self.__ids.items())}
+        tmp_file = self.__cache_file + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as cf:
+                json.dump(content, cf, separators=(",", ":"))
+            os.replace(tmp_file, self.__cache_file)
+        except OSError as e:
+            # only a cache, the next process rebuilds it from the identity listing
+            logging.warning("Failed to save node id cache {}: {}".format(self.__cache_file, e))
@@ -0,0 +1,219 @@
+from typing import Any, Dict, List
+from .commonutil import CIDict, CISet, ci_equals
+from .hpcpackdriver import HpcNode
+
+np: Any
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# HPC node states for which the idle check is done
+IDLE_CHECK_NODE_STATES = CISet(["Offline", "Starting", "Online", "Draining"])
+# codes of the columnar view, a state or health not listed is coded -1 and matches nothing
+NODE_STATES = ["Unknown", "Provisioning", "Offline", "Starting", "Online", "Draining", "Rejected", "Removing", "NotDeployed", "Stopping"]
+NODE_HEALTHS = ["OK", "Warning", "Error", "Transitional", "Unapproved"]
+
+
+class NodeSelector:
+    """
+    The selections of the HPC compute nodes the autoscale round acts on, made once the nodes are bound
+    to their CycleCloud nodes. drop_stopped_and_removed() narrows the nodes the selections other than
+    the tagging and the removal see, so one selector serves the stages of the round in any order.
+    """
+    def __init__(
+        self,
+        hpc_nodes: List[HpcNode]
+    ) -> None:
+        self.__all_nodes = hpc_nodes
+        self.nodes = hpc_nodes
+
+    def cc_tag_names(self) -> List[str]:
+        return [n.name for n in self.__all_nodes if n.shall_addcyclecloudtag]
+
+    def nodearray_tag_names(self) -> CIDict[List[str]]:
+        names_by_array: CIDict[List[str]] = CIDict()
+        for n in self.__all_nodes:
+            if n.shall_addnodearraytag:
+                names_by_array.setdefault(n.cc_nodearray, []).append(n.name)
+        return names_by_array
+
+    def remove_names(self) -> List[str]:
+        # the CC node is removed, or it is stopped and the HPC node has no node template
+        return [n.name for n in self.__all_nodes if n.removed_cc_node or (n.stopped_cc_node and not n.template_assigned)]
+
+    def stopped_online_names(self) -> List[str]:
+        return [n.name for n in self.__all_nodes if n.stopped_cc_node and ci_equals(n.state, "Online")]
+
+    def drop_stopped_and_removed(self) -> None:
+        self.nodes = [n for n in self.nodes if not (n.stopped_cc_node or n.removed_cc_node)]
+
+    def assign_template_names(self) -> List[str]:
+        return [n.name for n in self.nodes if n.bound_cc_node and not n.template_assigned]
+
+    def active_cc_nodes(self) -> List[HpcNode]:
+        return [n for n in self.nodes if n.template_assigned and n.bound_cc_node]
+
+    def ready_active_cc_nodes(self) -> List[HpcNode]:
+        return [n for n in self.active_cc_nodes() if n.ready_for_job]
+
+    def idle_check_candidates(
+        self,
+        grow_default_groups: bool,
+        group_hungry: Dict[str, bool]
+    ) -> List[HpcNode]:
+        # By default, we check idle for active CC nodes in HPC Pack with 'Offline', 'Starting', 'Online', 'Draining' state
+        candidates = [n for n in self.active_cc_nodes() if (not n.bound_cc_node.keep_alive) and n.state in IDLE_CHECK_NODE_STATES]
+
+        # We can exclude some nodes from idle checking:
+        # 1. If HPC Pack ask for grow in default node group(s), all healthy ONLINE nodes are considered as busy
+        # 2. If HPC Pack ask for grow in certain node group, all healthy ONLINE nodes in that node group are considered as busy
+        # 3. If a node group is hungry (new CC required or grow request not satisfied), no idle check needed for all nodes in that node array
+        if grow_default_groups:
+            candidates = [n for n in candidates if not n.ready_for_job]
+        for grp, hungry in group_hungry.items():
+            if hungry:
+                candidates = [n for n in candidates if not ci_equals(grp, n.cc_nodearray)]
+            elif not grow_default_groups:
+                candidates = [n for n in candidates if not (ci_equals(grp, n.cc_nodearray) and n.ready_for_job)]
+        return candidates
+
+    def bring_online_names(self, shrinking_cc_node_ids: CISet) -> List[str]:
+        return [n.name for n in self.active_cc_nodes()
+                if ci_equals(n.state, 'Offline') and not n.error and n.cc_node_id not in shrinking_cc_node_ids]
+
+    def shrinking_online_names(self, shrinking_cc_node_ids: CISet) -> List[str]:
+        return [n.name for n in self.active_cc_nodes() if ci_equals(n.state, 'Online') and n.cc_node_id in shrinking_cc_node_ids]
+
+
+class NodeColumns(NodeSelector):
+    """
+    NodeSelector on a columnar view of the nodes: the state, health and node array are coded
+    into NumPy arrays along with the flags the selections test, once per round, and each
+    selection is one vectorized mask instead of a pass over the nodes through their properties.
+    """
+    def __init__(
+        self,
+        hpc_nodes: List[HpcNode]
+    ) -> None:
+        if np is None:
+            raise RuntimeError("autoscale.columnar requires the numpy package, install it or disable the columnar view")
+        super().__init__(hpc_nodes)
+        self.__all_nodes = hpc_nodes
+        count = len(hpc_nodes)
+        # keyed by the casefolded value, CIDict lookups cost too much on this path
+        state_codes = {s.casefold(): i for i, s in enumerate(NODE_STATES)}
+        health_codes = {h.casefold(): i for i, h in enumerate(NODE_HEALTHS)}
+        # the node arrays of the bound nodes, coded in the order they are met
+        self.__nodearray_codes: Dict[str, int] = {}
+
+        # one pass over the nodes, a node property is read once whatever the number of selections
+        rows = []
+        for n in hpc_nodes:
+            cc_node = n.bound_cc_node
+            nodearray = cc_node.nodearray if cc_node else None
+            rows.append((
+                state_codes.get((n.state or "").casefold(), -1),
+                health_codes.get((n.health or "").casefold(), -1),
+                self.__nodearray_codes.setdefault(nodearray.casefold(), len(self.__nodearray_codes)) if nodearray else -1,
+                bool(cc_node),
+                bool(n.nodetemplate),
+                bool(n.cc_node_id),
+                "CycleCloudNodes" in n.nodegroups,
+                bool(cc_node) and nodearray in n.nodegroups,
+                bool(cc_node) and bool(cc_node.keep_alive),
+                bool(cc_node) and ci_equals(cc_node.target_state, 'Deallocated'),
+                # casefolded, so that the membership tests of the CC node Ids are plain array lookups
+                (n.cc_node_id or "").casefold()))
+        columns = list(zip(*rows)) if rows else [()] * 11
+
+        self.state = np.array(columns[0], dtype=np.int8)
+        self.health = np.array(columns[1], dtype=np.int8)
+        self.nodearray = np.array(columns[2], dtype=np.int32)
+        self.bound, self.template_assigned, self.is_cc_node, self.in_cc_group, self.in_nodearray_group, \
+            self.keep_alive, self.deallocating = [np.array(c, dtype=bool) for c in columns[3:10]]
+        self.cc_node_id = np.array(columns[10], dtype=str if count else "U1")
+        self.names = np.array([n.name for n in hpc_nodes], dtype=object)
+
+        self.error = self.health == NODE_HEALTHS.index("Error")
+        self.ready = (self.state == NODE_STATES.index("Online")) & (self.health == NODE_HEALTHS.index("OK"))
+        self.removed_cc = ~self.bound & (self.is_cc_node | (self.in_cc_group & (self.error | ~self.template_assigned)))
+        self.stopped_cc = self.bound & self.deallocating
+        self.active_cc = self.template_assigned & self.bound
+        # the nodes the selections see, narrowed by drop_stopped_and_removed
+        self.kept = np.ones(count, dtype=bool)
+
+    def __names(self, mask: Any) -> List[str]:
+        return self.names[mask].tolist()
+
+    def __nodes(self, mask: Any) -> List[HpcNode]:
+        return [self.__all_nodes[i] for i in np.flatnonzero(mask)]
+
+    def __in_ids(self, cc_node_ids: CISet) -> Any:
+        if len(cc_node_ids) == 0:
+            return np.zeros(len(self.__all_nodes), dtype=bool)
+        return np.isin(self.cc_node_id, [i.casefold() for i in cc_node_ids])
+
+    def cc_tag_names(self) -> List[str]:
+        return self.__names(self.bound & ~self.in_cc_group)
+
+    def nodearray_tag_names(self) -> CIDict[List[str]]:
+        names_by_array: CIDict[List[str]] = CIDict()
+        mask = self.bound & ~self.in_nodearray_group
+        for i in np.flatnonzero(mask):
+            node = self.__all_nodes[i]
+            names_by_array.setdefault(node.cc_nodearray, []).append(node.name)
+        return names_by_array
+
+    def remove_names(self) -> List[str]:
+        return self.__names(self.removed_cc | (self.stopped_cc & ~self.template_assigned))
+
+    def stopped_online_names(self) -> List[str]:
+        return self.__names(self.stopped_cc & (self.state == NODE_STATES.index("Online")))
+
+    def drop_stopped_and_removed(self) -> None:
+        self.kept = self.kept & ~(self.stopped_cc | self.removed_cc)
+        self.nodes = self.__nodes(self.kept)
+
+    def assign_template_names(self) -> List[str]:
+        return self.__names(self.kept & self.bound & ~self.template_assigned)
+
+    def active_cc_nodes(self) -> List[HpcNode]:
+        return self.__nodes(self.kept & self.active_cc)
+
+    def ready_active_cc_nodes(self) -> List[HpcNode]:
+        return self.__nodes(self.kept & self.active_cc & self.ready)
+
+    def idle_check_candidates(
+        self,
+        grow_default_groups: bool,
+        group_hungry: Dict[str, bool]
+    ) -> List[HpcNode]:
+        idle_check_states = [NODE_STATES.index(s) for s in IDLE_CHECK_NODE_STATES]
+        mask = self.kept & self.active_cc & ~self.keep_alive & np.isin(self.state, idle_check_states)
+        if grow_default_groups:
+            mask &= ~self.ready
+        for grp, hungry in group_hungry.items():
+            in_group = self.nodearray == self.__nodearray_codes.get(grp.casefold(), -2)
+            if hungry:
+                mask &= ~in_group
+            elif not grow_default_groups:
+                mask &= ~(in_group & self.ready)
+        return self.__nodes(mask)
+
+    def bring_online_names(self, shrinking_cc_node_ids: CISet) -> List[str]:
+        return self.__names(
+            self.kept & self.active_cc & (self.state == NODE_STATES.index("Offline")) & ~self.error & ~self.__in_ids(shrinking_cc_node_ids))
+
+    def shrinking_online_names(self, shrinking_cc_node_ids: CISet) -> List[str]:
+        return self.__names(self.kept & self.active_cc & (self.state == NODE_STATES.index("Online")) & self.__in_ids(shrinking_cc_node_ids))
+
+
+def new_node_selector(
+    config: Dict[str, Any],
+    hpc_nodes: List[HpcNode]
+) -> NodeSelector:
+    autoscale_config = config.get("autoscale") or {}
+    # the columnar view needs numpy, an optional dependency
+    selector_class = NodeColumns if autoscale_config.get("columnar") else NodeSelector
+    return selector_class(hpc_nodes)
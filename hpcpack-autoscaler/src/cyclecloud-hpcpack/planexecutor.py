@@ -0,0 +1,237 @@
+import threading
+from typing import Callable, Dict, List, Optional
+import hpc.autoscale.hpclogging as logging
+from hpc.autoscale.node.node import Node
+from hpc.autoscale.node.nodemanager import NodeManager
+from hpc.autoscale.results import BootupResult
+from .commonutil import CISet, ci_equals, run_dependent
+from .hpcnodehistory import NodeHistoryItem
+from .hpcpackdriver import BulkResult, HpcRestClient
+from .roundmetrics import RoundMetrics
+from .roundplan import GroupDemand, Plan, RoundInputs, start_nodes
+
+DEFAULT_APPLY_WORKERS = 4
+
+
+def apply_plan(
+    plan: Plan,
+    inputs: RoundInputs,
+    hpcpack_rest_client: HpcRestClient,
+    round_metrics: RoundMetrics,
+    allocated: bool = True,
+    skip_reason: Optional[Callable[[], Optional[str]]] = None,
+    max_workers: int = DEFAULT_APPLY_WORKERS
+) -> None:
+    """
+    Applies the actions of the plan and saves the node history with the updates of the plan.
+    allocated tells whether the new nodes of the plan are allocated on inputs.node_mgr already, as
+    when the plan was made on it by allocate_round, otherwise they are allocated again. The standby
+    nodes to start are allocated here in any case. skip_reason tells whether the node group tagging,
+    which can wait for a later round, must be skipped.
+
+    The actions run concurrently, up to max_workers at a time, except that a node is tagged once
+    its group is created, the CC nodes are shut down or terminated once the HPC nodes are taken
+    offline, and the node manager actions take turns. A failed action does not stop the others,
+    only the actions that depend on it, and the round fails once the node history is saved. A bulk
+    action fails as well when the head node failed some of its nodes, but for taking the nodes
+    offline: the CC nodes of those are kept running and the next round tries again.
+    """
+    node_mgr = inputs.node_mgr
+    node_history = inputs.node_history
+    actions: Dict[str, Callable[[], Dict[str, int]]] = {}
+    depends_on: Dict[str, List[str]] = {}
+    # the node manager is not meant to be called from several threads
+    node_mgr_lock = threading.Lock()
+    booted_nodes: List[Node] = []
+    failed_cc_ids = CISet()
+    nodes_to_shut_down: List[str] = []
+
+    round_metrics.begin("apply")
+    # the nodes are tagged in a later round, the tags are not needed to scale
+    group_tagging_skip_reason = skip_reason() if skip_reason else None
+    if group_tagging_skip_reason:
+        logging.warning("Skipping the node group tagging: {}".format(group_tagging_skip_reason))
+        round_metrics.add_phase("apply.group_tagging", 0.0, skipped=1)
+    else:
+        for cc_grp in plan.groups_to_create:
+            actions["create_group." + cc_grp] = _create_group_action(hpcpack_rest_client, cc_grp)
+        for cc_grp, add_tag_nodes in plan.nodes_to_tag.items():
+            actions["tag." + cc_grp] = _tag_action(hpcpack_rest_client, cc_grp, add_tag_nodes)
+            depends_on["tag." + cc_grp] = ["create_group." + cc_grp]
+
+    if len(plan.nodes_to_remove) > 0:
+        def remove_nodes() -> Dict[str, int]:
+            logging.info("Removing the HPC nodes: {}".format(plan.nodes_to_remove))
+            remove_result = hpcpack_rest_client.remove_nodes(plan.nodes_to_remove)
+            return _bulk_counts("nodes_removed", plan.nodes_to_remove, remove_result)
+        actions["remove_nodes"] = remove_nodes
+
+    if len(plan.templates_to_assign) > 0:
+        def assign_templates() -> Dict[str, int]:
+            logging.info("Assigning default node template for the HPC nodes: {}".format(plan.templates_to_assign))
+            assign_result = hpcpack_rest_client.assign_default_compute_node_template(plan.templates_to_assign)
+            return _bulk_counts("templates_assigned", plan.templates_to_assign, assign_result)
+        actions["assign_templates"] = assign_templates
+
+    if plan.new_node_count > 0 or plan.standby_starts:
+        def bootup() -> Dict[str, int]:
+            counts: Dict[str, int] = {}
+            with node_mgr_lock:
+                if not allocated:
+                    for new_nodes in plan.new_nodes:
+                        selector = {'ncpus': 1, 'node.nodearray': [new_nodes["nodearray"]], 'node.vm_size': [new_nodes["vm_size"]]}
+                        logging.info("Allocate: {}  New Nodes: {}".format(selector, new_nodes["count"]))
+                        result = node_mgr.allocate(selector, node_count=new_nodes["count"], allow_existing=False)
+                        if not result or result.total_slots < new_nodes["count"]:
+                            logging.warning("Allocated {} of the {} new nodes {}".format(result.total_slots if result else 0, new_nodes["count"], selector))
+                if plan.standby_starts:
+                    counts["standby_started"] = _start_standby(node_mgr, inputs, plan)
+                logging.info("Allocating {} nodes in total".format(len(node_mgr.new_nodes)))
+                bootup_result: BootupResult = node_mgr.bootup()
+            logging.info(bootup_result)
+            if bootup_result and bootup_result.nodes:
+                booted_nodes.extend(bootup_result.nodes)
+            counts["nodes_booted"] = len(booted_nodes)
+            return counts
+        actions["bootup"] = bootup
+    else:
+        logging.info("No need to allocate new nodes ...")
+
+    if len(plan.nodes_to_bring_online) > 0:
+        def bring_online() -> Dict[str, int]:
+            logging.info("Bringing the HPC nodes online: {}".format(plan.nodes_to_bring_online))
+            online_result = hpcpack_rest_client.bring_nodes_online(plan.nodes_to_bring_online)
+            return _bulk_counts("nodes_brought_online", plan.nodes_to_bring_online, online_result)
+        actions["bring_online"] = bring_online
+
+    if len(plan.nodes_to_take_offline) > 0:
+        def take_offline() -> Dict[str, int]:
+            logging.info("Taking the HPC nodes offline: {}".format(plan.nodes_to_take_offline))
+            offline_result = hpcpack_rest_client.take_nodes_offline(plan.nodes_to_take_offline)
+            if not offline_result.ok:
+                # Do not stop a CC node whose HPC node may still get jobs, retry in the next round
+                failed_offline_names = CISet(offline_result.failed_node_names)
+                failed_cc_ids.update([cc_id for name, cc_id in plan.offline_cc_ids.items() if name in failed_offline_names])
+                logging.warning("Not shutting down the CC nodes of the HPC nodes that failed to go offline: {}".format(failed_offline_names))
+            return {"nodes_taken_offline": len(plan.nodes_to_take_offline) - len(offline_result.failed_node_names)}
+        actions["take_offline"] = take_offline
+
+    if len(plan.nodes_to_shut_down) > 0:
+        def shut_down() -> Dict[str, int]:
+            cc_node_to_shutdown = _cc_nodes(inputs, [i for i in plan.nodes_to_shut_down if i not in failed_cc_ids])
+            if len(cc_node_to_shutdown) == 0:
+                return {}
+            logging.info("Shut down the following Cycle cloud node: {}".format([cn.name for cn in cc_node_to_shutdown]))
+            with node_mgr_lock:
+                node_mgr.shutdown_nodes(cc_node_to_shutdown)
+            nodes_to_shut_down.extend([n.delayed_node_id.node_id for n in cc_node_to_shutdown])
+            return {"nodes_shut_down": len(cc_node_to_shutdown)}
+        actions["shut_down"] = shut_down
+        depends_on["shut_down"] = ["take_offline"]
+
+    if len(plan.nodes_to_terminate) > 0:
+        def terminate() -> Dict[str, int]:
+            cc_node_to_terminate = _cc_nodes(inputs, [i for i in plan.nodes_to_terminate if i not in failed_cc_ids])
+            if len(cc_node_to_terminate) == 0:
+                return {}
+            logging.info("Terminating the following provisioning-timeout Cycle cloud nodes: {}".format([cn.name for cn in cc_node_to_terminate]))
+            with node_mgr_lock:
+                node_mgr.terminate_nodes(cc_node_to_terminate)
+            return {"nodes_terminated": len(cc_node_to_terminate)}
+        actions["terminate"] = terminate
+        depends_on["terminate"] = ["take_offline"]
+
+    failed_actions = []
+    results = run_dependent(actions, depends_on, max_workers=max_workers)
+    for name in actions:
+        result = results[name]
+        counts = dict(result.result or {})
+        if result.error is not None:
+            logging.error("Action {} failed: {}".format(name, result.error))
+            counts["failed"] = 1
+            failed_actions.append(name)
+        elif counts.get("failed_nodes"):
+            logging.error("Action {} failed for {} nodes".format(name, counts["failed_nodes"]))
+            counts["failed"] = 1
+            failed_actions.append(name)
+        round_metrics.add_phase("apply." + name, result.seconds, **counts)
+
+    # the node history is only changed here, not by the actions running concurrently
+    # the pre-warmed nodes are known by name, those of a plan allocated again may be named otherwise and are not tagged
+    prewarm_names = CISet(plan.prewarm_nodes)
+    for cc_node in booted_nodes:
+        nhi = node_history.find(cc_id=cc_node.delayed_node_id.node_id)
+        if nhi is None:
+            nhi = NodeHistoryItem(cc_node.delayed_node_id.node_id)
+            node_history.insert(nhi)
+        else:
+            nhi.restart()
+        if cc_node.name in prewarm_names:
+            nhi.prewarm_time = plan.created
+    for cc_id in plan.prewarm_hits:
+        nhi = node_history.find(cc_id=cc_id)
+        if nhi is not None:
+            nhi.prewarm_hit_time = plan.created
+    for cc_id, idle_from in plan.idle_from.items():
+        nhi = node_history.find(cc_id=cc_id)
+        if nhi is not None:
+            nhi.idle_from = idle_from
+    for cc_id in nodes_to_shut_down:
+        nhi = node_history.find(cc_id=cc_id)
+        if nhi is not None:
+            nhi.stop_time = plan.created
+
+    round_metrics.begin("save")
+    logging.info("Save node history: {} items".format(len(node_history.items)))
+    node_history.save()
+    round_metrics.count("items", len(node_history.items))
+    if failed_actions:
+        raise RuntimeError("{} of the {} actions failed: {}".format(len(failed_actions), len(actions), ", ".join(failed_actions)))
+
+
+def _create_group_action(hpcpack_rest_client: HpcRestClient, cc_grp: str) -> Callable[[], Dict[str, int]]:
+    def create_group() -> Dict[str, int]:
+        logging.info("Create HPC node group: {}".format(cc_grp))
+        hpcpack_rest_client.add_node_group(cc_grp, "Cycle Cloud Node group")
+        return {"groups_created": 1}
+    return create_group
+
+
+def _tag_action(hpcpack_rest_client: HpcRestClient, cc_grp: str, add_tag_nodes: List[str]) -> Callable[[], Dict[str, int]]:
+    def tag() -> Dict[str, int]:
+        logging.info("Adding HPC nodes to node group {}: {}".format(cc_grp, add_tag_nodes))
+        tag_result = hpcpack_rest_client.add_node_to_node_group(cc_grp, add_tag_nodes)
+        return _bulk_counts("nodes_tagged", add_tag_nodes, tag_result)
+    return tag
+
+
+def _bulk_counts(name: str, node_names: List[str], bulk_result: BulkResult) -> Dict[str, int]:
+    # the nodes of the failed chunks are counted as failed_nodes, which fails the action once the others are done
+    if bulk_result.ok:
+        return {name: len(node_names)}
+    failed_node_names = bulk_result.failed_node_names
+    logging.warning("{}: failed for the HPC nodes {}".format(name, failed_node_names))
+    return {name: len(node_names) - len(failed_node_names), "failed_nodes": len(failed_node_names)}
+
+
+def _start_standby(node_mgr: NodeManager, inputs: RoundInputs, plan: Plan) -> int:
+    # the running nodes are counted in the pools already, and the nodes terminated this round must not be started again
+    terminating_ids = CISet(plan.nodes_to_terminate)
+    for cc_node in inputs.cc_nodes:
+        if ci_equals(cc_node.target_state, 'Started') or cc_node.delayed_node_id.node_id in terminating_ids:
+            cc_node.closed = True
+    started_count = 0
+    for array, missing in plan.standby_starts.items():
+        _, started = start_nodes(node_mgr, GroupDemand("standby", array, missing, 0), missing)
+        logging.info("Starting {} nodes for the standby pool of node array {}".format(len(started), array))
+        started_count += len(started)
+    return started_count
+
+
+def _cc_nodes(inputs: RoundInputs, cc_ids: List[str]) -> List[Node]:
+    cc_nodes = [inputs.cc_nodes_by_id.get(cc_id) for cc_id in cc_ids]
+    missing = [cc_id for cc_id, n in zip(cc_ids, cc_nodes) if n is None]
+    if missing:
+        # a plan made in an earlier process may name nodes that are gone since
+        logging.warning("Skipping the Cycle cloud nodes that no longer exist: {}".format(missing))
+    return [n for n in cc_nodes if n is not None]
@@ -0,0 +1,155 @@
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+API_ROOT = "/HpcManager/api/"
+
+
+def route_key(function_route: str) -> str:
+    """
+    The route under the API root, with the node group name of the node-groups/{group_name} route left out.
+    """
+    path = function_route.split(API_ROOT, 1)[-1].split("?", 1)[0]
+    if path.startswith("node-groups/"):
+        return "node-groups/{group_name}"
+    return path
+
+
+class RouteStats:
+    """
+    Counters of the calls of one route. latency is the time until the head node answered (the response
+    headers, or the whole body for the calls that are not streamed), total_seconds also includes
+    reading a streamed body and handling its records, so their difference is our own processing.
+    """
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.statuses: Dict[str, int] = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.latency_seconds = 0.0
+        self.total_seconds = 0.0
+        self.max_latency = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(
+        self,
+        status: Optional[int],
+        latency: float,
+        total_seconds: float,
+        request_bytes: int,
+        response_bytes: int
+    ) -> None:
+        self.calls += 1
+        # no status: the call failed before the head node answered (connection error, timeout)
+        status_key = str(status) if status is not None else "error"
+        self.statuses[status_key] = self.statuses.get(status_key, 0) + 1
+        if status is None or status >= 400:
+            self.errors += 1
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+        self.latency_seconds += latency
+        self.total_seconds += total_seconds
+        self.max_latency = max(self.max_latency, latency)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "statuses": dict(self.statuses),
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "latency_seconds": round(self.latency_seconds, 6),
+            "total_seconds": round(self.total_seconds, 6),
+            "max_latency": round(self.max_latency, 6),
+            "buckets": list(self.buckets),
+        }
+
+
+class CallRecorder:
+    """
+    Records one call when its with-block exits, see RestStats.measure.
+    """
+    def __init__(self, stats: "RestStats", route: str, request_bytes: int) -> None:
+        self.__stats = stats
+        self.__route = route
+        self.__request_bytes = request_bytes
+        self.__start = 0.0
+        self.__latency: Optional[float] = None
+        self.status: Optional[int] = None
+        self.response_bytes = 0
+
+    def __enter__(self) -> "CallRecorder":
+        self.__start = time.perf_counter()
+        return self
+
+    def response(self, status: int, response_bytes: int = 0) -> None:
+        """
+        Called once the head node answered, the bytes of a streamed body are added with received().
+        """
+        self.__latency = time.perf_counter() - self.__start
+        self.status = status
+        self.response_bytes += response_bytes
+
+    def received(self, response_bytes: int) -> None:
+        self.response_bytes += response_bytes
+
+    def counted(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            self.response_bytes += len(chunk)
+            yield chunk
+
+    def __exit__(self, *args: Any) -> None:
+        total_seconds = time.perf_counter() - self.__start
+        latency = self.__latency if self.__latency is not None else total_seconds
+        self.__stats.observe(self.__route, self.status, latency, total_seconds, self.__request_bytes, self.response_bytes)
+
+
+class RestStats:
+    """
+    Per-route call counts, latency histograms, payload bytes, HTTP statuses and errors of a REST client.
+    """
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__routes: Dict[str, RouteStats] = {}
+
+    def measure(self, function_route: str, data: Union[str, bytes, None] = None) -> CallRecorder:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return CallRecorder(self, route_key(function_route), len(data) if data else 0)
+
+    def observe(
+        self,
+        route: str,
+        status: Optional[int],
+        latency: float,
+        total_seconds: float,
+        request_bytes: int,
+        response_bytes: int
+    ) -> None:
+        with self.__lock:
+            self.__routes.setdefault(route, RouteStats()).observe(status, latency, total_seconds, request_bytes, response_bytes)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self.__lock:
+            return {route: stats.to_dict() for route, stats in sorted(self.__routes.items())}
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__routes = {}
+
+    def summary(self) -> List[str]:
+        lines = []
+        for route, s in self.snapshot().items():
+            lines.append("{}: {} calls, {} errors, statuses {}, latency avg {:.3f}s max {:.3f}s, total {:.3f}s, sent {} B, received {} B".format(
+                route, s["calls"], s["errors"], s["statuses"], s["latency_seconds"] / max(1, s["calls"]), s["max_latency"],
+                s["total_seconds"], s["request_bytes"], s["response_bytes"]))
+        return lines
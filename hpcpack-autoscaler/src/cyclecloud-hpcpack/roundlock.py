@@ -0,0 +1,210 @@
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import hpc.autoscale.hpclogging as logging
+from typing import Any, Dict, Iterator, List, Optional
+
+DEFAULT_LOCK_FILE = "C:\\cycle\\jetpack\\config\\autoscaler.lock"
+
+# lock files held by this process -> [hold count, token], a held lock is re-entrant within the process
+_held: Dict[str, List[Any]] = {}
+_held_lock = threading.Lock()
+
+
+class RoundLockBusy(RuntimeError):
+    pass
+
+
+class RoundLock:
+    """
+    Cross-process lock of the autoscale rounds, a lock file created exclusively that records its owner.
+
+    A lock file is stale, and is broken, when its owner process on this host is gone or when it is
+    older than stale_after seconds, e.g. after the owner hung or its host was restored from a disk
+    snapshot. A run that finds the lock held can leave a note in the pending file, which the owner
+    picks up when its round is done.
+    """
+    DEFAULT_STALE_AFTER = 600.0
+
+    def __init__(
+        self,
+        lock_file: str = DEFAULT_LOCK_FILE,
+        stale_after: float = DEFAULT_STALE_AFTER
+    ) -> None:
+        self.lock_file = lock_file
+        self.pending_file = lock_file + ".pending"
+        self.__stale_after = stale_after
+        self.__key = os.path.normcase(os.path.abspath(lock_file))
+
+    def owner(self) -> Optional[Dict[str, Any]]:
+        return _read_owner(self.lock_file)
+
+    def acquire(self, timeout: float = 0, interval: float = 0.5) -> bool:
+        """
+        Takes the lock, waiting up to timeout seconds for another process to release it.
+        """
+        with _held_lock:
+            if self.__key in _held:
+                _held[self.__key][0] += 1
+                return True
+        end = time.monotonic() + timeout
+        while True:
+            token = self.__try_create()
+            if token:
+                with _held_lock:
+                    _held[self.__key] = [1, token]
+                return True
+            if self.__break_if_stale():
+                continue
+            if time.monotonic() >= end:
+                return False
+            time.sleep(interval)
+
+    def release(self) -> None:
+        with _held_lock:
+            held = _held.get(self.__key)
+            if held is None:
+                return
+            held[0] -= 1
+            if held[0] > 0:
+                return
+            del _held[self.__key]
+        owner = self.owner()
+        # a lock broken as stale and taken by another process meanwhile is not ours to remove
+        if owner is not None and owner.get("token") == held[1]:
+            try:
+                os.remove(self.lock_file)
+            except OSError as e:
+                logging.warning("Failed to remove the lock file {}: {}".format(self.lock_file, e))
+
+    @contextlib.contextmanager
+    def hold(self, timeout: float = 0) -> Iterator["RoundLock"]:
+        if not self.acquire(timeout):
+            raise RoundLockBusy("{} is held by {}".format(self.lock_file, self.owner()))
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def add_pending(self) -> None:
+        with open(self.pending_file, "a", encoding="utf-8") as pf:
+            pf.write("{} {}\n".format(os.getpid(), time.time()))
+
+    def take_pending(self) -> int:
+        """
+        Returns how many runs left a note since the last call and clears the notes.
+        """
+        taken_file = self.pending_file + "." + uuid.uuid4().hex
+        try:
+            os.replace(self.pending_file, taken_file)
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            # e.g. a skipped run is appending to it right now, the note is taken next time
+            logging.warning("Failed to take the pending file {}: {}".format(self.pending_file, e))
+            return 0
+        try:
+            with open(taken_file, "r", encoding="utf-8") as pf:
+                return sum(1 for line in pf if line.strip())
+        finally:
+            os.remove(taken_file)
+
+    def __try_create(self) -> Optional[str]:
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w", encoding="utf-8") as lf:
+            json.dump({"pid": os.getpid(), "host": socket.gethostname(), "acquired": time.time(), "token": token}, lf)
+        return token
+
+    def __break_if_stale(self) -> bool:
+        owner = self.owner()
+        if owner is None:
+            # released meanwhile
+            return True
+        try:
+            age = time.time() - (owner.get("acquired") or os.path.getmtime(self.lock_file))
+        except OSError:
+            return True
+        same_host = owner.get("host") == socket.gethostname()
+        if same_host and isinstance(owner.get("pid"), int) and not _pid_alive(owner["pid"]):
+            reason = "its process {} is gone".format(owner["pid"])
+        elif age > self.__stale_after:
+            reason = "it was taken {:.0f}s ago".format(age)
+        else:
+            return False
+        logging.warning("Breaking the stale lock {} of {}: {}".format(self.lock_file, owner, reason))
+        # moved aside under a unique name first: of the processes breaking the lock at once only one
+        # gets the file, and it can check that it is still the stale one before removing it
+        broken_file = "{}.stale.{}".format(self.lock_file, uuid.uuid4().hex)
+        try:
+            os.replace(self.lock_file, broken_file)
+        except FileNotFoundError:
+            # broken by another process meanwhile
+            return True
+        except OSError as e:
+            logging.warning("Failed to move the stale lock file {}: {}".format(self.lock_file, e))
+            return False
+        if _read_owner(broken_file) != owner:
+            # another process broke the stale lock and took it between the check and the move, give it back
+            try:
+                os.link(broken_file, self.lock_file)
+            except OSError as e:
+                logging.warning("Failed to restore the lock file {} of {}: {}".format(self.lock_file, _read_owner(broken_file), e))
+        try:
+            os.remove(broken_file)
+        except OSError as e:
+            logging.warning("Failed to remove the stale lock file {}: {}".format(broken_file, e))
+        return True
+
+
+def _read_owner(lock_file: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(lock_file, "r", encoding="utf-8") as lf:
+            return json.load(lf)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        # being written right now, or damaged: judged by the file age alone
+        return {}
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32  # type: ignore
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            # ERROR_ACCESS_DENIED: the process exists but belongs to someone else
+            return kernel32.GetLastError() == 5
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def new_round_lock(config: Dict[str, Any]) -> Optional[RoundLock]:
+    autoscale_config = config.get("autoscale") or {}
+    # an empty or null lock_file turns the lock off
+    lock_file = autoscale_config.get("lock_file", DEFAULT_LOCK_FILE)
+    if not lock_file:
+        return None
+    return RoundLock(lock_file, stale_after=autoscale_config.get("lock_stale_after") or RoundLock.DEFAULT_STALE_AFTER)
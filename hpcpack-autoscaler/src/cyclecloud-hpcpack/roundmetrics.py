@@ -0,0 +1,184 @@
+import json
+import os
+import time
+import hpc.autoscale.hpclogging as logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from .reststats import LATENCY_BUCKETS
+
+DEFAULT_METRICS_FILE = "C:\\cycle\\jetpack\\config\\autoscaler_metrics.jsonl"
+# the JSON-lines file is rotated to <file>.1 once it grows past this size
+DEFAULT_METRICS_MAX_BYTES = 10 * 1024 * 1024
+METRIC_PREFIX = "hpcpack_autoscale"
+
+
+class PhaseMetrics:
+    def __init__(self, name: str, seconds: float = 0.0) -> None:
+        self.name = name
+        self.seconds = seconds
+        self.counts: Dict[str, int] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "seconds": round(self.seconds, 6), "counts": self.counts}
+
+
+class RoundMetrics:
+    """
+    Durations and node/action counts of the phases of one autoscale round. The round moves from
+    phase to phase with begin(), count() adds to the current phase, and write() appends the round
+    to a JSON-lines file and replaces a Prometheus textfile-collector file with its gauges.
+    """
+    def __init__(
+        self,
+        metrics_file: Optional[str] = DEFAULT_METRICS_FILE,
+        prometheus_file: Optional[str] = None,
+        max_bytes: int = DEFAULT_METRICS_MAX_BYTES
+    ) -> None:
+        self.__metrics_file = metrics_file
+        self.__prometheus_file = prometheus_file
+        self.__max_bytes = max_bytes
+        self.timestamp = datetime.utcnow()
+        self.__start = time.perf_counter()
+        self.__phase_start = self.__start
+        self.__current: Optional[PhaseMetrics] = None
+        self.phases: List[PhaseMetrics] = []
+        # counts of the round as a whole, e.g. the number of CC nodes
+        self.counts: Dict[str, int] = {}
+        self.seconds: Optional[float] = None
+        self.success = True
+        # why the round did not run, e.g. another run held the lock
+        self.skipped: Optional[str] = None
+        # RestStats.snapshot() of the REST client for the round
+        self.rest: Dict[str, Dict[str, Any]] = {}
+
+    def begin(self, phase: str) -> None:
+        """
+        Ends the current phase and starts the next one.
+        """
+        self.__end_phase()
+        self.__current = PhaseMetrics(phase)
+        self.phases.append(self.__current)
+        self.__phase_start = time.perf_counter()
+
+    def add_phase(self, phase: str, seconds: float, **counts: int) -> None:
+        """
+        Records a phase timed elsewhere, e.g. one of the fetches that run concurrently.
+        """
+        metrics = PhaseMetrics(phase, seconds)
+        metrics.counts.update(counts)
+        self.phases.append(metrics)
+
+    def count(self, name: str, value: int = 1) -> None:
+        counts = self.__current.counts if self.__current is not None else self.counts
+        counts[name] = counts.get(name, 0) + value
+
+    def set_round_count(self, name: str, value: int) -> None:
+        self.counts[name] = value
+
+    def skip(self, reason: str) -> None:
+        self.finish(False)
+        self.skipped = reason
+
+    def finish(self, success: bool = True) -> None:
+        self.__end_phase()
+        self.__current = None
+        self.seconds = time.perf_counter() - self.__start
+        self.success = success
+
+    def __end_phase(self) -> None:
+        if self.__current is not None:
+            self.__current.seconds += time.perf_counter() - self.__phase_start
+            self.__current = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "timestamp": self.timestamp.isoformat() + "Z",
+            "seconds": round(self.seconds or 0.0, 6),
+            "success": self.success,
+            "skipped": self.skipped,
+            "counts": self.counts,
+            "phases": [p.to_dict() for p in self.phases],
+            "rest": self.rest,
+        }
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def sample(name: str, labels: List[Any], value: Any) -> None:
+            label_str = ",".join('{}="{}"'.format(k, _escape_label(v)) for k, v in labels)
+            lines.append("{}_{}{} {}".format(METRIC_PREFIX, name, "{" + label_str + "}" if label_str else "", value))
+
+        def gauge(name: str, help: str, samples: List[Any]) -> None:
+            lines.append("# HELP {}_{} {}".format(METRIC_PREFIX, name, help))
+            lines.append("# TYPE {}_{} gauge".format(METRIC_PREFIX, name))
+            for labels, value in samples:
+                sample(name, labels, value)
+
+        gauge("round_duration_seconds", "Wall time of the last autoscale round.", [([], round(self.seconds or 0.0, 6))])
+        gauge("round_success", "1 if the last autoscale round completed, 0 if it failed.", [([], 1 if self.success else 0)])
+        gauge("round_timestamp_seconds", "Unix time the last autoscale round started.",
+              [([], round((self.timestamp - datetime(1970, 1, 1)).total_seconds(), 3))])
+        gauge("round_count", "Node counts of the last autoscale round.", [([("name", k)], v) for k, v in sorted(self.counts.items())])
+        gauge("phase_duration_seconds", "Wall time of each phase of the last autoscale round.",
+              [([("phase", p.name)], round(p.seconds, 6)) for p in self.phases])
+        gauge("phase_count", "Node and action counts of each phase of the last autoscale round.",
+              [([("phase", p.name), ("name", k)], v) for p in self.phases for k, v in sorted(p.counts.items())])
+        if self.rest:
+            lines.append("# HELP {}_rest_latency_seconds Head node latency of the REST calls of the last autoscale round by route.".format(METRIC_PREFIX))
+            lines.append("# TYPE {}_rest_latency_seconds histogram".format(METRIC_PREFIX))
+            for route, s in self.rest.items():
+                cumulative = 0
+                for bound, count in zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], s["buckets"]):
+                    cumulative += count
+                    sample("rest_latency_seconds_bucket", [("route", route), ("le", bound)], cumulative)
+                sample("rest_latency_seconds_sum", [("route", route)], s["latency_seconds"])
+                sample("rest_latency_seconds_count", [("route", route)], s["calls"])
+            gauge("rest_seconds", "Wall time of the REST calls of the last autoscale round by route, including reading and handling the response.",
+                  [([("route", r)], s["total_seconds"]) for r, s in self.rest.items()])
+            gauge("rest_errors", "Failed REST calls of the last autoscale round by route.", [([("route", r)], s["errors"]) for r, s in self.rest.items()])
+            gauge("rest_responses", "REST calls of the last autoscale round by route and HTTP status.",
+                  [([("route", r), ("status", status)], count) for r, s in self.rest.items() for status, count in sorted(s["statuses"].items())])
+            gauge("rest_request_bytes", "Request body bytes sent in the last autoscale round by route.",
+                  [([("route", r)], s["request_bytes"]) for r, s in self.rest.items()])
+            gauge("rest_response_bytes", "Response body bytes received in the last autoscale round by route.",
+                  [([("route", r)], s["response_bytes"]) for r, s in self.rest.items()])
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        # the metrics must never fail the round
+        if self.__metrics_file:
+            try:
+                if os.path.exists(self.__metrics_file) and os.path.getsize(self.__metrics_file) > self.__max_bytes:
+                    os.replace(self.__metrics_file, self.__metrics_file + ".1")
+                with open(self.__metrics_file, "a", encoding="utf-8") as mf:
+                    mf.write(json.dumps(self.to_dict(), separators=(",", ":")) + "\n")
+            except OSError as e:
+                logging.warning("Failed to write the round metrics to {}: {}".format(self.__metrics_file, e))
+        # the gauges stay those of the last round that ran, the skipped runs are counted by the next one
+        if self.__prometheus_file and self.skipped is None:
+            # the collector may read the file at any time, replace it as a whole
+            tmp_file = self.__prometheus_file + ".tmp"
+            try:
+                with open(tmp_file, "w", encoding="utf-8", newline="\n") as pf:
+                    pf.write(self.to_prometheus())
+                os.replace(tmp_file, self.__prometheus_file)
+            except OSError as e:
+                logging.warning("Failed to write the round metrics to {}: {}".format(self.__prometheus_file, e))
+
+    def summary(self) -> str:
+        if self.skipped is not None:
+            return "Round skipped: {}".format(self.skipped)
+        return "Round took {:.2f}s: {}".format(self.seconds or 0.0, ", ".join("{}={:.2f}".format(p.name, p.seconds) for p in self.phases))
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def new_round_metrics(config: Dict[str, Any]) -> RoundMetrics:
+    autoscale_config = config.get("autoscale") or {}
+    # an empty or null metrics_file turns the JSON-lines file off
+    return RoundMetrics(
+        metrics_file=autoscale_config.get("metrics_file", DEFAULT_METRICS_FILE),
+        prometheus_file=autoscale_config.get("prometheus_file"),
+        max_bytes=autoscale_config.get("metrics_max_bytes") or DEFAULT_METRICS_MAX_BYTES)
@@ -0,0 +1,613 @@
+import json
+import math
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import hpc.autoscale.hpclogging as logging
+from hpc.autoscale.node.node import Node
+from hpc.autoscale.node.nodemanager import NodeManager
+from .commonutil import CIDict, CISet, ci_dict, ci_equals, from_epoch, to_epoch
+from .hpcnodehistory import HpcNodeHistory
+from .hpcpackdriver import BulkResult, GrowDecision, HpcNode
+from .nodeselection import NodeSelector, new_node_selector
+
+# version of the plan file layout
+PLAN_FORMAT = 1
+# "ComputeNodes", "CycleCloudNodes", "AzureIaaSNodes" are all treated as default
+DEFAULT_GROUPS = CISet(["Default", "ComputeNodes", "AzureIaaSNodes", "CycleCloudNodes"])
+# nodes started ahead of the predicted demand that may wait for it at once
+DEFAULT_PREWARM_MAX_NODES = 10
+# seconds a pre-warmed node may stay idle before it first runs jobs
+DEFAULT_PREWARM_IDLE_TIMEOUT = 3600
+
+# the nodes and cores a node group asks to grow by, nodearray is None for the default groups
+GroupDemand = NamedTuple("GroupDemand", [("group", str), ("nodearray", Optional[str]), ("nodes", int), ("cores", int)])
+
+
+class RoundInputs:
+    """
+    Snapshot the decisions of a round are made on: the CycleCloud nodes and their node manager, the
+    active HPC compute nodes bound to them and to the node history by synchronize, the HPC node
+    groups, the grow decisions and the ones forecast from the past rounds, if pre-warming is on.
+    """
+    def __init__(
+        self,
+        node_mgr: NodeManager,
+        cc_nodes: List[Node],
+        hpc_nodes: List[HpcNode],
+        hpc_node_groups: Iterable[str],
+        grow_decisions: Dict[str, GrowDecision],
+        node_history: HpcNodeHistory,
+        now: Optional[datetime] = None,
+        forecast: Optional[Dict[str, GrowDecision]] = None
+    ) -> None:
+        self.node_mgr = node_mgr
+        self.cc_nodes = cc_nodes
+        self.cc_nodes_by_id = CIDict([(n.delayed_node_id.node_id, n) for n in cc_nodes])
+        self.hpc_nodes = hpc_nodes
+        self.hpc_node_groups = CISet(hpc_node_groups)
+        self.grow_decisions = grow_decisions
+        self.node_history = node_history
+        self.nodearrays = CISet([b.nodearray for b in node_mgr.get_buckets()])
+        self.now = now or datetime.utcnow()
+        self.forecast = forecast or {}
+
+
+class Plan:
+    """
+    The actions of one round, in the order they are applied, and the node history updates that
+    go with them. The HPC nodes are named, the CycleCloud nodes are referred to by node Id.
+    """
+    def __init__(self, created: Optional[datetime] = None) -> None:
+        self.created = created or datetime.utcnow()
+        self.groups_to_create: List[str] = []
+        # node group -> HPC node names
+        self.nodes_to_tag: Dict[str, List[str]] = {}
+        self.nodes_to_remove: List[str] = []
+        self.templates_to_assign: List[str] = []
+        # {"nodearray", "vm_size", "count"} of the nodes allocated on the node manager
+        self.new_nodes: List[Dict[str, Any]] = []
+        self.nodes_to_bring_online: List[str] = []
+        self.nodes_to_take_offline: List[str] = []
+        # HPC node name -> CC node Id of the nodes taken offline, a CC node is not stopped if its HPC node failed to go offline
+        self.offline_cc_ids: Dict[str, str] = {}
+        self.nodes_to_shut_down: List[str] = []
+        self.nodes_to_terminate: List[str] = []
+        # CC node names of the nodes started ahead of the predicted demand, and CC node Ids of the pre-warmed nodes that ran jobs
+        self.prewarm_nodes: List[str] = []
+        self.prewarm_hits: List[str] = []
+        # node array -> nodes to start for its standby pool, allocated when the plan is applied
+        self.standby_starts: Dict[str, int] = {}
+        # CC node Id -> new idle_from of its node history item, None to clear it
+        self.idle_from: Dict[str, Optional[datetime]] = {}
+        # phase -> why the round did without it
+        self.skipped: Dict[str, str] = {}
+        # decision counts, e.g. the idle check candidates
+        self.counts: Dict[str, int] = {}
+
+    @property
+    def new_node_count(self) -> int:
+        return sum(n["count"] for n in self.new_nodes)
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def summary(self) -> str:
+        return "Plan: {} groups to create, {} nodes to tag, {} to remove, {} templates to assign, {} new nodes, " \
+            "{} to pre-warm, {} standby to start, {} to bring online, {} to take offline, {} to shut down, {} to terminate, {} idle time updates".format(
+                len(self.groups_to_create), sum(len(v) for v in self.nodes_to_tag.values()), len(self.nodes_to_remove),
+                len(self.templates_to_assign), self.new_node_count, len(self.prewarm_nodes), sum(self.standby_starts.values()),
+                len(self.nodes_to_bring_online), len(self.nodes_to_take_offline), len(self.nodes_to_shut_down), len(self.nodes_to_terminate), len(self.idle_from))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "format": PLAN_FORMAT,
+            "created": to_epoch(self.created),
+            "groups_to_create": self.groups_to_create,
+            "nodes_to_tag": self.nodes_to_tag,
+            "nodes_to_remove": self.nodes_to_remove,
+            "templates_to_assign": self.templates_to_assign,
+            "new_nodes": self.new_nodes,
+            "nodes_to_bring_online": self.nodes_to_bring_online,
+            "nodes_to_take_offline": self.nodes_to_take_offline,
+            "offline_cc_ids": self.offline_cc_ids,
+            "nodes_to_shut_down": self.nodes_to_shut_down,
+            "nodes_to_terminate": self.nodes_to_terminate,
+            "prewarm_nodes": self.prewarm_nodes,
+            "prewarm_hits": self.prewarm_hits,
+            "standby_starts": self.standby_starts,
+            "idle_from": {k: to_epoch(v) for k, v in self.idle_from.items()},
+            "skipped": self.skipped,
+            "counts": self.counts,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Plan":
+        if d.get("format") != PLAN_FORMAT:
+            raise ValueError("Unsupported plan format {}, expected {}".format(d.get("format"), PLAN_FORMAT))
+        plan = cls(from_epoch(d["created"]))
+        for attr in ["groups_to_create", "nodes_to_tag", "nodes_to_remove", "templates_to_assign", "new_nodes", "nodes_to_bring_online",
+                     "nodes_to_take_offline", "offline_cc_ids", "nodes_to_shut_down", "nodes_to_terminate", "prewarm_nodes", "prewarm_hits",
+                     "standby_starts", "skipped", "counts"]:
+            setattr(plan, attr, d.get(attr) or getattr(plan, attr))
+        plan.idle_from = {k: from_epoch(v) for k, v in (d.get("idle_from") or {}).items()}
+        return plan
+
+    def write(self, plan_file: str) -> None:
+        with open(plan_file, "w", encoding="utf-8") as pf:
+            json.dump(self.to_dict(), pf, indent=1)
+
+    @classmethod
+    def read(cls, plan_file: str) -> "Plan":
+        with open(plan_file, "r", encoding="utf-8") as pf:
+            return cls.from_dict(json.load(pf))
+
+
+class GroupAllocation:
+    """
+    What the node manager allocated for the demand of a node group: the slots matched to its node
+    and core targets, the nodes they are on and the new nodes among them. A group is hungry when its demand is not met by
+    the nodes it already has.
+    """
+    def __init__(self, demand: GroupDemand) -> None:
+        self.demand = demand
+        self.node_slots = 0
+        self.core_slots = 0
+        self.nodes: List[Node] = []
+        self.new_nodes: List[Node] = []
+
+    @property
+    def hungry(self) -> bool:
+        return self.node_slots < self.demand.nodes or self.core_slots < self.demand.cores or len(self.new_nodes) > 0
+
+    def __repr__(self) -> str:
+        return "GroupAllocation({}, nodes {}/{}, cores {}/{}, {} new nodes)".format(
+            self.demand.group, self.node_slots, self.demand.nodes, self.core_slots, self.demand.cores, len(self.new_nodes))
+
+
+def collect_demands(grow_decisions: Dict[str, GrowDecision], nodearrays: CISet) -> List[GroupDemand]:
+    """
+    The demands of the grow decisions: one per node group mapped to a node array, in the order of
+    the decisions, then the sum of the default groups, which any node array can meet.
+    """
+    demands: List[GroupDemand] = []
+    # grow_by_socket not supported yet, treat as grow_by_node
+    default_cores_to_grow = default_nodes_to_grow = 0.0
+    for grp, tmp in grow_decisions.items():
+        if not (tmp.cores_to_grow + tmp.nodes_to_grow + tmp.sockets_to_grow):
+            continue
+        if grp in DEFAULT_GROUPS:
+            default_cores_to_grow += tmp.cores_to_grow
+            default_nodes_to_grow += tmp.nodes_to_grow + tmp.sockets_to_grow
+            continue
+        if grp not in nodearrays:
+            logging.warning("No mapping node array for the grow requirement {}:{}".format(grp, tmp))
+            continue
+        demands.append(GroupDemand(grp, nodearrays.lookup(grp), math.ceil(tmp.nodes_to_grow + tmp.sockets_to_grow), math.ceil(tmp.cores_to_grow)))
+    if default_nodes_to_grow or default_cores_to_grow:
+        demands.append(GroupDemand("Default", None, math.ceil(default_nodes_to_grow), math.ceil(default_cores_to_grow)))
+    return demands
+
+
+def allocate_demands(node_mgr: NodeManager, demands: List[GroupDemand]) -> List[GroupAllocation]:
+    """
+    Allocates the demands on the node manager in one pass, in order, and returns what each got.
+    A demand is met by the nodes of its node array, those of any node array for the default
+    groups, with one allocation per unit it asks for, the node manager taking one unit a call.
+    """
+    allocations: List[GroupAllocation] = []
+    for demand in demands:
+        allocation = GroupAllocation(demand)
+        selector: Dict[str, Any] = {'ncpus': 1}
+        if demand.nodearray:
+            selector['node.nodearray'] = [demand.nodearray]
+        # the node manager appends the nodes it creates, a later demand may get slots on them without being hungry
+        known_new_nodes = len(node_mgr.new_nodes)
+        for target, unit in [(demand.nodes, "node_count"), (demand.cores, "slot_count")]:
+            if not target:
+                continue
+            logging.info("Allocate: {}  Target {}: {}".format(selector, "Nodes" if unit == "node_count" else "Cores", target))
+            result = node_mgr.allocate(selector, **{unit: target})
+            logging.info(result)
+            if not result:
+                continue
+            if unit == "node_count":
+                allocation.node_slots = result.total_slots
+            else:
+                allocation.core_slots = result.total_slots
+            # the cores may land on the nodes taken for the node target
+            allocated_node_ids = set(id(n) for n in allocation.nodes)
+            allocation.nodes.extend([n for n in result.nodes if id(n) not in allocated_node_ids])
+        allocation.new_nodes = node_mgr.new_nodes[known_new_nodes:]
+        allocations.append(allocation)
+    return allocations
+
+
+def start_nodes(node_mgr: NodeManager, demand: GroupDemand, max_started: int) -> Tuple[List[GroupAllocation], List[Node]]:
+    """
+    Allocates the nodes of the demand until it is met, the node array has no node left, or
+    max_started nodes are started. The running nodes are matched first and are not started, the
+    deallocated nodes are then started again before new nodes are created, see the bucket order
+    of the round.
+    """
+    allocations: List[GroupAllocation] = []
+    started: List[Node] = []
+    nodes_to_go = demand.nodes
+    # a cap at a time, as the running nodes matched do not count against it
+    while nodes_to_go > 0 and len(started) < max_started:
+        allocation = allocate_demands(node_mgr, [demand._replace(nodes=min(nodes_to_go, max_started - len(started)))])[0]
+        allocations.append(allocation)
+        new_node_ids = set(id(n) for n in allocation.new_nodes)
+        started.extend([n for n in allocation.nodes if id(n) in new_node_ids or ci_equals(n.target_state, 'Deallocated')])
+        nodes_to_go -= allocation.node_slots
+        if allocation.node_slots < allocation.demand.nodes:
+            break
+    return allocations, started
+
+
+def prewarm_demands(
+    forecast: Dict[str, GrowDecision],
+    demands: List[GroupDemand],
+    nodearrays: CISet,
+    vcpu_counts: CIDict[int],
+    prewarmed: Optional[CIDict[int]] = None
+) -> List[GroupDemand]:
+    """
+    The nodes to pre-warm for the forecast demand of the node groups mapped to a node array, less
+    the demand of the round and the nodes of the node array pre-warmed by the earlier rounds, in
+    prewarmed, largest first. The cores are turned into nodes of the largest VM size of the node
+    array. The default groups are not pre-warmed, no node array is theirs.
+    """
+    demand_by_group: CIDict[GroupDemand] = CIDict([(d.group, d) for d in demands if d.nodearray])
+    prewarm: List[GroupDemand] = []
+    for grp, expected in forecast.items():
+        if grp in DEFAULT_GROUPS or grp not in nodearrays:
+            continue
+        array = nodearrays.lookup(grp)
+        vcpus = vcpu_counts.get(array) or 1
+        # the forecast is an average, a group asking for a node one day a week is not pre-warmed
+        expected_nodes = int(expected.nodes_to_grow + expected.sockets_to_grow + expected.cores_to_grow / vcpus + 0.5)
+        demand = demand_by_group.get(grp)
+        asked_nodes = demand.nodes + math.ceil(demand.cores / vcpus) if demand else 0
+        prewarmed_nodes = (prewarmed.get(array) or 0) if prewarmed else 0
+        if expected_nodes > asked_nodes + prewarmed_nodes:
+            prewarm.append(GroupDemand(grp, array, expected_nodes - asked_nodes - prewarmed_nodes, 0))
+    return sorted(prewarm, key=lambda d: -d.nodes)
+
+
+# the idle check of the scale down candidates, made between the allocation of a round and its plan
+IdleCheck = NamedTuple("IdleCheck", [("candidates", List[HpcNode]), ("idle_node_names", CISet), ("idle_unknown_node_names", CISet)])
+
+
+class RoundAllocation:
+    """
+    What allocate_round allocated on the node manager of a round: the group allocations of its grow
+    decisions, the pre-warmed nodes, the CC nodes closed to the allocation and the selections of the
+    HPC nodes the plan is made on. The scale down is checked unless the default groups are hungry.
+    """
+    def __init__(self, node_selector: NodeSelector) -> None:
+        self.node_selector = node_selector
+        # the online healthy HPC nodes, their CC nodes are closed to the allocation
+        self.ready_hpc_nodes: List[HpcNode] = []
+        # CC nodes whose provisioning timed out or whose HPC node is in error
+        self.provisioning_timeouts: List[Node] = []
+        self.demands: List[GroupDemand] = []
+        self.allocations: List[GroupAllocation] = []
+        # the allocations beyond the grow decisions, and the CC node names of the pre-warmed nodes
+        self.extra_allocations: List[GroupAllocation] = []
+        self.prewarm_nodes: List[str] = []
+
+    @property
+    def default_allocation(self) -> Optional[GroupAllocation]:
+        return next((a for a in self.allocations if not a.demand.nodearray), None)
+
+    @property
+    def shrink_check(self) -> bool:
+        # For a hungry group, no idle check is required if the node health is OK
+        default_allocation = self.default_allocation
+        return not (default_allocation and default_allocation.hungry)
+
+    def idle_check_candidates(self) -> List[HpcNode]:
+        # the active CC nodes in an idle check state, less the nodes of the groups asking to grow, see idle_check_candidates
+        group_hungry: Dict[str, bool] = {a.demand.group: a.hungry for a in self.allocations if a.demand.nodearray}
+        return self.node_selector.idle_check_candidates(self.default_allocation is not None, group_hungry)
+
+
+def allocate_round(config: Dict[str, Any], inputs: RoundInputs) -> RoundAllocation:
+    """
+    Allocates on the node manager of the round the nodes of its grow decisions and the pre-warming,
+    in memory only. This is the one planning stage that changes anything: the ready CC nodes and
+    those to terminate are closed to the allocation, and the new nodes are added to the node manager.
+    """
+    autoscale_config = config.get("autoscale") or {}
+    prewarm_max_nodes = autoscale_config.get("prewarm_max_nodes", DEFAULT_PREWARM_MAX_NODES)
+    node_mgr = inputs.node_mgr
+    node_history = inputs.node_history
+    node_selector = new_node_selector(config, inputs.hpc_nodes)
+    node_selector.drop_stopped_and_removed()
+    allocation = RoundAllocation(node_selector)
+
+    # Start scale up checking:
+    logging.info("Start scale up checking ...")
+    # Exclude the already online healthy HPC nodes before calling node_mgr.allocate
+    allocation.ready_hpc_nodes = node_selector.ready_active_cc_nodes()
+    for hpc_node in allocation.ready_hpc_nodes:
+        hpc_node.bound_cc_node.closed = True
+
+    # Terminate the provisioning timeout CC nodes
+    hpc_nodes_with_active_cc_by_id = ci_dict(node_selector.active_cc_nodes(), lambda n: n.id)
+    for cc_node in inputs.cc_nodes:
+        if ci_equals(cc_node.target_state, 'Deallocated') or ci_equals(cc_node.target_state, 'Terminated') or cc_node.create_time_remaining:
+            continue
+        nhi = node_history.find(cc_id=cc_node.delayed_node_id.node_id)
+        if not nhi.hpc_id:
+            cc_node.closed = True
+            allocation.provisioning_timeouts.append(cc_node)
+        else:
+            hpc_node = hpc_nodes_with_active_cc_by_id.get(nhi.hpc_id)
+            if hpc_node and hpc_node.error:
+                cc_node.closed = True
+                allocation.provisioning_timeouts.append(cc_node)
+
+    # If the current CC nodes in the node array cannot satisfy the grow decision, the group is hungry
+    allocation.demands = collect_demands(inputs.grow_decisions, inputs.nodearrays)
+    allocation.allocations = allocate_demands(node_mgr, allocation.demands)
+
+    # Start nodes ahead of the demand forecast from the past rounds, their allocations do not make a group hungry
+    if autoscale_config.get("prewarm") and inputs.forecast:
+        vcpu_counts: CIDict[int] = CIDict()
+        for b in node_mgr.get_buckets():
+            vcpu_counts[b.nodearray] = max(vcpu_counts.get(b.nodearray) or 1, b.vcpu_count)
+        # the cap counts the pre-warmed nodes of the earlier rounds still waiting for their demand
+        pending_prewarm_ids = CISet([nhi.cc_id for nhi in node_history.items if not nhi.stopped and nhi.prewarm_pending])
+        room = prewarm_max_nodes - len(pending_prewarm_ids)
+        # those ready are closed to the allocation, so they are taken off the forecast demand,
+        # the others are matched by the allocation and not started again
+        prewarmed: CIDict[int] = CIDict()
+        for hpc_node in allocation.ready_hpc_nodes:
+            cc_node = hpc_node.bound_cc_node
+            if cc_node.delayed_node_id.node_id in pending_prewarm_ids:
+                prewarmed[cc_node.nodearray] = (prewarmed.get(cc_node.nodearray) or 0) + 1
+        for demand in prewarm_demands(inputs.forecast, allocation.demands, inputs.nodearrays, vcpu_counts, prewarmed):
+            # only the new and the deallocated nodes started count against the cap, the running nodes are warm already
+            demand_allocations, started = start_nodes(node_mgr, demand, room)
+            allocation.extra_allocations.extend(demand_allocations)
+            if started:
+                logging.info("Pre-warming {} nodes for node group {}".format(len(started), demand.group))
+                allocation.prewarm_nodes.extend([n.name for n in started])
+            room -= len(started)
+            if room <= 0:
+                logging.info("Pre-warmed nodes reached autoscale.prewarm_max_nodes ({})".format(prewarm_max_nodes))
+                break
+    return allocation
+
+
+def check_idle(hpc_nodes: List[HpcNode], check_nodes_idle: Callable[[List[str]], BulkResult]) -> IdleCheck:
+    """
+    Checks which of the HPC nodes are idle, through check_nodes_idle for those not Offline. The
+    nodes whose idle check failed are neither idle nor busy, they are in idle_unknown_node_names.
+    """
+    # Offline node must be idle
+    idle_node_names = CISet([n.name for n in hpc_nodes if ci_equals(n.state, 'Offline')])
+    idle_unknown_node_names = CISet()
+    if len(hpc_nodes) > len(idle_node_names):
+        idle_nodes = check_nodes_idle([n.name for n in hpc_nodes if not ci_equals(n.state, 'Offline')])
+        idle_node_names.update([n.node_name for n in idle_nodes])
+        idle_unknown_node_names.update(idle_nodes.failed_node_names)
+    return IdleCheck(hpc_nodes, idle_node_names, idle_unknown_node_names)
+
+
+def plan_round(
+    config: Dict[str, Any],
+    inputs: RoundInputs,
+    allocation: RoundAllocation,
+    idle_check: Optional[IdleCheck],
+    idle_check_skip_reason: Optional[str] = None
+) -> Plan:
+    """
+    Decides the actions of a round from its inputs, what allocate_round allocated for it and the
+    idle check of its candidates for the scale down, None if the check was not made. Nothing is
+    changed, neither the inputs and the node manager nor the head node, CycleCloud or the node
+    history: the standby nodes to start are allocated when the plan is applied.
+    """
+    autoscale_config = config.get("autoscale") or {}
+    idle_timeout_seconds: int = autoscale_config.get("idle_timeout") or 600
+    retention_days = autoscale_config.get("vm_retention_days") or 7
+    prewarm_idle_timeout: int = autoscale_config.get("prewarm_idle_timeout") or DEFAULT_PREWARM_IDLE_TIMEOUT
+    # node array -> idle Online nodes kept running for the next jobs
+    standby: Dict[str, int] = autoscale_config.get("standby") or {}
+    node_history = inputs.node_history
+    plan = Plan(inputs.now)
+    node_selector = allocation.node_selector
+
+    # Create HPC node groups for CC node arrays, and add the HPC nodes into the corresponding node groups
+    for cc_grp in ["CycleCloudNodes"] + list(inputs.nodearrays):
+        if cc_grp not in inputs.hpc_node_groups:
+            plan.groups_to_create.append(cc_grp)
+    add_cc_tag_nodes = node_selector.cc_tag_names()
+    if len(add_cc_tag_nodes) > 0:
+        plan.nodes_to_tag["CycleCloudNodes"] = add_cc_tag_nodes
+    add_array_tag_nodes_by_array = node_selector.nodearray_tag_names()
+    for cc_grp in inputs.nodearrays:
+        add_array_tag_nodes = add_array_tag_nodes_by_array.get(cc_grp, [])
+        if len(add_array_tag_nodes) > 0:
+            plan.nodes_to_tag[cc_grp] = add_array_tag_nodes
+
+    # Possible values for HPC NodeState (states marked with * shall not occur for CC nodes):
+    #   Unknown, Provisioning, Offline, Starting, Online, Draining, Rejected(*), Removing, NotDeployed(*), Stopping(*)
+    # Remove the following HPC Pack nodes:
+    #   1. The corresponding CC node already removed
+    #   2. The corresponding CC node is stopped and HPC node is not assigned a node template
+    # Take offline the following HPC Pack nodes:
+    #   1. The corresponding CC node is stopped or is going to stop
+    plan.nodes_to_remove = node_selector.remove_names()
+    plan.nodes_to_take_offline = node_selector.stopped_online_names()
+
+    # Assign default node template for unapproved CC node
+    plan.templates_to_assign = node_selector.assign_template_names()
+
+    cc_node_to_terminate = list(allocation.provisioning_timeouts)
+    plan.count("provisioning_timeouts", len(cc_node_to_terminate))
+    plan.prewarm_nodes = list(allocation.prewarm_nodes)
+    plan.count("prewarm_nodes", len(plan.prewarm_nodes))
+    plan.count("hungry_groups", len([a for a in allocation.allocations if a.hungry]))
+
+    # Start the shrink checking
+    cc_node_to_shutdown: List[Node] = []
+    # without an idle check no node is found idle or busy, the standby pools count the ready nodes in
+    idle_node_names = CISet()
+    idle_unknown_node_names = CISet()
+    checked_node_names = CISet()
+    if not allocation.shrink_check:
+        logging.info("No shrink check at this round ...")
+        for nhi in node_history.items:
+            if not nhi.stopped and nhi.hpc_id and nhi.idle_from is not None:
+                plan.idle_from[nhi.cc_id] = None
+    elif idle_check is None:
+        # the idle times are kept, the nodes idle long enough are shut down in a later round
+        idle_check_skip_reason = idle_check_skip_reason or "no idle check was made"
+        logging.warning("Skipping the scale down check: {}".format(idle_check_skip_reason))
+        plan.skipped["idle_check"] = idle_check_skip_reason
+    else:
+        logging.info("Start scale down checking ...")
+        curtime = inputs.now
+        # nodes whose idle check failed keep their idle time until the next round
+        idle_node_names = idle_check.idle_node_names
+        idle_unknown_node_names = idle_check.idle_unknown_node_names
+        plan.count("candidates", len(idle_check.candidates))
+        plan.count("idle_nodes", len(idle_node_names))
+        plan.count("idle_unknown_nodes", len(idle_unknown_node_names))
+        checked_node_names = CISet([n.name for n in idle_check.candidates])
+
+        if len(idle_node_names) > 0:
+            logging.info("The following node is idle: {}".format(idle_node_names))
+        else:
+            logging.info("No idle node found in this round.")
+
+        for nhi in node_history.items:
+            if nhi.stopped:
+                if nhi.stop_time + timedelta(days=retention_days) < curtime:
+                    cc_node = inputs.cc_nodes_by_id.get(nhi.cc_id)
+                    if cc_node is not None:
+                        cc_node_to_terminate.append(cc_node)
+                continue
+            if nhi.hostname in idle_node_names:
+                if nhi.idle_from is None:
+                    plan.idle_from[nhi.cc_id] = curtime
+                elif nhi.idle_timeout(prewarm_idle_timeout if nhi.prewarm_pending else idle_timeout_seconds):
+                    cc_node = inputs.cc_nodes_by_id.get(nhi.cc_id)
+                    if cc_node is not None:
+                        cc_node_to_shutdown.append(cc_node)
+            elif nhi.hostname not in idle_unknown_node_names:
+                if nhi.idle_from is not None:
+                    plan.idle_from[nhi.cc_id] = None
+                # a pre-warmed node found busy met the demand it was started for
+                if nhi.prewarm_pending and nhi.hostname in checked_node_names:
+                    plan.prewarm_hits.append(nhi.cc_id)
+        plan.count("prewarm_hits", len(plan.prewarm_hits))
+
+    # Keep the standby pools: the idle Online nodes a node array keeps running for the next jobs
+    # the deallocated nodes still known to HPC Pack start again without joining it, a pool keeps as many past the retention
+    registered_stopped_ids = CISet([nhi.cc_id for nhi in node_history.items if nhi.stopped and nhi.hpc_id])
+    for pool_array, pool_size in standby.items():
+        array = inputs.nodearrays.lookup(pool_array)
+        if array is None:
+            logging.warning("No node array {} for the standby pool of autoscale.standby".format(pool_array))
+            continue
+        reserve = [n for n in inputs.cc_nodes if ci_equals(n.nodearray, array) and ci_equals(n.target_state, 'Deallocated')
+                   and n.delayed_node_id.node_id in registered_stopped_ids]
+        reserve_ids = set(id(n) for n in reserve)
+        retiring = sorted([n for n in cc_node_to_terminate if id(n) in reserve_ids],
+                          key=lambda n: node_history.find(cc_id=n.delayed_node_id.node_id).stop_ts or 0.0, reverse=True)
+        kept_reserve = retiring[:max(0, pool_size - len(reserve) + len(retiring))]
+        if kept_reserve:
+            kept_ids = set(id(n) for n in kept_reserve)
+            cc_node_to_terminate = [n for n in cc_node_to_terminate if id(n) not in kept_ids]
+        plan.count("standby_reserve_kept", len(kept_reserve))
+
+        ready_nodes = [n for n in allocation.ready_hpc_nodes if ci_equals(n.cc_nodearray, array)]
+        # the nodes found running jobs are out of the pool, those not checked are counted in
+        pool_nodes = [n for n in ready_nodes if n.name in idle_node_names or n.name in idle_unknown_node_names
+                      or n.name not in checked_node_names]
+        pool_cc_ids = CISet([n.cc_node_id for n in pool_nodes])
+        # the nodes idle the longest are shut down, the others are kept
+        shutting_down = sorted([n for n in cc_node_to_shutdown if n.delayed_node_id.node_id in pool_cc_ids],
+                               key=lambda n: node_history.find(cc_id=n.delayed_node_id.node_id).idle_ts or 0.0, reverse=True)
+        kept = shutting_down[:max(0, pool_size - len(pool_nodes) + len(shutting_down))]
+        if kept:
+            logging.info("Keeping {} idle nodes of node array {} as standby: {}".format(len(kept), array, [n.name for n in kept]))
+            kept_ids = set(id(n) for n in kept)
+            cc_node_to_shutdown = [n for n in cc_node_to_shutdown if id(n) not in kept_ids]
+        pool_count = len(pool_nodes) - len(shutting_down) + len(kept)
+        plan.count("standby_kept", len(kept))
+        plan.count("standby_nodes", pool_count)
+
+        # top the pool up, the nodes still starting are ready soon
+        ready_cc_ids = CISet([n.cc_node_id for n in ready_nodes])
+        stopping_ids = set(id(n) for n in cc_node_to_terminate + cc_node_to_shutdown)
+        starting = [n for n in inputs.cc_nodes if ci_equals(n.nodearray, array) and ci_equals(n.target_state, 'Started')
+                    and n.delayed_node_id.node_id not in ready_cc_ids and id(n) not in stopping_ids]
+        missing = pool_size - pool_count - len(starting)
+        if missing > 0:
+            logging.info("{} nodes to start for the standby pool of node array {}".format(missing, array))
+            plan.standby_starts[array] = missing
+            plan.count("standby_starts", missing)
+
+    pending_prewarm_ids = CISet([nhi.cc_id for nhi in node_history.items if not nhi.stopped and nhi.prewarm_pending])
+    plan.count("prewarm_misses", len([n for n in cc_node_to_shutdown if n.delayed_node_id.node_id in pending_prewarm_ids]))
+
+    new_node_counts: Dict[Any, int] = {}
+    for a in allocation.allocations + allocation.extra_allocations:
+        for n in a.new_nodes:
+            new_node_counts[(n.nodearray, n.vm_size)] = new_node_counts.get((n.nodearray, n.vm_size), 0) + 1
+    plan.new_nodes = [{"nodearray": k[0], "vm_size": k[1], "count": v} for k, v in new_node_counts.items()]
+    plan.count("new_nodes", plan.new_node_count)
+
+    plan.nodes_to_shut_down = [n.delayed_node_id.node_id for n in cc_node_to_shutdown]
+    plan.nodes_to_terminate = [n.delayed_node_id.node_id for n in cc_node_to_terminate]
+    shrinking_cc_node_ids = CISet(plan.nodes_to_terminate)
+    shrinking_cc_node_ids.update(plan.nodes_to_shut_down)
+    plan.nodes_to_bring_online = node_selector.bring_online_names(shrinking_cc_node_ids)
+    plan.nodes_to_take_offline.extend(node_selector.shrinking_online_names(shrinking_cc_node_ids))
+    taken_offline = CISet(plan.nodes_to_take_offline)
+    plan.offline_cc_ids = {n.name: n.cc_node_id for n in node_selector.active_cc_nodes() if n.name in taken_offline}
+    return plan
+
+
+def recheck_idle(
+    plan: Plan,
+    inputs: RoundInputs,
+    check_nodes_idle: Callable[[List[str]], BulkResult],
+    idle_check_skip_reason: Optional[str] = None
+) -> List[str]:
+    """
+    Checks again, on the inputs of the round applying it, the idle nodes a plan made earlier, e.g.
+    by azhpcpack plan, shuts down: its idle check is as old as the plan. The nodes found running
+    jobs, or whose idle check failed or is skipped, are kept running and are no longer taken
+    offline, the idle time of those found running jobs is cleared. Returns the CC node Ids of the
+    nodes kept.
+    """
+    if idle_check_skip_reason:
+        # the nodes idle long enough are shut down in a later round
+        logging.warning("Skipping the scale down of the plan: {}".format(idle_check_skip_reason))
+        plan.skipped["idle_check"] = idle_check_skip_reason
+        kept_cc_ids = plan.nodes_to_shut_down
+        plan.nodes_to_shut_down = []
+        plan.nodes_to_take_offline = [name for name in plan.nodes_to_take_offline if name not in plan.offline_cc_ids]
+        plan.offline_cc_ids = {}
+        return kept_cc_ids
+    shut_down_ids = CISet(plan.nodes_to_shut_down)
+    hpc_nodes = [n for n in inputs.hpc_nodes if n.cc_node_id in shut_down_ids]
+    _, idle_node_names, idle_unknown_node_names = check_idle(hpc_nodes, check_nodes_idle)
+    kept_nodes = [n for n in hpc_nodes if n.name not in idle_node_names]
+    if not kept_nodes:
+        return []
+    kept_names = CISet([n.name for n in kept_nodes])
+    kept_cc_ids = CISet([n.cc_node_id for n in kept_nodes])
+    logging.warning("Not shutting down the nodes no longer idle since the plan was made: {}".format(kept_names))
+    plan.nodes_to_shut_down = [i for i in plan.nodes_to_shut_down if i not in kept_cc_ids]
+    plan.nodes_to_take_offline = [name for name in plan.nodes_to_take_offline if name not in kept_names]
+    plan.offline_cc_ids = {name: cc_id for name, cc_id in plan.offline_cc_ids.items() if name not in kept_names}
+    for n in kept_nodes:
+        if n.name not in idle_unknown_node_names:
+            plan.idle_from[n.cc_node_id] = None
+    return [n.cc_node_id for n in kept_nodes]
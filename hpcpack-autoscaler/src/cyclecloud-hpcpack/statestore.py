@@ -0,0 +1,226 @@
+import json
+import os
+import zlib
+import hpc.autoscale.hpclogging as logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from .commonutil import from_epoch, to_epoch
+
+
+class JournaledStateStore:
+    """
+    Crash-safe key/record store made of a snapshot file and an append-only journal.
+
+    Each commit appends one checksummed line holding the upserted and deleted records and
+    fsyncs the journal, so a round writes only what changed. Once compact_every records are
+    journaled, the full state is written to a new snapshot (temp file + fsync + atomic replace)
+    and the journal is truncated. On load the snapshot is read and the journal is replayed up
+    to the last intact record, a torn tail left by a crash is cut off.
+
+    Records are stored as given (compact JSON arrays for the node history) and key_of
+    extracts the key of a record. Timestamps are UTC epoch seconds.
+
+    Another process may write the same files in between, e.g. a cron run next to the daemon.
+    A commit then continues the seq of the records on disk, and changed_on_disk tells the
+    owner that its records are stale.
+    """
+    FORMAT = "hpcpack-journaled-state"
+    # 2: records are JSON arrays, timestamps are epoch seconds
+    VERSION = 2
+
+    def __init__(
+        self,
+        snapshot_file: str,
+        journal_file: Optional[str] = None,
+        compact_every: int = 60,
+        key_of: Callable[[Any], str] = lambda r: r[0]
+    ) -> None:
+        self.__snapshot_file = snapshot_file
+        self.__key_of = key_of
+        self.__journal_file = journal_file or snapshot_file + ".journal"
+        self.__compact_every = compact_every
+        self.__seq = 0
+        self.__journaled = 0
+        # set when the files on disk are not in the store format (missing, legacy or damaged)
+        self.__needs_compaction = True
+        # (inode, size, mtime) of the snapshot and the journal as last read or written by this store
+        self.__stamp: Optional[Tuple[Any, Any]] = None
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.__needs_compaction or self.__journaled >= self.__compact_every
+
+    @property
+    def changed_on_disk(self) -> bool:
+        """
+        Whether the files were written since this store last read or wrote them.
+        """
+        return self.__stamp is None or self.__file_stamp() != self.__stamp
+
+    def load(self) -> Optional[Tuple[datetime, Dict[str, Any]]]:
+        """
+        Returns the last committed (updated, records), or None if there is no snapshot in the store format.
+        """
+        snapshot = self.__read_snapshot()
+        self.__stamp = self.__file_stamp()
+        if snapshot is None:
+            self.__needs_compaction = True
+            return None
+        self.__seq = snapshot["seq"]
+        updated = from_epoch(snapshot["updated"])
+        records: Dict[str, Any] = {self.__key_of(r): r for r in snapshot["items"]}
+
+        self.__journaled = 0
+        self.__needs_compaction = False
+        for entry in self.__replay_journal(self.__seq):
+            self.__seq = entry["seq"]
+            self.__journaled += 1
+            updated = from_epoch(entry["updated"])
+            for key in entry.get("deletes", []):
+                records.pop(key, None)
+            for record in entry.get("upserts", []):
+                records[self.__key_of(record)] = record
+        # the replay cuts off a damaged tail
+        self.__stamp = self.__file_stamp()
+        return updated, records
+
+    def commit(self, updated: datetime, upserts: Iterable[Any], deletes: Iterable[str]) -> None:
+        if self.changed_on_disk:
+            self.__reread_seq()
+        entry = {
+            "seq": self.__seq + 1,
+            "updated": to_epoch(updated),
+            "upserts": list(upserts),
+            "deletes": list(deletes),
+        }
+        payload = json.dumps(entry, separators=(",", ":"))
+        line = "{:08x} {}\n".format(zlib.crc32(payload.encode()), payload)
+        with open(self.__journal_file, "a", encoding="utf-8") as jf:
+            jf.write(line)
+            jf.flush()
+            os.fsync(jf.fileno())
+        self.__seq += 1
+        self.__journaled += 1
+        self.__stamp = self.__file_stamp()
+
+    def compact(self, updated: datetime, records: Dict[str, Any]) -> None:
+        if self.changed_on_disk:
+            self.__reread_seq()
+        snapshot = {
+            "format": self.FORMAT,
+            "version": self.VERSION,
+            "seq": self.__seq,
+            "updated": to_epoch(updated),
+            "items": list(records.values()),
+        }
+        tmp_file = self.__snapshot_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as sf:
+            sf.write(json.dumps(snapshot, separators=(",", ":")))
+            sf.flush()
+            os.fsync(sf.fileno())
+        os.replace(tmp_file, self.__snapshot_file)
+        _fsync_dir(self.__snapshot_file)
+        # Journal records up to seq are now in the snapshot, and are skipped on replay
+        # even if the process dies before the truncation below
+        with open(self.__journal_file, "w", encoding="utf-8") as jf:
+            jf.flush()
+            os.fsync(jf.fileno())
+        self.__journaled = 0
+        self.__needs_compaction = False
+        self.__stamp = self.__file_stamp()
+
+    def __reread_seq(self) -> None:
+        # Continue after the last record another process wrote, so that no seq is used twice
+        # and the journal of a newer snapshot is not mistaken for an older one on replay
+        snapshot = self.__read_snapshot()
+        if snapshot is None:
+            # not in the store format, rewritten by the next compaction
+            return
+        seq = snapshot["seq"]
+        entries = self.__replay_journal(seq)
+        if entries:
+            seq = entries[-1]["seq"]
+        if seq != self.__seq:
+            logging.warning("Another process wrote the state store {} up to record {}, continuing after it".format(self.__snapshot_file, seq))
+        self.__seq = seq
+        self.__journaled = len(entries)
+
+    def __file_stamp(self) -> Tuple[Any, Any]:
+        return _stat_stamp(self.__snapshot_file), _stat_stamp(self.__journal_file)
+
+    def __read_snapshot(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.__snapshot_file):
+            return None
+        try:
+            with open(self.__snapshot_file, "r", encoding="utf-8") as sf:
+                snapshot = json.load(sf)
+        except ValueError:
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get("format") != self.FORMAT:
+            return None
+        if snapshot.get("version") != self.VERSION:
+            logging.warning("Unsupported state snapshot version {} in {}".format(snapshot.get("version"), self.__snapshot_file))
+            return None
+        return snapshot
+
+    def __replay_journal(self, snapshot_seq: int) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.__journal_file):
+            return []
+        entries: List[Dict[str, Any]] = []
+        good_offset = 0
+        expected_seq = snapshot_seq + 1
+        with open(self.__journal_file, "rb") as jf:
+            content = jf.read()
+        for raw_line in content.splitlines(keepends=True):
+            entry = _parse_journal_line(raw_line)
+            if entry is None:
+                break
+            if entry["seq"] > snapshot_seq:
+                if entry["seq"] != expected_seq:
+                    break
+                entries.append(entry)
+                expected_seq += 1
+            good_offset += len(raw_line)
+        if good_offset < len(content):
+            logging.warning("Discarding {} bytes of damaged journal in {} after record {}".format(
+                len(content) - good_offset, self.__journal_file, expected_seq - 1))
+            with open(self.__journal_file, "r+b") as jf:
+                jf.truncate(good_offset)
+                jf.flush()
+                os.fsync(jf.fileno())
+        return entries
+
+
+def _parse_journal_line(raw_line: bytes) -> Optional[Dict[str, Any]]:
+    if not raw_line.endswith(b"\n"):
+        return None
+    try:
+        crc, payload = raw_line.rstrip(b"\n").split(b" ", 1)
+        if int(crc, 16) != zlib.crc32(payload):
+            return None
+        entry = json.loads(payload.decode("utf-8"))
+    except ValueError:
+        return None
+    return entry if isinstance(entry, dict) and isinstance(entry.get("seq"), int) else None
+
+
+def _stat_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _fsync_dir(path: str) -> None:
+    # Persist the rename itself, directories cannot be opened for fsync on Windows
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
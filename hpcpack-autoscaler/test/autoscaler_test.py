@@ -0,0 +1,60 @@
+import importlib
+import os
+from typing import Any, Dict, List
+
+autoscaler = importlib.import_module("cyclecloud-hpcpack.autoscaler")
+benchmark = importlib.import_module("cyclecloud-hpcpack.benchmark")
+hpcnodehistory = importlib.import_module("cyclecloud-hpcpack.hpcnodehistory")
+roundlock = importlib.import_module("cyclecloud-hpcpack.roundlock")
+
+
+def round_config(tmp_path: Any) -> Dict[str, Any]:
+    return {"autoscale": {"metrics_file": None, "lock_file": None, "grow_history_file": str(tmp_path / "grow_history.jsonl")}}
+
+
+def round_args(tmp_path: Any, cluster: Any) -> Dict[str, Any]:
+    statefile, archivefile = str(tmp_path / "state.txt"), str(tmp_path / "archive.txt")
+    cluster.write_history(statefile, archivefile)
+    return {
+        "hpcpack_rest_client": cluster.new_rest_client(),
+        "node_history": hpcnodehistory.HpcNodeHistory(statefile, archivefile),
+        "node_mgr": cluster.new_node_manager(),
+    }
+
+
+def test_grow_decisions_recorded_by_the_rounds_applied(tmp_path: Any) -> None:
+    cluster = benchmark.SyntheticCluster(100, seed=1)
+    config = round_config(tmp_path)
+    grow_history_file = config["autoscale"]["grow_history_file"]
+    autoscaler.plan_hpcpack(config, **round_args(tmp_path, cluster))
+    autoscaler.autoscale_hpcpack(config, dry_run=True, **round_args(tmp_path, cluster))
+    assert not os.path.exists(grow_history_file)
+    autoscaler.autoscale_hpcpack(config, **round_args(tmp_path, cluster))
+    with open(grow_history_file, "r", encoding="utf-8") as hf:
+        assert len(hf.readlines()) == 1
+
+
+def test_coalesced_round_fetches_the_nodes_again(tmp_path: Any, monkeypatch: Any) -> None:
+    cluster = benchmark.SyntheticCluster(100, seed=1)
+    config = round_config(tmp_path)
+    config["autoscale"].update({"overlap": "coalesce", "lock_file": str(tmp_path / "autoscaler.lock")})
+    rounds: List[Any] = []
+
+    def round_node_mgr() -> Any:
+        # the node manager of each round, as seen by its get_nodes
+        node_mgr = cluster.new_node_manager()
+        get_nodes = node_mgr.get_nodes
+
+        def counted_get_nodes() -> Any:
+            rounds.append(node_mgr)
+            return get_nodes()
+        node_mgr.get_nodes = counted_get_nodes
+        return node_mgr
+
+    monkeypatch.setattr(autoscaler, "new_node_manager", lambda config: round_node_mgr())
+    # a run that overlapped the round left its note
+    roundlock.RoundLock(config["autoscale"]["lock_file"]).add_pending()
+    args = round_args(tmp_path, cluster)
+    args["node_mgr"] = round_node_mgr()
+    autoscaler.autoscale_hpcpack(config, **args)
+    assert len(rounds) == 2 and rounds[0] is args["node_mgr"] and rounds[1] is not args["node_mgr"]
@@ -0,0 +1,83 @@
+import importlib
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+commonutil = importlib.import_module("cyclecloud-hpcpack.commonutil")
+
+CIDict = commonutil.CIDict
+CISet = commonutil.CISet
+
+
+def test_cidict() -> None:
+    d = CIDict([("Node-1", 1), ("node-2", 2)])
+    assert d["NODE-1"] == 1 and d.get("Node-2") == 2
+    assert "node-1" in d and None not in d and 1 not in d
+    assert d.get(None) is None and d.get("node-3", 3) == 3
+    # the first spelling is kept
+    d["NODE-1"] = 10
+    assert list(d) == ["Node-1", "node-2"]
+    assert list(d.items()) == [("Node-1", 10), ("node-2", 2)]
+    assert list(d.values()) == [10, 2]
+    assert d.lookup("NODE-1") == "Node-1" and d.lookup("NODE-2") == "node-2" and d.lookup("node-3") is None
+    assert d.setdefault("NODE-2", 20) == 2 and d.setdefault("Node-3", 3) == 3
+    assert d.pop("node-3") == 3 and d.pop("node-3", None) is None
+    with pytest.raises(KeyError):
+        d.pop("node-3")
+    del d["node-1"]
+    with pytest.raises(KeyError):
+        d["Node-1"]
+    # a key spelled differently once deleted
+    d["NODE-1"] = 1
+    assert list(d) == ["node-2", "NODE-1"] and len(d) == 2
+    d.clear()
+    assert len(d) == 0 and list(d) == []
+
+
+def test_cidict_from_dict() -> None:
+    d = CIDict({"A": 1})
+    assert d["a"] == 1 and dict(d) == {"A": 1}
+
+
+def test_ciset() -> None:
+    s = CISet(["Node-1", "node-1", "node-2"])
+    assert len(s) == 2 and list(s) == ["Node-1", "node-2"]
+    assert "NODE-2" in s and None not in s
+    assert s.lookup("NODE-1") == "Node-1"
+    s.discard("NODE-1")
+    assert list(s) == ["node-2"]
+
+
+def test_ci_dict() -> None:
+    d = commonutil.ci_dict(["A", "a", "b", None], lambda v: v)
+    assert dict(d) == {"A": "A", "b": "b"}
+
+
+def test_epoch() -> None:
+    now = datetime(2024, 2, 29, 12, 30, 15, 250000)
+    assert commonutil.from_epoch(commonutil.to_epoch(now)) == now
+    assert commonutil.to_epoch(None) is None and commonutil.from_epoch(None) is None
+
+
+def test_run_concurrently() -> None:
+    results, seconds = commonutil.run_concurrently({"a": lambda: 1, "b": lambda: 2}, max_workers=2, timeout=5.0)
+    assert results == {"a": 1, "b": 2} and set(seconds) == {"a", "b"}
+
+
+def test_run_concurrently_timeouts() -> None:
+    release = threading.Event()
+    try:
+        # the slow task has a timeout of its own, the fast one keeps the default
+        results, _ = commonutil.run_concurrently({"slow": lambda: release.wait(0.3), "fast": lambda: 1}, max_workers=2,
+                                                 timeout=0.1, timeouts={"slow": 5.0})
+        assert results == {"slow": False, "fast": 1}
+        # the short timeout is not held up by the long one
+        start = time.monotonic()
+        with pytest.raises(TimeoutError, match="hung"):
+            commonutil.run_concurrently({"slow": lambda: release.wait(5.0), "hung": lambda: release.wait(5.0)}, max_workers=2,
+                                        timeouts={"slow": 5.0, "hung": 0.1})
+        assert time.monotonic() - start < 2.0
+    finally:
+        release.set()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The package directory, cyclecloud-hpcpack, is not a valid identifier: the tests import its
+# modules with importlib.import_module("cyclecloud-hpcpack.<module>") from the src directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
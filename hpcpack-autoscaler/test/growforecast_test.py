@@ -0,0 +1,67 @@
+import importlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, List
+
+growforecast = importlib.import_module("cyclecloud-hpcpack.growforecast")
+hpcpackdriver = importlib.import_module("cyclecloud-hpcpack.hpcpackdriver")
+
+GrowDecision = hpcpackdriver.GrowDecision
+GrowHistory = growforecast.GrowHistory
+
+
+def read_lines(history_file: str) -> List[Any]:
+    with open(history_file, "r", encoding="utf-8") as hf:
+        return [json.loads(line) for line in hf]
+
+
+def test_record_does_not_load(tmp_path: Any) -> None:
+    history_file = str(tmp_path / "grow_history.jsonl")
+    now = datetime.utcnow()
+    history = GrowHistory(history_file)
+    history.record({"array0": GrowDecision(4.0, 1.0, 0.0), "array1": GrowDecision(0.0, 0.0, 0.0)}, now=now - timedelta(days=1, minutes=-1))
+    history.record({}, now=now)
+    assert history.records == 0
+    assert [line["g"] for line in read_lines(history_file)] == [{"array0": [1.0, 4.0]}, {}]
+    # the forecast loads the records, those recorded next are kept in memory too
+    assert history.forecast(now) == {"array0": GrowDecision(4.0, 1.0, 0.0)}
+    assert history.records == 2
+    history.record({"array0": GrowDecision(0.0, 2.0, 0.0)}, now=now)
+    assert history.records == 3
+
+
+def test_forecast(tmp_path: Any) -> None:
+    history_file = str(tmp_path / "grow_history.jsonl")
+    now = datetime.utcnow()
+    history = GrowHistory(history_file, days=3, lead_minutes=30)
+    # the peak of the lead window of each past day, averaged over the days with records
+    history.record({"Array0": GrowDecision(0.0, 2.0, 0.0)}, now=now - timedelta(days=1) + timedelta(minutes=10))
+    history.record({"array0": GrowDecision(0.0, 4.0, 0.0)}, now=now - timedelta(days=1) + timedelta(minutes=20))
+    history.record({}, now=now - timedelta(days=2) + timedelta(minutes=5))
+    # out of the lead window
+    history.record({"array0": GrowDecision(0.0, 10.0, 0.0)}, now=now - timedelta(days=1) + timedelta(minutes=40))
+    forecast = history.forecast(now)
+    assert list(forecast) == ["Array0"]
+    assert forecast["Array0"] == GrowDecision(0.0, 2.0, 0.0)
+    assert GrowHistory(str(tmp_path / "missing.jsonl")).forecast(now) == {}
+
+
+def test_expired_records_are_dropped(tmp_path: Any) -> None:
+    history_file = str(tmp_path / "grow_history.jsonl")
+    now = datetime.utcnow()
+    history = GrowHistory(history_file, days=7)
+    history.record({"array0": GrowDecision(0.0, 1.0, 0.0)}, now=now - timedelta(days=8))
+    history.record({"array0": GrowDecision(0.0, 1.0, 0.0)}, now=now - timedelta(days=1, minutes=-1))
+    with open(history_file, "a", encoding="utf-8") as hf:
+        hf.write('{"t": 12\n')
+    # the record of the round compacts the file once its oldest record is expired for long enough
+    GrowHistory(history_file, days=7).record({}, now=now)
+    # the torn line is dropped too
+    assert len(read_lines(history_file)) == 2
+    assert GrowHistory(history_file, days=7).forecast(now) == {"array0": GrowDecision(0.0, 1.0, 0.0)}
+
+
+def test_new_grow_history(tmp_path: Any) -> None:
+    assert growforecast.new_grow_history({"autoscale": {"grow_history_file": None}}) is None
+    history = growforecast.new_grow_history({"autoscale": {"grow_history_file": str(tmp_path / "grow_history.jsonl")}})
+    assert history is not None and history.records == 0
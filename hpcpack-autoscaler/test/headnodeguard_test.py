@@ -0,0 +1,89 @@
+import importlib
+from typing import Any, List
+
+headnodeguard = importlib.import_module("cyclecloud-hpcpack.headnodeguard")
+
+CircuitBreaker = headnodeguard.CircuitBreaker
+HeadNodeGuard = headnodeguard.HeadNodeGuard
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def fake_clock(monkeypatch: Any) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(headnodeguard.time, "monotonic", clock)
+    return clock
+
+
+def test_round_deadline(monkeypatch: Any) -> None:
+    clock = fake_clock(monkeypatch)
+    unbounded = headnodeguard.RoundDeadline()
+    assert unbounded.cap(30.0) == 30.0 and unbounded.cap(None) is None
+    deadline = headnodeguard.RoundDeadline(60.0)
+    clock.now += 50
+    assert deadline.remaining() == 10.0
+    assert deadline.cap(30.0) == 10.0 and deadline.cap(None) == 10.0
+    clock.now += 20
+    assert deadline.expired
+    # the essential calls of an overrun round still get a short chance
+    assert deadline.cap(30.0) == 1.0
+
+
+def test_circuit_breaker(monkeypatch: Any) -> None:
+    clock = fake_clock(monkeypatch)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=300.0, slow_call_seconds=30.0)
+    breaker.record_failure()
+    breaker.record_success(1.0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    # a slow call counts as a failure
+    breaker.record_success(31.0)
+    assert breaker.state == CircuitBreaker.OPEN and breaker.degraded
+    breaker.record_success(1.0)
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 300
+    assert breaker.state == CircuitBreaker.HALF_OPEN and not breaker.degraded
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 300
+    breaker.record_success(1.0)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retries(monkeypatch: Any) -> None:
+    fake_clock(monkeypatch)
+    guard = HeadNodeGuard(retry_attempts=3, retry_base_delay=0.5, retry_max_delay=8.0, breaker=CircuitBreaker(failure_threshold=10), seed=1)
+    guard.start_round(headnodeguard.RoundDeadline(120.0))
+    delays: List[Any] = [guard.failed(attempt, 503) for attempt in range(3)]
+    assert 0 <= delays[0] <= 0.5 and 0 <= delays[1] <= 1.0
+    # the attempts are used up
+    assert delays[2] is None
+    assert guard.retries == 2
+    # the head node answered, the call fails the same way every time
+    assert guard.failed(0, 404) is None
+    assert guard.failed(0, None, idempotent=False) is None
+    assert guard.failed(0, 429, retry_after="5") == 5.0
+
+
+def test_no_retry_past_the_deadline_or_when_degraded(monkeypatch: Any) -> None:
+    clock = fake_clock(monkeypatch)
+    guard = HeadNodeGuard(breaker=CircuitBreaker(failure_threshold=3), seed=1)
+    guard.start_round(headnodeguard.RoundDeadline(10.0))
+    clock.now += 10
+    assert guard.failed(0, None) is None
+    guard.start_round(headnodeguard.RoundDeadline(None))
+    assert guard.failed(0, None) is not None
+    assert guard.failed(0, None) is None
+    assert guard.breaker.degraded
+
+
+def test_new_head_node_guard() -> None:
+    guard = headnodeguard.new_head_node_guard({"retry_attempts": 1, "breaker_failures": 1})
+    assert guard.failed(0, 503) is None
+    assert guard.breaker.degraded
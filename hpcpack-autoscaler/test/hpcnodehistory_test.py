@@ -0,0 +1,125 @@
+import importlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+import jsonpickle
+
+hpcnodehistory = importlib.import_module("cyclecloud-hpcpack.hpcnodehistory")
+
+
+class LegacyNodeHistoryItem:
+    # The attributes of NodeHistoryItem before the state format version 2
+    def __init__(self, cc_id: str, hostname: Optional[str], hpc_id: Optional[str]) -> None:
+        now = datetime.utcnow()
+        self.cc_id = cc_id
+        self.hostname = hostname
+        self.emerge_time = now - timedelta(hours=1)
+        self.start_time = now - timedelta(minutes=30)
+        self.hpc_id = hpc_id
+        self.idle_from: Optional[datetime] = None
+        self.stop_time: Optional[datetime] = None
+
+
+def write_legacy_statefile(statefile: str, updated: datetime) -> None:
+    items = [
+        LegacyNodeHistoryItem("cc-1", "node-1", "1"),
+        LegacyNodeHistoryItem("cc-2", "node-2", None),
+        LegacyNodeHistoryItem("cc-3", None, None),
+    ]
+    items[1].stop_time = updated - timedelta(minutes=5)
+    content = jsonpickle.encode({"updated": updated, "items": items})
+    # what the older versions wrote, a jsonpickle object tag naming NodeHistoryItem
+    legacy_tag = "{}.LegacyNodeHistoryItem".format(__name__)
+    content = content.replace(legacy_tag, "{}.NodeHistoryItem".format(hpcnodehistory.__name__))
+    with open(statefile, "w") as f:
+        f.write(content)
+
+
+def test_migrate_legacy_statefile(tmp_path: Any) -> None:
+    statefile = str(tmp_path / "nodehistory.json")
+    archivefile = str(tmp_path / "nodehistory.archive")
+    updated = datetime.utcnow() - timedelta(seconds=30)
+    write_legacy_statefile(statefile, updated)
+
+    history = hpcnodehistory.HpcNodeHistory(statefile, archivefile)
+    items = {i.cc_id: i for i in history.items}
+    assert sorted(items) == ["cc-1", "cc-2", "cc-3"]
+    assert items["cc-1"].hostname == "node-1"
+    assert items["cc-1"].hpc_id == "1"
+    assert not items["cc-1"].stopped
+    assert items["cc-2"].stopped
+    assert not items["cc-3"].prewarm_pending
+    assert history.find(hpc_id="1") is items["cc-1"]
+    assert history.find(hostname="NODE-2") is items["cc-2"]
+    assert os.path.exists(statefile + ".legacy")
+
+    # the migrated state is reloaded from the current format
+    reloaded = hpcnodehistory.HpcNodeHistory(statefile, archivefile)
+    assert sorted(i.cc_id for i in reloaded.items) == ["cc-1", "cc-2", "cc-3"]
+    assert reloaded.find(cc_id="cc-2").stop_time == items["cc-2"].stop_time
+
+
+def test_save_and_reload(tmp_path: Any) -> None:
+    statefile = str(tmp_path / "nodehistory.json")
+    archivefile = str(tmp_path / "nodehistory.archive")
+    history = hpcnodehistory.HpcNodeHistory(statefile, archivefile)
+    prewarmed = hpcnodehistory.NodeHistoryItem("cc-1", "node-1")
+    prewarmed.prewarm_time = datetime.utcnow()
+    history.insert(prewarmed)
+    history.insert(hpcnodehistory.NodeHistoryItem("cc-2", "node-2"))
+    history.save()
+    history.archive(history.find(cc_id="cc-2"))
+    history.save()
+
+    reloaded = hpcnodehistory.HpcNodeHistory(statefile, archivefile)
+    assert [i.cc_id for i in reloaded.items] == ["cc-1"]
+    assert reloaded.find(cc_id="CC-1").prewarm_pending
+    with open(archivefile) as af:
+        assert "cc_id=cc-2" in af.read()
+
+
+def test_indexes_follow_key_changes(tmp_path: Any) -> None:
+    history = hpcnodehistory.HpcNodeHistory(str(tmp_path / "nodehistory.json"), str(tmp_path / "nodehistory.archive"))
+    item = hpcnodehistory.NodeHistoryItem("cc-1", "node-1")
+    history.insert(item)
+    history.insert(hpcnodehistory.NodeHistoryItem("cc-2", "node-2"))
+    assert history.find(hpc_id="1") is None
+    item.reset_hpc_id("1")
+    item.hostname = "node-1b"
+    assert history.find(hpc_id="1") is item
+    assert history.find(hostname="NODE-1B", hpc_id="1") is item
+    assert history.find(hostname="node-1") is None
+    assert sorted(i.cc_id for i in history.find_items(hpc_ids=["1"], hostnames=["node-1b", "node-2"], cc_ids=["cc-1"])) == ["cc-1", "cc-2"]
+
+    # an archived or replaced item is dropped from the indexes, and no longer updates them
+    history.archive(item)
+    assert history.find(hpc_id="1") is None and history.find_items(hostnames=["node-1b"]) == []
+    item.hpc_id = "3"
+    assert history.find(hpc_id="3") is None
+    replacement = hpcnodehistory.NodeHistoryItem("cc-2", "node-2b")
+    history.insert(replacement, overwrite=True)
+    assert history.find(hostname="node-2") is None and history.find(hostname="node-2b") is replacement
+
+
+def test_save_journals_the_changed_items(tmp_path: Any) -> None:
+    statefile = str(tmp_path / "nodehistory.json")
+    archivefile = str(tmp_path / "nodehistory.archive")
+    history = hpcnodehistory.HpcNodeHistory(statefile, archivefile)
+    for i in range(3):
+        history.insert(hpcnodehistory.NodeHistoryItem("cc-{}".format(i), "node-{}".format(i)))
+    history.save()
+    # the same value, not journaled
+    history.find(cc_id="cc-0").idle_from = None
+    history.find(cc_id="cc-1").hpc_id = "1"
+    history.archive(history.find(cc_id="cc-2"))
+    history.save()
+
+    with open(statefile + ".journal") as jf:
+        entries = [json.loads(line.split(" ", 1)[1]) for line in jf]
+    assert [r[0] for r in entries[-1]["upserts"]] == ["cc-1"]
+    assert entries[-1]["deletes"] == ["cc-2"]
+    reloaded = hpcnodehistory.HpcNodeHistory(statefile, archivefile)
+    assert reloaded.find(hpc_id="1").cc_id == "cc-1"
+    assert reloaded.find(cc_id="cc-2") is None
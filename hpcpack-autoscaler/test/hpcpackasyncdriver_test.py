@@ -0,0 +1,171 @@
+import asyncio
+import importlib
+import json
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+aiohttp = pytest.importorskip("aiohttp")
+
+benchmark = importlib.import_module("cyclecloud-hpcpack.benchmark")
+hpcpackasyncdriver = importlib.import_module("cyclecloud-hpcpack.hpcpackasyncdriver")
+hpcpackdriver = importlib.import_module("cyclecloud-hpcpack.hpcpackdriver")
+hpcpacksimulator = importlib.import_module("cyclecloud-hpcpack.hpcpacksimulator")
+
+
+def simulated_request(
+    head_node: Any,
+    method: str,
+    url: str,
+    params: Optional[Dict[str, str]],
+    data: Optional[str],
+    headers: Optional[Dict[str, str]]
+) -> Any:
+    path = urlsplit(url).path
+    if params:
+        path += "?" + urlencode(params)
+    return head_node.handle(method, path, data.encode("utf-8") if data else b"", headers)
+
+
+class StubSession:
+    # requests.Session answered by a SimulatedHeadNode, without a socket
+    def __init__(self, head_node: Any) -> None:
+        self.head_node = head_node
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        data: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs: Any
+    ) -> requests.Response:
+        status, response_headers, content = simulated_request(self.head_node, method, url, params, data, headers)
+        res = requests.Response()
+        res.status_code = status
+        res.headers = CaseInsensitiveDict(response_headers)
+        res.url = url
+        res._content = content
+        res._content_consumed = True
+        return res
+
+    def close(self) -> None:
+        pass
+
+
+class StubStream:
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+
+    async def iter_chunked(self, size: int) -> Any:
+        for i in range(0, len(self.content), size):
+            yield self.content[i:i + size]
+
+
+class AsyncStubResponse:
+    def __init__(self, status: int, headers: Dict[str, str], content: bytes) -> None:
+        self.status = status
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = StubStream(content)
+
+    async def __aenter__(self) -> "AsyncStubResponse":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    async def read(self) -> bytes:
+        return self.content.content
+
+    def raise_for_status(self) -> None:
+        raise aiohttp.ClientResponseError(None, (), status=self.status, headers=self.headers)
+
+
+class AsyncStubSession:
+    # aiohttp.ClientSession answered by a SimulatedHeadNode, without a socket
+    closed = False
+
+    def __init__(self, head_node: Any) -> None:
+        self.head_node = head_node
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        data: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> AsyncStubResponse:
+        return AsyncStubResponse(*simulated_request(self.head_node, method, url, params, data, headers))
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def new_head_node() -> Any:
+    cluster = benchmark.SyntheticCluster(12, nodearray_count=2, seed=3)
+    head_node = hpcpacksimulator.SimulatedHeadNode.from_cluster(cluster)
+    head_node.add_node("new-0", "CCW-ARRAY0-99")
+    return head_node
+
+
+def node_fields(nodes: List[Any]) -> List[Any]:
+    return sorted((n.id, n.name, n.health, n.state, sorted(n.nodegroups), n.nodetemplate) for n in nodes)
+
+
+def exercise(client: Any) -> Dict[str, Any]:
+    # the same calls as a round makes, with the results in comparable form
+    results: Dict[str, Any] = {}
+    results["grow_decision"] = client.get_grow_decision()
+    nodes = client.list_computenodes()
+    results["list_computenodes"] = node_fields(nodes)
+    results["first_refresh"] = client.last_status_refresh
+    results["list_computenodes_again"] = node_fields(client.list_computenodes())
+    results["second_refresh"] = client.last_status_refresh
+    results["active_computenodes"] = node_fields(client.list_computenodes(active_only=True))
+    names = sorted(n.name for n in nodes)
+    results["list_node_names"] = sorted(client.list_node_names())
+    results["get_nodes"] = node_fields(client.get_nodes(names[:3]))
+    results["list_idle_nodes"] = sorted(i.node_name for i in client.list_idle_nodes())
+    results["take_nodes_offline"] = sorted(client.take_nodes_offline(names[:3]))
+    results["bring_nodes_online"] = sorted(client.bring_nodes_online(names[:2]))
+    results["assign_default_compute_node_template"] = sorted(client.assign_default_compute_node_template(["CCW-ARRAY0-99"]))
+    results["add_node_group"] = client.add_node_group("array9")
+    results["add_node_to_node_group"] = sorted(client.add_node_to_node_group("array9", names[:4]))
+    results["list_node_groups"] = sorted(client.list_node_groups())
+    results["remove_nodes"] = sorted(client.remove_nodes(names[-2:]))
+    results["get_node_status_exact"] = sorted(json.dumps(n, sort_keys=True) for n in client.get_node_status_exact(names))
+    return results
+
+
+def test_async_clients_match_the_blocking_client() -> None:
+    sync_head_node, facade_head_node = new_head_node(), new_head_node()
+    sync_client = hpcpackdriver.HpcRestClient({}, "unused.pem", chunk_size=2)
+    sync_client._session = StubSession(sync_head_node)
+    expected = exercise(sync_client)
+    assert expected["second_refresh"].not_modified
+    assert expected["take_nodes_offline"] and expected["add_node_to_node_group"]
+
+    with hpcpackasyncdriver.AsyncBackedHpcRestClient({}, "unused.pem", chunk_size=2) as facade:
+        facade.async_client._session = AsyncStubSession(facade_head_node)
+        assert exercise(facade) == expected
+    assert facade_head_node.request_counts == sync_head_node.request_counts
+
+
+def test_async_client_coroutines() -> None:
+    async def take_offline() -> Any:
+        async with hpcpackasyncdriver.AsyncHpcRestClient({}, "unused.pem", chunk_size=2) as client:
+            client._session = AsyncStubSession(head_node)
+            nodes = await client.list_computenodes(active_only=True)
+            online = [n.name for n in nodes if n.state == "Online"]
+            result = await client.take_nodes_offline(online)
+            return online, result
+
+    head_node = new_head_node()
+    online, result = asyncio.run(take_offline())
+    assert result.ok and len(online) > 2 and sorted(result) == sorted(online)
+    assert all(head_node.node(name)["NodeState"] == "Offline" for name in online)
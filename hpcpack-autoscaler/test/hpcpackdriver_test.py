@@ -0,0 +1,116 @@
+import importlib
+import json
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+hpcpackdriver = importlib.import_module("cyclecloud-hpcpack.hpcpackdriver")
+
+HpcRestClient = hpcpackdriver.HpcRestClient
+StatusRefresh = hpcpackdriver.StatusRefresh
+
+
+class StatusSession:
+    """
+    requests.Session serving the node listings of a head node that answers the conditional
+    requests: If-None-Match when it sends an ETag, else If-Modified-Since.
+    """
+    def __init__(self, records: List[Dict[str, Any]], etags: bool = True) -> None:
+        self.records = records
+        self.etags = etags
+        self.version = 0
+        self.status_requests: List[Dict[str, str]] = []
+
+    def change(self) -> None:
+        self.version += 1
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs: Any
+    ) -> requests.Response:
+        headers = headers or {}
+        res = requests.Response()
+        res.url = url
+        res.status_code = 200
+        if url == HpcRestClient.LIST_NODES_ROUTE.format("localhost"):
+            content: Any = [{"Id": r["Id"], "Name": r["Name"]} for r in self.records]
+        else:
+            assert url == HpcRestClient.LIST_NODES_STATUS_ROUTE.format("localhost")
+            self.status_requests.append(dict(headers))
+            validators = {"Last-Modified": "Mon, 01 Jan 2024 00:{:02d}:00 GMT".format(self.version)}
+            if self.etags:
+                validators["ETag"] = '"{}"'.format(self.version)
+            res.headers = CaseInsensitiveDict(validators)
+            if (headers.get("If-None-Match") == validators.get("ETag") if self.etags
+                    else headers.get("If-Modified-Since") == validators["Last-Modified"]):
+                res.status_code = 304
+                res._content = b""
+                res._content_consumed = True
+                return res
+            content = [{k: v for k, v in r.items() if k != "Id"} for r in self.records]
+        res._content = json.dumps(content).encode("utf-8")
+        res._content_consumed = True
+        return res
+
+    def close(self) -> None:
+        pass
+
+
+def node_records(count: int) -> List[Dict[str, Any]]:
+    return [{"Id": "id-{}".format(i), "Name": "CCW-ARRAY0-{}".format(i), "NodeHealth": "OK", "NodeState": "Online",
+             "Groups": ["ComputeNodes", "CycleCloudNodes"], "NodeTemplate": "Default ComputeNode Template"}
+            for i in range(count)]
+
+
+def new_client(session: StatusSession) -> Any:
+    client = HpcRestClient({}, "unused.pem")
+    client._session = session
+    return client
+
+
+def test_status_listing_not_modified() -> None:
+    session = StatusSession(node_records(5))
+    client = new_client(session)
+    nodes = client.list_computenodes()
+    assert client.last_status_refresh == StatusRefresh(False, 0, 5, 0)
+    nodes[0].idle_from = nodes[0].cc_node_id = "bound last round"
+
+    again = client.list_computenodes()
+    assert session.status_requests[-1] == {"If-None-Match": '"0"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    assert client.last_status_refresh == StatusRefresh(True, 5, 0, 0)
+    # the nodes of the previous listing are handed out again, without the links of the last round
+    assert [id(n) for n in again] == [id(n) for n in nodes]
+    assert again[0].idle_from is None and again[0].cc_node_id is None
+
+
+def test_status_listing_not_modified_since() -> None:
+    session = StatusSession(node_records(3), etags=False)
+    client = new_client(session)
+    client.list_computenodes()
+    client.list_computenodes()
+    assert session.status_requests[-1] == {"If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    assert client.last_status_refresh == StatusRefresh(True, 3, 0, 0)
+
+
+def test_status_listing_reuses_unchanged_nodes() -> None:
+    session = StatusSession(node_records(5))
+    client = new_client(session)
+    nodes = {n.name: n for n in client.list_computenodes()}
+
+    session.records[1]["NodeState"] = "Draining"
+    session.records[2]["Groups"] = ["ComputeNodes", "CycleCloudNodes", "array0"]
+    del session.records[4]
+    session.change()
+    again = {n.name: n for n in client.list_computenodes()}
+    assert session.status_requests[-1]["If-None-Match"] == '"0"'
+    assert client.last_status_refresh == StatusRefresh(False, 2, 2, 1)
+    assert sorted(name for name, n in again.items() if n is nodes[name]) == ["CCW-ARRAY0-0", "CCW-ARRAY0-3"]
+    assert again["CCW-ARRAY0-1"].state == "Draining" and "array0" in again["CCW-ARRAY0-2"].nodegroups
+
+    # the listing after the change is the snapshot the next one is compared with
+    client.list_computenodes()
+    assert client.last_status_refresh == StatusRefresh(True, 4, 0, 0)
@@ -0,0 +1,42 @@
+import importlib
+import json
+from typing import Any, List
+
+import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+jsonstream = importlib.import_module("cyclecloud-hpcpack.jsonstream")
+
+json_values = st.recursive(
+    st.none() | st.booleans() | st.integers() | st.floats(allow_nan=False, allow_infinity=False) | st.text(),
+    lambda children: st.lists(children, max_size=3) | st.dictionaries(st.text(max_size=5), children, max_size=3),
+    max_leaves=10)
+
+
+def chunked(body: bytes, size: int) -> List[bytes]:
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@settings(max_examples=200, deadline=None)
+@given(st.lists(json_values, max_size=8), st.integers(1, 16), st.booleans())
+def test_decode_in_chunks(elements: List[Any], chunk_size: int, indent: bool) -> None:
+    # any split of the body, in the middle of a number, a string or a multi-byte character
+    body = json.dumps(elements, indent=1 if indent else None, ensure_ascii=False).encode("utf-8")
+    assert list(jsonstream.iter_json_array(chunked(body, chunk_size))) == elements
+
+
+def test_feed_returns_the_completed_elements() -> None:
+    decoder = jsonstream.JsonArrayDecoder()
+    assert decoder.feed(b'[{"Name": "A"}, 1') == [{"Name": "A"}]
+    assert decoder.feed(b"2, ") == [12]
+    assert not decoder.done
+    assert decoder.feed(b'"x"]') == ["x"]
+    assert decoder.done
+    assert decoder.close() == []
+
+
+@pytest.mark.parametrize("body", [b'{"a": 1}', b"[1, 2", b"[1 2]", b"[1,]", b"[1] 2", b'["a'])
+def test_invalid_body(body: bytes) -> None:
+    with pytest.raises(ValueError):
+        list(jsonstream.iter_json_array(chunked(body, 3)))
@@ -0,0 +1,67 @@
+import importlib
+from typing import Any, Dict, List
+
+import pytest
+
+benchmark = importlib.import_module("cyclecloud-hpcpack.benchmark")
+commonutil = importlib.import_module("cyclecloud-hpcpack.commonutil")
+hpcnodehistory = importlib.import_module("cyclecloud-hpcpack.hpcnodehistory")
+hpcpackdriver = importlib.import_module("cyclecloud-hpcpack.hpcpackdriver")
+nodeselection = importlib.import_module("cyclecloud-hpcpack.nodeselection")
+
+
+def bound_hpc_nodes(cluster: Any, tmp_path: Any) -> List[Any]:
+    statefile, archivefile = str(tmp_path / "state.txt"), str(tmp_path / "archive.txt")
+    cluster.write_history(statefile, archivefile)
+    node_history = hpcnodehistory.HpcNodeHistory(statefile, archivefile)
+    hpc_nodes = [n for n in cluster.new_hpc_nodes() if hpcpackdriver.is_active_computenode(n)]
+    node_history.synchronize(cluster.new_node_manager().get_nodes(), hpc_nodes)
+    return hpc_nodes
+
+
+def selections(selector: Any, cluster: Any) -> Dict[str, Any]:
+    # the selections of a round, in its order
+    shrinking_cc_node_ids = commonutil.CISet([spec[0] for spec in cluster.cc_nodes[::10]])
+    result: Dict[str, Any] = {
+        "cc_tag": selector.cc_tag_names(),
+        "nodearray_tag": dict(selector.nodearray_tag_names().items()),
+        "remove": selector.remove_names(),
+        "stopped_online": selector.stopped_online_names(),
+    }
+    selector.drop_stopped_and_removed()
+    result.update({
+        "assign_template": selector.assign_template_names(),
+        "active_cc": [n.name for n in selector.active_cc_nodes()],
+        "ready_active_cc": [n.name for n in selector.ready_active_cc_nodes()],
+        "bring_online": selector.bring_online_names(shrinking_cc_node_ids),
+        "shrinking_online": selector.shrinking_online_names(shrinking_cc_node_ids),
+    })
+    for grow_default in [False, True]:
+        for hungry in [{}, {cluster.nodearrays[0]: True, "array-without-nodes": True}, {a.upper(): i % 2 == 0 for i, a in enumerate(cluster.nodearrays)}]:
+            key = "idle_check_{}_{}".format(grow_default, sorted(hungry.items()))
+            result[key] = [n.name for n in selector.idle_check_candidates(grow_default, hungry)]
+    return result
+
+
+def test_selections(tmp_path: Any) -> None:
+    cluster = benchmark.SyntheticCluster(200, seed=1)
+    result = selections(nodeselection.NodeSelector(bound_hpc_nodes(cluster, tmp_path)), cluster)
+    # the synthetic cluster has nodes in most selections
+    assert all(result[key] for key in ["cc_tag", "assign_template", "active_cc", "ready_active_cc", "bring_online"])
+    assert set(result["ready_active_cc"]) <= set(result["active_cc"])
+    assert not set(result["remove"]) & set(result["active_cc"])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_columnar_parity(tmp_path: Any, seed: int) -> None:
+    pytest.importorskip("numpy")
+    cluster = benchmark.SyntheticCluster(400, nodearray_count=3, seed=seed)
+    expected = selections(nodeselection.NodeSelector(bound_hpc_nodes(cluster, tmp_path)), cluster)
+    actual = selections(nodeselection.NodeColumns(bound_hpc_nodes(cluster, tmp_path)), cluster)
+    assert actual == expected
+
+
+def test_new_node_selector() -> None:
+    assert type(nodeselection.new_node_selector({}, [])) is nodeselection.NodeSelector
+    if nodeselection.np is not None:
+        assert type(nodeselection.new_node_selector({"autoscale": {"columnar": True}}, [])) is nodeselection.NodeColumns
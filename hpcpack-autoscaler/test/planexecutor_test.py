@@ -0,0 +1,153 @@
+import importlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+benchmark = importlib.import_module("cyclecloud-hpcpack.benchmark")
+commonutil = importlib.import_module("cyclecloud-hpcpack.commonutil")
+hpcpackdriver = importlib.import_module("cyclecloud-hpcpack.hpcpackdriver")
+planexecutor = importlib.import_module("cyclecloud-hpcpack.planexecutor")
+roundmetrics = importlib.import_module("cyclecloud-hpcpack.roundmetrics")
+roundplan = importlib.import_module("cyclecloud-hpcpack.roundplan")
+
+FakeHpcRestClient: Any = benchmark.FakeHpcRestClient
+
+
+def partial_result(function_name: str, node_names: Any, failed: List[str]) -> Any:
+    # the nodes named in failed are in a chunk that timed out
+    chunks = [commonutil.ChunkResult(0, [n for n in node_names if n not in failed], [], None)]
+    if failed:
+        chunks.append(commonutil.ChunkResult(1, list(failed), None, RuntimeError("timed out")))
+    return hpcpackdriver.BulkResult(function_name, chunks)
+
+
+class FailingRestClient(FakeHpcRestClient):
+    # fails the nodes named in failed_offline and failed_online, and raises in remove_nodes
+    def __init__(self, cluster: Any, failed_offline: List[str], failed_online: Optional[List[str]] = None) -> None:
+        super().__init__(cluster)
+        self.failed_offline = failed_offline
+        self.failed_online = failed_online or []
+
+    def take_nodes_offline(self, node_names: Any) -> Any:
+        return partial_result("take_nodes_offline", node_names, self.failed_offline)
+
+    def bring_nodes_online(self, node_names: Any) -> Any:
+        return partial_result("bring_nodes_online", node_names, self.failed_online)
+
+    def remove_nodes(self, node_names: Any) -> Any:
+        raise RuntimeError("the head node is busy")
+
+
+def running_cluster(nodes: int) -> Any:
+    # nodes running, Online and bound in array0
+    cluster = benchmark.SyntheticCluster(0, nodearray_count=1)
+    now = commonutil.to_epoch(datetime.utcnow())
+    cluster.hpc_nodes = []
+    for i in range(nodes):
+        cc_id, hpc_id, hostname = "cc-{}".format(i), "hpc-{}".format(i), "ccw-array0-{}".format(i + 1)
+        cluster.cc_nodes.append((cc_id, "array0-{}".format(i + 1), hostname, "array0", "Started", "Started"))
+        cluster.hpc_nodes.append({"Id": hpc_id, "Name": hostname.upper(), "NodeHealth": "OK", "NodeState": "Online",
+                                  "Groups": ["ComputeNodes", "CycleCloudNodes", "array0"], "NodeTemplate": "Default ComputeNode Template"})
+        cluster.history_records.append([cc_id, hostname, hpc_id, now - 7200, now - 3600, now - 1800, None])
+    cluster.grow_decisions = {}
+    return cluster
+
+
+def round_inputs(tmp_path: Any, cluster: Any) -> Any:
+    cluster.write_history(str(tmp_path / "state.txt"), str(tmp_path / "archive.txt"))
+    node_history = roundplan.HpcNodeHistory(str(tmp_path / "state.txt"), str(tmp_path / "archive.txt"))
+    node_mgr = cluster.new_node_manager()
+    cc_nodes = node_mgr.get_nodes()
+    hpc_nodes = [n for n in cluster.new_hpc_nodes() if hpcpackdriver.is_active_computenode(n)]
+    node_history.synchronize(cc_nodes, hpc_nodes)
+    return roundplan.RoundInputs(node_mgr, cc_nodes, hpc_nodes, cluster.node_groups, {}, node_history)
+
+
+def phase_counts(round_metrics: Any) -> Dict[str, Dict[str, int]]:
+    return {p.name: p.counts for p in round_metrics.phases}
+
+
+def test_apply_plan(tmp_path: Any) -> None:
+    cluster = running_cluster(3)
+    inputs = round_inputs(tmp_path, cluster)
+    plan = roundplan.Plan()
+    plan.groups_to_create = ["array0"]
+    plan.nodes_to_tag = {"array0": ["CCW-ARRAY0-1"]}
+    plan.new_nodes = [{"nodearray": "array0", "vm_size": "Standard_F4", "count": 1}]
+    plan.prewarm_nodes = ["array0-4"]
+    plan.nodes_to_take_offline = ["CCW-ARRAY0-2", "CCW-ARRAY0-3"]
+    plan.offline_cc_ids = {"CCW-ARRAY0-2": "cc-1", "CCW-ARRAY0-3": "cc-2"}
+    plan.nodes_to_shut_down = ["cc-1", "cc-2"]
+    plan.idle_from = {"cc-0": None}
+    rest_client = cluster.new_rest_client()
+    round_metrics = roundmetrics.RoundMetrics(metrics_file=None)
+    planexecutor.apply_plan(plan, inputs, rest_client, round_metrics, allocated=False)
+
+    assert [n.name for n in inputs.node_mgr.shutdown] == ["array0-2", "array0-3"]
+    counts = phase_counts(round_metrics)
+    assert counts["apply.tag.array0"] == {"nodes_tagged": 1}
+    assert counts["apply.bootup"] == {"nodes_booted": 1}
+    assert counts["apply.take_offline"] == {"nodes_taken_offline": 2}
+    # the node history is saved with the updates of the plan
+    node_history = roundplan.HpcNodeHistory(str(tmp_path / "state.txt"), str(tmp_path / "archive.txt"))
+    assert node_history.find(cc_id="cc-0").idle_from is None
+    assert node_history.find(cc_id="cc-1").stopped and node_history.find(cc_id="cc-2").stopped
+    booted = node_history.find(cc_id="array0-new-4")
+    assert booted is not None and booted.prewarm_time == plan.created
+
+
+def test_apply_plan_failures(tmp_path: Any) -> None:
+    cluster = running_cluster(3)
+    inputs = round_inputs(tmp_path, cluster)
+    plan = roundplan.Plan()
+    plan.groups_to_create = ["array0"]
+    plan.nodes_to_remove = ["CCW-GONE-1"]
+    plan.nodes_to_take_offline = ["CCW-ARRAY0-2", "CCW-ARRAY0-3"]
+    plan.offline_cc_ids = {"CCW-ARRAY0-2": "cc-1", "CCW-ARRAY0-3": "cc-2"}
+    plan.nodes_to_shut_down = ["cc-1", "cc-2"]
+    rest_client = FailingRestClient(cluster, failed_offline=["CCW-ARRAY0-3"])
+    round_metrics = roundmetrics.RoundMetrics(metrics_file=None)
+    with pytest.raises(RuntimeError, match="remove_nodes"):
+        planexecutor.apply_plan(plan, inputs, rest_client, round_metrics, skip_reason=lambda: "the head node is degraded")
+
+    # the node whose HPC node may still get jobs keeps running, the failed removal does not stop the others
+    assert [n.name for n in inputs.node_mgr.shutdown] == ["array0-2"]
+    counts = phase_counts(round_metrics)
+    assert counts["apply.remove_nodes"] == {"failed": 1}
+    assert counts["apply.group_tagging"] == {"skipped": 1}
+    assert "add_node_group" not in rest_client.calls
+    node_history = roundplan.HpcNodeHistory(str(tmp_path / "state.txt"), str(tmp_path / "archive.txt"))
+    assert node_history.find(cc_id="cc-1").stopped and not node_history.find(cc_id="cc-2").stopped
+
+
+def test_apply_plan_standby_starts(tmp_path: Any) -> None:
+    cluster = running_cluster(2)
+    inputs = round_inputs(tmp_path, cluster)
+    for bucket in inputs.node_mgr.get_buckets():
+        bucket.max_count = 10
+    plan = roundplan.Plan()
+    plan.standby_starts = {"array0": 2}
+    round_metrics = roundmetrics.RoundMetrics(metrics_file=None)
+    planexecutor.apply_plan(plan, inputs, cluster.new_rest_client(), round_metrics)
+
+    # the running nodes are in the pool already, the missing ones are started
+    assert phase_counts(round_metrics)["apply.bootup"] == {"standby_started": 2, "nodes_booted": 2}
+    assert [n.name for n in inputs.node_mgr.new_nodes] == ["array0-3", "array0-4"]
+
+
+def test_apply_plan_failed_nodes(tmp_path: Any) -> None:
+    cluster = running_cluster(3)
+    inputs = round_inputs(tmp_path, cluster)
+    plan = roundplan.Plan()
+    plan.nodes_to_bring_online = ["CCW-ARRAY0-1", "CCW-ARRAY0-2"]
+    plan.idle_from = {"cc-0": None}
+    rest_client = FailingRestClient(cluster, failed_offline=[], failed_online=["CCW-ARRAY0-2"])
+    round_metrics = roundmetrics.RoundMetrics(metrics_file=None)
+    with pytest.raises(RuntimeError, match="bring_online"):
+        planexecutor.apply_plan(plan, inputs, rest_client, round_metrics)
+
+    # the nodes the head node failed are not counted, and the round reports the failure once the node history is saved
+    assert phase_counts(round_metrics)["apply.bring_online"] == {"nodes_brought_online": 1, "failed_nodes": 1, "failed": 1}
+    node_history = roundplan.HpcNodeHistory(str(tmp_path / "state.txt"), str(tmp_path / "archive.txt"))
+    assert node_history.find(cc_id="cc-0").idle_from is None
@@ -0,0 +1,94 @@
+import importlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any
+
+import pytest
+
+roundlock = importlib.import_module("cyclecloud-hpcpack.roundlock")
+
+
+def write_owner(lock_file: str, **owner: Any) -> None:
+    with open(lock_file, "w") as lf:
+        json.dump(owner, lf)
+
+
+def test_acquire_is_reentrant(tmp_path: Any) -> None:
+    lock_file = str(tmp_path / "autoscaler.lock")
+    lock = roundlock.RoundLock(lock_file)
+    with lock.hold():
+        assert os.path.exists(lock_file)
+        assert lock.owner()["pid"] == os.getpid()
+        # the history save takes the lock again within the round
+        with roundlock.RoundLock(lock_file).hold():
+            pass
+        assert os.path.exists(lock_file)
+    assert not os.path.exists(lock_file)
+
+
+def test_held_by_another_process(tmp_path: Any) -> None:
+    lock_file = str(tmp_path / "autoscaler.lock")
+    write_owner(lock_file, pid=1, host="another-host", acquired=time.time(), token="theirs")
+    lock = roundlock.RoundLock(lock_file)
+    assert not lock.acquire(timeout=0.2, interval=0.05)
+    with pytest.raises(roundlock.RoundLockBusy):
+        with lock.hold():
+            pass
+    # release does not remove a lock that is not ours
+    lock.release()
+    assert lock.owner()["token"] == "theirs"
+
+
+def test_break_stale_lock(tmp_path: Any) -> None:
+    lock_file = str(tmp_path / "autoscaler.lock")
+    lock = roundlock.RoundLock(lock_file, stale_after=60.0)
+    write_owner(lock_file, pid=1, host="another-host", acquired=time.time() - 61, token="theirs")
+    assert lock.acquire()
+    assert lock.owner()["pid"] == os.getpid()
+    lock.release()
+
+    # the owner process on this host is gone
+    gone = subprocess.Popen([sys.executable, "-c", "pass"])
+    gone.wait()
+    write_owner(lock_file, pid=gone.pid, host=socket.gethostname(), acquired=time.time(), token="theirs")
+    assert lock.acquire()
+    lock.release()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_break_stale_lock_taken_meanwhile(tmp_path: Any, monkeypatch: Any) -> None:
+    lock_file = str(tmp_path / "autoscaler.lock")
+    lock = roundlock.RoundLock(lock_file, stale_after=60.0)
+    write_owner(lock_file, pid=1, host="another-host", acquired=time.time() - 61, token="stale")
+    replace = os.replace
+
+    def taken_before_replace(src: str, dst: str) -> None:
+        # another process breaks the stale lock and takes it after this one found it stale
+        if src == lock_file:
+            write_owner(lock_file, pid=1, host="another-host", acquired=time.time(), token="theirs")
+        replace(src, dst)
+
+    monkeypatch.setattr(roundlock.os, "replace", taken_before_replace)
+    assert not lock.acquire(timeout=0.2, interval=0.05)
+    # the lock of the new owner is given back, the moved file is gone
+    assert lock.owner()["token"] == "theirs"
+    assert os.listdir(str(tmp_path)) == ["autoscaler.lock"]
+
+
+def test_pending_notes(tmp_path: Any) -> None:
+    lock = roundlock.RoundLock(str(tmp_path / "autoscaler.lock"))
+    assert lock.take_pending() == 0
+    lock.add_pending()
+    lock.add_pending()
+    assert lock.take_pending() == 2
+    assert lock.take_pending() == 0
+
+
+def test_new_round_lock(tmp_path: Any) -> None:
+    assert roundlock.new_round_lock({"autoscale": {"lock_file": None}}) is None
+    lock = roundlock.new_round_lock({"autoscale": {"lock_file": str(tmp_path / "autoscaler.lock")}})
+    assert lock is not None and lock.pending_file == str(tmp_path / "autoscaler.lock.pending")
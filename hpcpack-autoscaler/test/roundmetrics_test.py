@@ -0,0 +1,97 @@
+import importlib
+import json
+import os
+from typing import Any, Dict, List
+
+roundmetrics = importlib.import_module("cyclecloud-hpcpack.roundmetrics")
+reststats = importlib.import_module("cyclecloud-hpcpack.reststats")
+
+RoundMetrics = roundmetrics.RoundMetrics
+
+
+def finished_round(metrics_file: Any = None, prometheus_file: Any = None, max_bytes: int = 1024 * 1024) -> Any:
+    round_metrics = RoundMetrics(metrics_file=metrics_file, prometheus_file=prometheus_file, max_bytes=max_bytes)
+    round_metrics.set_round_count("cc_nodes", 3)
+    round_metrics.begin("fetch")
+    round_metrics.count("hpc_nodes", 2)
+    round_metrics.begin("apply.tag.array\"0\"")
+    round_metrics.count("nodes_tagged")
+    round_metrics.count("nodes_tagged")
+    round_metrics.add_phase("fetch.grow_decision", 0.25, decisions=1)
+    round_metrics.finish()
+    return round_metrics
+
+
+def read_lines(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as mf:
+        return [json.loads(line) for line in mf]
+
+
+def test_json_lines(tmp_path: Any) -> None:
+    metrics_file = str(tmp_path / "metrics.jsonl")
+    finished_round(metrics_file).write()
+    skipped = RoundMetrics(metrics_file=metrics_file)
+    skipped.skip("another run holds the lock")
+    skipped.write()
+
+    first, second = read_lines(metrics_file)
+    assert first["success"] and first["skipped"] is None and first["counts"] == {"cc_nodes": 3}
+    assert [(p["name"], p["counts"]) for p in first["phases"]] == [
+        ("fetch", {"hpc_nodes": 2}), ("apply.tag.array\"0\"", {"nodes_tagged": 2}), ("fetch.grow_decision", {"decisions": 1})]
+    assert first["phases"][2]["seconds"] == 0.25 and first["timestamp"].endswith("Z")
+    assert not second["success"] and second["skipped"] == "another run holds the lock" and second["phases"] == []
+
+
+def test_json_lines_rotation(tmp_path: Any) -> None:
+    metrics_file = str(tmp_path / "metrics.jsonl")
+    finished_round(metrics_file).write()
+    # room for one round but not for two, the lengths of the lines differ by a few digits
+    max_bytes = os.path.getsize(metrics_file) * 3 // 2
+    finished_round(metrics_file, max_bytes=max_bytes).write()
+    assert len(read_lines(metrics_file)) == 2 and not os.path.exists(metrics_file + ".1")
+    # the file past max_bytes is moved to <file>.1 before the next round, replacing the older one
+    for _ in range(3):
+        finished_round(metrics_file, max_bytes=max_bytes).write()
+    assert len(read_lines(metrics_file + ".1")) == 2 and len(read_lines(metrics_file)) == 1
+
+
+def test_prometheus_textfile(tmp_path: Any) -> None:
+    prometheus_file = str(tmp_path / "autoscaler.prom")
+    round_metrics = finished_round(prometheus_file=prometheus_file)
+    rest = reststats.RestStats()
+    for status in [200, 200, 500]:
+        with rest.measure("nodes/status", None) as call:
+            call.response(status, 10)
+    round_metrics.rest = rest.snapshot()
+    round_metrics.write()
+
+    with open(prometheus_file, "r", encoding="utf-8") as pf:
+        lines = pf.read().splitlines()
+    assert not os.path.exists(prometheus_file + ".tmp")
+    assert "# TYPE hpcpack_autoscale_round_duration_seconds gauge" in lines
+    assert "hpcpack_autoscale_round_success 1" in lines
+    assert 'hpcpack_autoscale_round_count{name="cc_nodes"} 3' in lines
+    assert 'hpcpack_autoscale_phase_count{phase="apply.tag.array\\"0\\"",name="nodes_tagged"} 2' in lines
+    assert 'hpcpack_autoscale_phase_duration_seconds{phase="fetch.grow_decision"} 0.25' in lines
+    assert "# TYPE hpcpack_autoscale_rest_latency_seconds histogram" in lines
+    assert 'hpcpack_autoscale_rest_latency_seconds_bucket{route="nodes/status",le="+Inf"} 3' in lines
+    assert 'hpcpack_autoscale_rest_latency_seconds_count{route="nodes/status"} 3' in lines
+    assert 'hpcpack_autoscale_rest_responses{route="nodes/status",status="500"} 1' in lines
+    assert 'hpcpack_autoscale_rest_response_bytes{route="nodes/status"} 30' in lines
+    buckets = [int(line.rsplit(" ", 1)[1]) for line in lines if line.startswith("hpcpack_autoscale_rest_latency_seconds_bucket")]
+    assert buckets == sorted(buckets)
+
+    # a skipped run leaves the gauges of the last round that ran
+    skipped = RoundMetrics(metrics_file=None, prometheus_file=prometheus_file)
+    skipped.skip("another run holds the lock")
+    skipped.write()
+    with open(prometheus_file, "r", encoding="utf-8") as pf:
+        assert pf.read().splitlines() == lines
+
+
+def test_new_round_metrics(tmp_path: Any) -> None:
+    prometheus_file = str(tmp_path / "autoscaler.prom")
+    round_metrics = roundmetrics.new_round_metrics({"autoscale": {"metrics_file": None, "prometheus_file": prometheus_file}})
+    round_metrics.finish()
+    round_metrics.write()
+    assert os.listdir(str(tmp_path)) == ["autoscaler.prom"]
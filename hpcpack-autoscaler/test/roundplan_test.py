@@ -0,0 +1,170 @@
+import importlib
+from datetime import datetime
+from typing import Any, Dict, List
+
+benchmark = importlib.import_module("cyclecloud-hpcpack.benchmark")
+commonutil = importlib.import_module("cyclecloud-hpcpack.commonutil")
+hpcpackdriver = importlib.import_module("cyclecloud-hpcpack.hpcpackdriver")
+roundplan = importlib.import_module("cyclecloud-hpcpack.roundplan")
+
+GrowDecision = hpcpackdriver.GrowDecision
+GroupDemand = roundplan.GroupDemand
+
+
+def ready_cluster(nodes: int, prewarmed: int) -> Any:
+    # nodes running, Online and bound in array0, the last prewarmed of them started ahead of a forecast demand
+    cluster = benchmark.SyntheticCluster(0, nodearray_count=2)
+    now = commonutil.to_epoch(datetime.utcnow())
+    cluster.hpc_nodes = []
+    for i in range(nodes):
+        cc_id, hpc_id, hostname = "cc-{}".format(i), "hpc-{}".format(i), "ccw-array0-{}".format(i + 1)
+        cluster.cc_nodes.append((cc_id, "array0-{}".format(i + 1), hostname, "array0", "Started", "Started"))
+        cluster.hpc_nodes.append({"Id": hpc_id, "Name": hostname.upper(), "NodeHealth": "OK", "NodeState": "Online",
+                                  "Groups": ["ComputeNodes", "CycleCloudNodes", "array0"], "NodeTemplate": "Default ComputeNode Template"})
+        record: List[Any] = [cc_id, hostname, hpc_id, now - 7200, now - 3600, None, None]
+        if i >= nodes - prewarmed:
+            record.extend([now - 600, None])
+        cluster.history_records.append(record)
+    cluster.grow_decisions = {}
+    return cluster
+
+
+def round_inputs(tmp_path: Any, cluster: Any, forecast: Dict[str, Any]) -> Any:
+    cluster.write_history(str(tmp_path / "state.txt"), str(tmp_path / "archive.txt"))
+    node_history = roundplan.HpcNodeHistory(str(tmp_path / "state.txt"), str(tmp_path / "archive.txt"))
+    node_mgr = cluster.new_node_manager()
+    for bucket in node_mgr.get_buckets():
+        bucket.max_count = 100
+    cc_nodes = node_mgr.get_nodes()
+    hpc_nodes = [n for n in cluster.new_hpc_nodes() if hpcpackdriver.is_active_computenode(n)]
+    node_history.synchronize(cc_nodes, hpc_nodes)
+    return roundplan.RoundInputs(node_mgr, cc_nodes, hpc_nodes, cluster.node_groups, {}, node_history, forecast=forecast)
+
+
+def make_plan(config: Dict[str, Any], inputs: Any, cluster: Any) -> Any:
+    # the stages of autoscaler.make_plan, the idle check answered by the cluster
+    allocation = roundplan.allocate_round(config, inputs)
+    idle_check = None
+    if allocation.shrink_check:
+        idle_check = roundplan.check_idle(allocation.idle_check_candidates(), cluster.new_rest_client().check_nodes_idle)
+    return roundplan.plan_round(config, inputs, allocation, idle_check)
+
+
+def plan_with_forecast(tmp_path: Any, cluster: Any, forecast: Dict[str, Any], max_nodes: int = 10) -> Any:
+    inputs = round_inputs(tmp_path, cluster, forecast)
+    config = {"autoscale": {"prewarm": True, "prewarm_max_nodes": max_nodes}}
+    return make_plan(config, inputs, cluster)
+
+
+def test_collect_demands() -> None:
+    nodearrays = commonutil.CISet(["array0", "array1"])
+    decisions = {
+        "ARRAY0": GrowDecision(3.5, 1.0, 0.0),
+        "array1": GrowDecision(0.0, 0.0, 0.0),
+        "unmapped": GrowDecision(0.0, 2.0, 0.0),
+        "ComputeNodes": GrowDecision(2.0, 0.0, 0.0),
+        "Default": GrowDecision(0.0, 1.5, 0.0),
+    }
+    demands = roundplan.collect_demands(decisions, nodearrays)
+    assert demands == [GroupDemand("ARRAY0", "array0", 1, 4), GroupDemand("Default", None, 2, 2)]
+
+
+def test_prewarm_demands() -> None:
+    nodearrays = commonutil.CISet(["array0", "array1"])
+    vcpu_counts = commonutil.CIDict([("array0", 4), ("array1", 1)])
+    forecast = {
+        "array0": GrowDecision(8.0, 1.0, 0.0),
+        "array1": GrowDecision(0.0, 0.4, 0.0),
+        "Default": GrowDecision(0.0, 5.0, 0.0),
+    }
+    # 1 node and 8 cores of 4 vCPUs forecast, 1 node asked for already
+    demands = [GroupDemand("array0", "array0", 1, 0)]
+    assert roundplan.prewarm_demands(forecast, demands, nodearrays, vcpu_counts) == [GroupDemand("array0", "array0", 2, 0)]
+    # the nodes pre-warmed by the earlier rounds count against the forecast
+    prewarmed = commonutil.CIDict([("ARRAY0", 1)])
+    assert roundplan.prewarm_demands(forecast, demands, nodearrays, vcpu_counts, prewarmed) == [GroupDemand("array0", "array0", 1, 0)]
+    prewarmed = commonutil.CIDict([("array0", 5)])
+    assert roundplan.prewarm_demands(forecast, [], nodearrays, vcpu_counts, prewarmed) == []
+
+
+def test_plan_prewarms_the_forecast(tmp_path: Any) -> None:
+    plan = plan_with_forecast(tmp_path, ready_cluster(4, 0), {"array0": GrowDecision(0.0, 3.0, 0.0)})
+    assert len(plan.prewarm_nodes) == 3
+    assert plan.new_node_count == 3
+
+
+def test_plan_counts_the_running_prewarmed_nodes(tmp_path: Any) -> None:
+    # the ready pre-warmed nodes meet the forecast, no node is started again every round
+    plan = plan_with_forecast(tmp_path, ready_cluster(5, 3), {"array0": GrowDecision(0.0, 3.0, 0.0)})
+    assert plan.prewarm_nodes == []
+    assert plan.new_node_count == 0
+    plan = plan_with_forecast(tmp_path, ready_cluster(5, 1), {"array0": GrowDecision(0.0, 3.0, 0.0)})
+    assert len(plan.prewarm_nodes) == 2
+
+
+def test_plan_prewarm_cap(tmp_path: Any) -> None:
+    plan = plan_with_forecast(tmp_path, ready_cluster(5, 2), {"array0": GrowDecision(0.0, 8.0, 0.0)}, max_nodes=4)
+    assert len(plan.prewarm_nodes) == 2
+
+
+def test_plan_round_changes_nothing(tmp_path: Any) -> None:
+    cluster = ready_cluster(4, 0)
+    cluster.idle_node_names = commonutil.CISet(["ccw-array0-1", "ccw-array0-2"])
+    inputs = round_inputs(tmp_path, cluster, {})
+    inputs.grow_decisions = {"array1": GrowDecision(0.0, 2.0, 0.0)}
+    config = {"autoscale": {"standby": {"array0": 3}}}
+    allocation = roundplan.allocate_round(config, inputs)
+    idle_check = roundplan.check_idle(allocation.idle_check_candidates(), cluster.new_rest_client().check_nodes_idle)
+    closed = [n.closed for n in inputs.cc_nodes]
+    new_nodes = list(inputs.node_mgr.new_nodes)
+
+    plan = roundplan.plan_round(config, inputs, allocation, idle_check)
+    again = roundplan.plan_round(config, inputs, allocation, idle_check)
+    assert plan.to_dict() == again.to_dict()
+    assert [n.closed for n in inputs.cc_nodes] == closed and inputs.node_mgr.new_nodes == new_nodes
+    assert plan.new_node_count == 2 and plan.counts["idle_nodes"] == 2
+    # the third node is busy, the idle ones are in the pool: one more is started when the plan is applied
+    assert plan.standby_starts == {"array0": 1}
+
+
+def test_plan_tops_the_standby_pool_up_without_shrink_check(tmp_path: Any) -> None:
+    cluster = ready_cluster(1, 0)
+    inputs = round_inputs(tmp_path, cluster, {})
+    # the default groups are hungry, the scale down is not checked
+    inputs.grow_decisions = {"Default": GrowDecision(0.0, 4.0, 0.0)}
+    plan = make_plan({"autoscale": {"standby": {"array0": 3}}}, inputs, cluster)
+    assert "candidates" not in plan.counts and plan.skipped == {}
+    # the ready node is counted in the pool, the nodes allocated for the default groups are not
+    assert plan.counts["standby_nodes"] == 1
+    assert plan.standby_starts == {"array0": 2}
+
+
+def shut_down_plan() -> Any:
+    plan = roundplan.Plan()
+    plan.nodes_to_shut_down = ["cc-0", "cc-1", "cc-2"]
+    plan.nodes_to_take_offline = ["CCW-ARRAY0-1", "CCW-ARRAY0-2", "CCW-ARRAY0-3"]
+    plan.offline_cc_ids = {"CCW-ARRAY0-1": "cc-0", "CCW-ARRAY0-2": "cc-1", "CCW-ARRAY0-3": "cc-2"}
+    return plan
+
+
+def test_recheck_idle(tmp_path: Any) -> None:
+    cluster = ready_cluster(4, 0)
+    # the third node got a job since the plan was made
+    cluster.idle_node_names = commonutil.CISet(["ccw-array0-1", "ccw-array0-2", "ccw-array0-4"])
+    plan = shut_down_plan()
+    kept = roundplan.recheck_idle(plan, round_inputs(tmp_path, cluster, {}), cluster.new_rest_client().check_nodes_idle)
+    assert kept == ["cc-2"]
+    assert plan.nodes_to_shut_down == ["cc-0", "cc-1"]
+    assert plan.nodes_to_take_offline == ["CCW-ARRAY0-1", "CCW-ARRAY0-2"]
+    assert plan.offline_cc_ids == {"CCW-ARRAY0-1": "cc-0", "CCW-ARRAY0-2": "cc-1"}
+    assert plan.idle_from == {"cc-2": None}
+
+
+def test_recheck_idle_skipped(tmp_path: Any) -> None:
+    cluster = ready_cluster(4, 0)
+    plan = shut_down_plan()
+    kept = roundplan.recheck_idle(plan, round_inputs(tmp_path, cluster, {}), cluster.new_rest_client().check_nodes_idle,
+                                  idle_check_skip_reason="the head node is degraded")
+    assert kept == ["cc-0", "cc-1", "cc-2"]
+    assert plan.nodes_to_shut_down == [] and plan.nodes_to_take_offline == [] and plan.offline_cc_ids == {}
+    assert plan.skipped == {"idle_check": "the head node is degraded"}
@@ -0,0 +1,119 @@
+import importlib
+import json
+from datetime import datetime, timedelta
+from typing import Any
+
+statestore = importlib.import_module("cyclecloud-hpcpack.statestore")
+
+
+def test_load_missing(tmp_path: Any) -> None:
+    store = statestore.JournaledStateStore(str(tmp_path / "state.txt"))
+    assert store.load() is None
+    assert store.needs_compaction
+
+
+def test_commit_and_replay(tmp_path: Any) -> None:
+    snapshot_file = str(tmp_path / "state.txt")
+    store = statestore.JournaledStateStore(snapshot_file)
+    updated = datetime(2024, 1, 1, 12, 0, 0)
+    store.compact(updated, {"a": ["a", 1], "b": ["b", 2]})
+    store.commit(updated + timedelta(minutes=1), [["a", 3], ["c", 4]], ["b"])
+    store.commit(updated + timedelta(minutes=2), [], [])
+    assert not store.needs_compaction
+
+    loaded = statestore.JournaledStateStore(snapshot_file).load()
+    assert loaded is not None
+    assert loaded[0] == updated + timedelta(minutes=2)
+    assert loaded[1] == {"a": ["a", 3], "c": ["c", 4]}
+
+
+def test_compaction_is_due(tmp_path: Any) -> None:
+    store = statestore.JournaledStateStore(str(tmp_path / "state.txt"), compact_every=2)
+    updated = datetime(2024, 1, 1)
+    store.compact(updated, {})
+    store.commit(updated, [["a", 1]], [])
+    assert not store.needs_compaction
+    store.commit(updated, [["b", 1]], [])
+    assert store.needs_compaction
+    store.compact(updated, {"a": ["a", 1], "b": ["b", 1]})
+    assert not store.needs_compaction
+    with open(str(tmp_path / "state.txt.journal")) as jf:
+        assert jf.read() == ""
+
+
+def test_torn_journal_tail(tmp_path: Any) -> None:
+    snapshot_file = str(tmp_path / "state.txt")
+    store = statestore.JournaledStateStore(snapshot_file)
+    updated = datetime(2024, 1, 1)
+    store.compact(updated, {"a": ["a", 1]})
+    store.commit(updated, [["b", 2]], [])
+    store.commit(updated, [["c", 3]], [])
+    journal_file = snapshot_file + ".journal"
+    with open(journal_file, "rb") as jf:
+        content = jf.read()
+    # a crash in the middle of the last record
+    with open(journal_file, "wb") as jf:
+        jf.write(content[:-5])
+
+    loaded = statestore.JournaledStateStore(snapshot_file).load()
+    assert loaded is not None and loaded[1] == {"a": ["a", 1], "b": ["b", 2]}
+    with open(journal_file, "rb") as jf:
+        assert jf.read() == content[:content.index(b"\n") + 1]
+
+    # a record with a bad checksum
+    with open(journal_file, "ab") as jf:
+        jf.write(b"00000000 " + json.dumps({"seq": 2, "updated": 0, "upserts": [["d", 4]]}).encode() + b"\n")
+    loaded = statestore.JournaledStateStore(snapshot_file).load()
+    assert loaded is not None and "d" not in loaded[1]
+
+
+def test_journal_of_an_older_snapshot(tmp_path: Any) -> None:
+    # the process died after the new snapshot replaced the old one, before the journal was truncated
+    snapshot_file = str(tmp_path / "state.txt")
+    store = statestore.JournaledStateStore(snapshot_file)
+    updated = datetime(2024, 1, 1)
+    store.compact(updated, {})
+    store.commit(updated, [["a", 1]], [])
+    with open(snapshot_file + ".journal") as jf:
+        journal = jf.read()
+    store.compact(updated, {"a": ["a", 2]})
+    with open(snapshot_file + ".journal", "w") as jf:
+        jf.write(journal)
+
+    loaded = statestore.JournaledStateStore(snapshot_file).load()
+    assert loaded is not None and loaded[1] == {"a": ["a", 2]}
+
+
+def test_unsupported_snapshot(tmp_path: Any) -> None:
+    snapshot_file = str(tmp_path / "state.txt")
+    with open(snapshot_file, "w") as sf:
+        json.dump({"format": statestore.JournaledStateStore.FORMAT, "version": 1, "seq": 0, "updated": 0, "items": []}, sf)
+    assert statestore.JournaledStateStore(snapshot_file).load() is None
+    with open(snapshot_file, "w") as sf:
+        sf.write('{"py/object": "legacy"')
+    assert statestore.JournaledStateStore(snapshot_file).load() is None
+
+
+def test_commit_after_another_process(tmp_path: Any) -> None:
+    snapshot_file = str(tmp_path / "state.txt")
+    updated = datetime(2024, 1, 1)
+    daemon = statestore.JournaledStateStore(snapshot_file)
+    daemon.compact(updated, {"a": ["a", 1]})
+    assert not daemon.changed_on_disk
+    other = statestore.JournaledStateStore(snapshot_file)
+    other.load()
+    other.commit(updated, [["b", 2]], [])
+    other.commit(updated, [["c", 3]], [])
+    assert daemon.changed_on_disk
+    # the commit continues after the records of the other process instead of reusing their seq
+    daemon.commit(updated, [["a", 4]], [])
+    assert not daemon.changed_on_disk
+    loaded = statestore.JournaledStateStore(snapshot_file).load()
+    assert loaded is not None and loaded[1] == {"a": ["a", 4], "b": ["b", 2], "c": ["c", 3]}
+
+    # a snapshot compacted by the other process
+    other.load()
+    other.compact(updated, {"d": ["d", 5]})
+    daemon.commit(updated, [["e", 6]], [])
+    loaded = statestore.JournaledStateStore(snapshot_file).load()
+    assert loaded is not None and loaded[1] == {"d": ["d", 5], "e": ["e", 6]}
@@ -0,0 +1,221 @@
+import importlib
+import os
+import tempfile
+from datetime import datetime, timedelta
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+from hypothesis import example, given, settings
+from hypothesis import strategies as st
+
+commonutil = importlib.import_module("cyclecloud-hpcpack.commonutil")
+hpcnodehistory = importlib.import_module("cyclecloud-hpcpack.hpcnodehistory")
+hpcpackdriver = importlib.import_module("cyclecloud-hpcpack.hpcpackdriver")
+
+NodeHistoryItem = hpcnodehistory.NodeHistoryItem
+ci_equals = commonutil.ci_equals
+
+PROVISIONING_TIMEOUT = 1500
+IDLE_TIMEOUT = 900
+HOSTNAMES = ["ccw-array0-{}".format(i) for i in range(1, 9)]
+
+DelayedNodeId = NamedTuple("DelayedNodeId", [("node_id", str)])
+
+
+class CCNode:
+    # the attributes of a CycleCloud node synchronize reads and sets
+    def __init__(self, node_id: str, hostname: str, target_state: str) -> None:
+        self.delayed_node_id = DelayedNodeId(node_id)
+        self.hostname = hostname
+        self.target_state = target_state
+        self.create_time_unix = 0.0
+        self.create_time_remaining = 0.0
+        self.idle_time_remaining = 0.0
+
+
+def ci_find_one(source: Any, target_value: str, target_func: Any) -> Any:
+    for i in source:
+        if ci_equals(target_value, target_func(i)):
+            return i
+    return None
+
+
+def ci_in(a: Optional[str], b: Any) -> bool:
+    return any(ci_equals(a, c) for c in b)
+
+
+class BaselineHistory:
+    """
+    HpcNodeHistory.synchronize before it was rewritten as hash joins, over a list of items: the
+    lookups by hpc_id and hostname are linear scans with ci_find_one and ci_in.
+    """
+    def __init__(self, items: List[Any]) -> None:
+        self.items = items
+        self.items_to_archive: List[Any] = []
+
+    def synchronize(self, cc_nodes: List[Any], hpc_nodes: List[Any]) -> None:
+        nhi_by_cc_id = {n.cc_id: n for n in self.items}
+        now = datetime.utcnow()
+        for cc_node in cc_nodes:
+            nhi = nhi_by_cc_id.get(cc_node.delayed_node_id.node_id)
+            if nhi is None:
+                nhi = NodeHistoryItem(cc_node.delayed_node_id.node_id, cc_node.hostname)
+                self.items.append(nhi)
+                nhi_by_cc_id[nhi.cc_id] = nhi
+            else:
+                if not nhi.hostname:
+                    nhi.hostname = cc_node.hostname
+                elif not ci_equals(nhi.hostname, cc_node.hostname):
+                    if nhi.hpc_id:
+                        hpc_node = ci_find_one(hpc_nodes, nhi.hpc_id, target_func=lambda n: n.id)
+                        if hpc_node is not None:
+                            hpc_node.cc_node_id = nhi.cc_id
+                    self.items.remove(nhi)
+                    self.items_to_archive.append(nhi)
+                    nhi = NodeHistoryItem(cc_node.delayed_node_id.node_id, cc_node.hostname, nhi.emerge_time)
+                    self.items.append(nhi)
+                    nhi_by_cc_id[nhi.cc_id] = nhi
+            if ci_equals(cc_node.target_state, "Deallocated") or ci_equals(cc_node.target_state, "Terminated"):
+                cc_node.create_time_remaining = PROVISIONING_TIMEOUT
+                cc_node.idle_time_remaining = IDLE_TIMEOUT
+                if not nhi.stopped:
+                    nhi.stop_time = now
+            else:
+                if nhi.stopped:
+                    nhi.restart()
+                cc_node.create_time_unix = nhi.start_time.timestamp()
+                cc_node.create_time_remaining = max(0, PROVISIONING_TIMEOUT + cc_node.create_time_unix - now.timestamp())
+                if nhi.idle_from is None:
+                    cc_node.idle_time_remaining = IDLE_TIMEOUT
+                else:
+                    cc_node.idle_time_remaining = max(0, IDLE_TIMEOUT + nhi.idle_from.timestamp() - now.timestamp())
+
+        cc_node_by_id = {n.delayed_node_id.node_id: n for n in cc_nodes}
+        nhi_by_hpc_id = {nhi.hpc_id: nhi for nhi in self.items if nhi.hpc_id}
+        for hpc_node in hpc_nodes:
+            if hpc_node.is_cc_node:
+                continue
+            nhi = nhi_by_hpc_id.pop(hpc_node.id, None)
+            if nhi is not None:
+                hpc_node.cc_node_id = nhi.cc_id
+                hpc_node.idle_from = nhi.idle_from
+                hpc_node.bound_cc_node = cc_node_by_id.get(nhi.cc_id)
+
+        for nhi in nhi_by_hpc_id.values():
+            if ci_in(nhi.cc_id, cc_node_by_id):
+                nhi.reset_hpc_id()
+
+        hpc_node_to_bound = [n for n in hpc_nodes if not n.is_cc_node]
+        nhi_to_bound_with_hpc = [nhi for nhi in self.items if nhi.hostname and not nhi.hpc_id]
+        if len(hpc_node_to_bound) > 0 and len(nhi_to_bound_with_hpc) > 0:
+            candidate_nhi = [nhi for nhi in nhi_to_bound_with_hpc if ci_in(nhi.cc_id, cc_node_by_id)]
+            candidate_nhi.extend([nhi for nhi in nhi_to_bound_with_hpc if not ci_in(nhi.cc_id, cc_node_by_id)])
+            for hpc_node in hpc_node_to_bound:
+                match_nhi = ci_find_one(candidate_nhi, hpc_node.name, target_func=lambda n: n.hostname)
+                if match_nhi:
+                    match_nhi.reset_hpc_id(hpc_node.id)
+                    hpc_node.cc_node_id = match_nhi.cc_id
+                    hpc_node.bound_cc_node = cc_node_by_id.get(match_nhi.cc_id)
+
+        hpc_ids = [hpc_node.id for hpc_node in hpc_nodes]
+        self.items_to_archive.extend([nhi for nhi in self.items if not ci_in(nhi.cc_id, cc_node_by_id) and not ci_in(nhi.hpc_id, hpc_ids)])
+        self.items[:] = [nhi for nhi in self.items if ci_in(nhi.cc_id, cc_node_by_id) or ci_in(nhi.hpc_id, hpc_ids)]
+
+
+# (cc_id, hostname, target_state)
+cc_node_specs = st.lists(
+    st.tuples(st.sampled_from(HOSTNAMES), st.sampled_from(["Started", "Started", "Deallocated", "Terminated"])),
+    max_size=len(HOSTNAMES), unique_by=lambda s: s[0]
+).map(lambda specs: [("cc-{}".format(i), hostname, state) for i, (hostname, state) in enumerate(specs)])
+
+# (hostname, hpc index or None, idle seconds or None, stopped seconds ago or None, started seconds ago)
+history_specs = st.lists(st.tuples(
+    st.one_of(st.none(), st.sampled_from(HOSTNAMES)),
+    st.one_of(st.none(), st.integers(0, 11)),
+    st.one_of(st.none(), st.sampled_from([60, 1200])),
+    st.one_of(st.none(), st.sampled_from([60, 86400])),
+    st.sampled_from([300, 3600]),
+), max_size=12)
+
+# (hpc index, hostname in upper or lower case)
+hpc_node_specs = st.lists(
+    st.tuples(st.integers(0, 11), st.sampled_from(HOSTNAMES), st.booleans()),
+    max_size=len(HOSTNAMES), unique_by=(lambda s: s[0], lambda s: s[1]))
+
+
+def history_records(cc_specs: List[Tuple[str, str, str]], specs: List[Tuple[Any, ...]]) -> List[List[Any]]:
+    # the first items are those of the CC nodes, the others of the nodes removed from CycleCloud
+    now = datetime.utcnow()
+    records: List[List[Any]] = []
+    hpc_indexes = set()
+    for i, (hostname, hpc_index, idle, stopped, started) in enumerate(specs):
+        cc_id = cc_specs[i][0] if i < len(cc_specs) else "gone-{}".format(i)
+        # the hpc_id of an item is unique, as bound by synchronize
+        hpc_id = None
+        if hpc_index is not None and hpc_index not in hpc_indexes:
+            hpc_indexes.add(hpc_index)
+            hpc_id = "hpc-{}".format(hpc_index)
+        records.append([cc_id, hostname, hpc_id, now - timedelta(days=1), now - timedelta(seconds=started),
+                        now - timedelta(seconds=idle) if idle else None, now - timedelta(seconds=stopped) if stopped else None])
+    return records
+
+
+def new_item(record: List[Any]) -> Any:
+    cc_id, hostname, hpc_id, emerge_time, start_time, idle_from, stop_time = record
+    item = NodeHistoryItem(cc_id, hostname, emerge_time)
+    item.hpc_id = hpc_id
+    item.start_time = start_time
+    item.idle_from = idle_from
+    item.stop_time = stop_time
+    return item
+
+
+def new_nodes(cc_specs: List[Tuple[str, str, str]], hpc_specs: List[Tuple[int, str, bool]]) -> Tuple[List[Any], List[Any]]:
+    cc_nodes = [CCNode(cc_id, hostname, target_state) for cc_id, hostname, target_state in cc_specs]
+    hpc_nodes = [hpcpackdriver.HpcNode("hpc-{}".format(index), hostname.upper() if upper else hostname, "OK", "Online",
+                                       ["ComputeNodes", "CycleCloudNodes", "array0"], "Default ComputeNode Template")
+                 for index, hostname, upper in hpc_specs]
+    return cc_nodes, hpc_nodes
+
+
+def node_results(cc_nodes: List[Any], hpc_nodes: List[Any]) -> Tuple[List[Any], List[Any]]:
+    cc_results = [(n.delayed_node_id.node_id, round(n.create_time_remaining), round(n.idle_time_remaining)) for n in cc_nodes]
+    hpc_results = [(n.id, n.cc_node_id, n.bound_cc_node.delayed_node_id.node_id if n.bound_cc_node else None, n.idle_from) for n in hpc_nodes]
+    return cc_results, hpc_results
+
+
+def item_results(items: List[Any]) -> List[Any]:
+    return sorted((i.cc_id, i.hostname or "", i.hpc_id or "", i.stopped, i.idle_from or datetime.min) for i in items)
+
+
+def archive_results(items: List[Any]) -> List[str]:
+    return sorted("cc_id={}, hostname={}, hpc_id={}".format(i.cc_id, i.hostname, i.hpc_id) for i in items)
+
+
+@settings(max_examples=300, deadline=None)
+@given(cc_node_specs, history_specs, hpc_node_specs)
+# the CC node got a new hostname: its item is archived and the HPC node of the old hostname is not bound again
+@example([("cc-0", HOSTNAMES[1], "Started")], [(HOSTNAMES[0], 0, 60, None, 3600)], [(0, HOSTNAMES[0], True), (1, HOSTNAMES[1], True)])
+def test_synchronize_parity(cc_specs: List[Tuple[str, str, str]], specs: List[Tuple[Any, ...]], hpc_specs: List[Tuple[int, str, bool]]) -> None:
+    records = history_records(cc_specs, specs)
+
+    baseline = BaselineHistory([new_item(r) for r in records])
+    baseline_cc_nodes, baseline_hpc_nodes = new_nodes(cc_specs, hpc_specs)
+    baseline.synchronize(baseline_cc_nodes, baseline_hpc_nodes)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        archivefile = os.path.join(work_dir, "archive.txt")
+        history = hpcnodehistory.HpcNodeHistory(os.path.join(work_dir, "state.txt"), archivefile,
+                                                provisioning_timeout=PROVISIONING_TIMEOUT, idle_timeout=IDLE_TIMEOUT)
+        for r in records:
+            history.insert(new_item(r))
+        cc_nodes, hpc_nodes = new_nodes(cc_specs, hpc_specs)
+        history.synchronize(cc_nodes, hpc_nodes)
+        history.save()
+        archived: List[str] = []
+        if os.path.exists(archivefile):
+            with open(archivefile) as af:
+                archived = sorted(line[:line.index(", emerge_time=")] for line in af if line.strip())
+
+    assert node_results(cc_nodes, hpc_nodes) == node_results(baseline_cc_nodes, baseline_hpc_nodes)
+    assert item_results(history.items) == item_results(baseline.items)
+    assert archived == archive_results(baseline.items_to_archive)
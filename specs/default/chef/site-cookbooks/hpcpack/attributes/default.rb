@@ -3,6 +3,8 @@ default['hpcpack']['hn']['hostname'] = nil
 
 # HPC Pack Autoscaling configuration
 default['hpcpack']['autoscaler']['package'] = "cyclecloud-hpcpack-pkg-2.1.2.zip"
+# Run the autoscaler as a long-running daemon instead of a per-minute scheduled task
+default['hpcpack']['autoscaler']['daemon'] = false
 
 # HPC Pack Configuration options
 default['hpcpack']['config']['HeartbeatInterval'] = 30
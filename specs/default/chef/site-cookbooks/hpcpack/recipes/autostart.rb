@@ -86,4 +86,21 @@ windows_task 'cyclecloud-hpc-autoscaler' do
     frequency :minute
     frequency_modifier 1
     only_if { node['cyclecloud']['cluster']['autoscale']['start_enabled'] }
+    not_if { node['hpcpack']['autoscaler']['daemon'] }
+end
+
+# Daemon mode: one long-running autoscaler process, rounds are scheduled in-process.
+# The task fires every minute: the Task Scheduler ignores the trigger while the daemon runs
+# (the default IgnoreNew instance policy) and starts it again once it died.
+windows_task 'cyclecloud-hpc-autoscaler-daemon' do
+    task_name "Cyclecloud-HPC-Autoscaler-Daemon"
+    command   "powershell.exe -file #{autoscaler_bin_dir}\\azhpcpack.ps1 daemon --config-path #{config_dir}\\autoscale.json"
+    user      "#{node['hpcpack']['ad']['domain']}\\#{node['hpcpack']['ad']['admin']['name']}"
+    password  node['hpcpack']['ad']['admin']['password']
+    frequency :minute
+    frequency_modifier 1
+    # no time limit, the Task Scheduler stops a task after 72 hours by default
+    execution_time_limit "PT0S"
+    action    [:create, :run]
+    only_if { node['cyclecloud']['cluster']['autoscale']['start_enabled'] && node['hpcpack']['autoscaler']['daemon'] }
 end